@@ -0,0 +1,33 @@
+#%%
+#1. IMPORTING NECESSARY MODULES AND LOADING THE SAMPLE DATA
+import os
+import db_benchmark
+import pandas as pd
+
+df = pd.read_csv('customer_data.csv')
+standin_file = 'customer_activity_benchmark.db' # Local SQLite copy standing in for the RDS database
+
+#%%
+#2. BENCHMARKING PARALLEL EXTRACTION
+engine = db_benchmark.create_sqlite_standin(standin_file, df, copies=20)
+extraction_df = db_benchmark.extraction_benchmark(engine, 'customer_activity', 'session_id', workers=[2, 4, 8])
+print(extraction_df)
+
+#%%
+#3. BENCHMARKING SKEWNESS TRANSFORMATIONS
+transform_df = pd.concat([df.dropna()] * 20, ignore_index=True)
+transform_results_df = db_benchmark.transform_benchmark(transform_df,
+                                                        ['administrative_duration', 'informational_duration', 'page_values'],
+                                                        {'product_related_duration': 0.01, 'exit_rates': 1e-10})
+print(transform_results_df)
+
+#%%
+#4. BENCHMARKING LOADING, CLEANING, PROFILING AND AGGREGATION ON GENERATED DATA
+results_file = 'benchmark_results.json'
+baseline_file = 'benchmark_baseline.json' # Results of an earlier run to compare with, e.g. a copy of results_file from the last nightly job
+suite = db_benchmark.run_suite(df, sizes=[10000, 1000000, 100000000], work_dir='benchmark_data') # 100M rows are streamed, not held in memory
+db_benchmark.save_results(suite, results_file)
+print(db_benchmark.load_results(results_file))
+if os.path.exists(baseline_file):
+    comparison_df = db_benchmark.compare_results(baseline_file, results_file)
+    print(comparison_df[comparison_df['regression']]) # Cases more than 10% slower, or using more than 10% more memory, than the baseline
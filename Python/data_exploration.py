@@ -4,12 +4,15 @@ import db_utils
 import db_cleaning
 
 
+report_dir = None # Folder to save the figures to as images (headless, rendered in parallel) instead of showing them
+n_workers = 4 # Processes rendering the figures when report_dir is set
+
 db_extract = db_utils.RDSDatabaseConnector()
-db_info = db_utils.DataFrameInfo()
+db_info = db_utils.DataFrameInfo(report_dir)
 db_clean = db_cleaning.DataFrameTransform()
-db_plotter = db_utils.Plotter()
+db_plotter = db_utils.Plotter(report_dir)
+db_report = db_utils.ReportRenderer(report_dir, n_workers)
 engine = db_extract.init_db_engine()
-conn = engine.connect()
 df = db_extract.read_rds_data(engine, 'customer_activity')
 db_extract.df_to_csv(df, 'customer_data.csv')
 numeric_features = ['administrative',
@@ -24,50 +27,47 @@ numeric_features = ['administrative',
 categorical_features = [col for col in df.columns if col not in numeric_features]
 # %%
 #2. EXPLORING THE DATA
-db_info.display_info(df)
-db_info.summary_statistics(df)
-db_info.null_summary(df)
-for column in categorical_features:
-    db_info.explore_categorical_variable(df,column)
-for column in numeric_features:
-    db_info.explore_continuous_variable(df,column)
-db_info.visualise_missing_data(df)
-db_plotter.corr_matrix(df)
-db_plotter.corr_scatter(df,numeric_features)
+profile = db_info.profile(df) # Every column statistic below, computed in one pass over each column
+db_info.display_info(profile)
+db_info.summary_statistics(profile)
+db_info.null_summary(profile)
+exploration_plots = ([('info', 'explore_categorical_variable', (column,)) for column in categorical_features]
+                     + [('info', 'explore_continuous_variable', (column,)) for column in numeric_features]
+                     + [('info', 'visualise_missing_data', ()),
+                        ('plotter', 'corr_matrix', ()),
+                        ('plotter', 'corr_scatter', (numeric_features,))])
+db_report.render(df, exploration_plots, 'exploration')
 
 #%%
 #3. VISUALISING OUTLIERS
-# Admin duration and admin are fine
-db_plotter.scatterplot(df,'administrative', 'administrative_duration')
-db_plotter.var_distribution(df, 'administrative_duration')
-# Info and info_duration are fine
-db_plotter.scatterplot(df,'informational', 'informational_duration')
-db_plotter.var_distribution(df, 'informational_duration')
-# Product_related_duration has outliers  over values of 20k
-db_plotter.scatterplot(df,'product_related', 'product_related_duration')
-db_plotter.var_distribution(df, 'product_related_duration')
-# Bounce rates and exit rates are fine (except potentially 2 data points borderline)
-db_plotter.scatterplot(df,'bounce_rates', 'exit_rates')
-# Page values are fine
-db_plotter.var_distribution(df, 'page_values')
-db_plotter.scatterplot(df,'page_values', 'bounce_rates')
+outlier_plots = [('plotter', 'scatterplot', ('administrative', 'administrative_duration')), # Admin duration and admin are fine
+                 ('plotter', 'var_distribution', ('administrative_duration',)),
+                 ('plotter', 'scatterplot', ('informational', 'informational_duration')), # Info and info_duration are fine
+                 ('plotter', 'var_distribution', ('informational_duration',)),
+                 ('plotter', 'scatterplot', ('product_related', 'product_related_duration')), # Product_related_duration has outliers  over values of 20k
+                 ('plotter', 'var_distribution', ('product_related_duration',)),
+                 ('plotter', 'scatterplot', ('bounce_rates', 'exit_rates')), # Bounce rates and exit rates are fine (except potentially 2 data points borderline)
+                 ('plotter', 'var_distribution', ('page_values',)), # Page values are fine
+                 ('plotter', 'scatterplot', ('page_values', 'bounce_rates'))]
+db_report.render(df, outlier_plots, 'outliers')
 
 #%%
 #4. CHECKING AND CLEANING FOR SKEWNESS
 db_plotter.vars_distribution(df, numeric_features)
 for var in numeric_features:
-    print(f' Skewness for {var} = {df[var].skew().round(1)}')
+    print(f' Skewness for {var} = {round(profile.statistics.loc[var, "skew"], 1)}')
     print('')
 ## Solving for skewness of all variables excluding more categorical variables - admin, info, product_related
 ## Analysing each variable
 for var in numeric_features:
-    db_info.var_skewness(df, var)
-    df[var].describe()
-    db_plotter.var_distribution(df, var)
-    db_plotter.qqplot(df, var)
+    db_info.var_skewness(profile, var)
+    profile.describe()[var]
+db_report.render(df, [('plotter', method, (var,)) for var in numeric_features for method in ['var_distribution', 'qqplot']], 'skewness')
 
 #%%
 #5. CHECKING AND CLEANING FOR COLLINEARITY
-db_plotter.corr_matrix(df)
-print(df['bounce_rates'].corr(df['exit_rates']))
-print(df['product_related'].corr(df['product_related_duration']))
\ No newline at end of file
+correlations = db_plotter.correlations(df) # Sums and cross-products of the numerical variables, accumulated once
+db_plotter.corr_matrix(correlations=correlations)
+corr = correlations.correlation()
+print(corr.loc['bounce_rates', 'exit_rates'])
+print(corr.loc['product_related', 'product_related_duration'])
\ No newline at end of file
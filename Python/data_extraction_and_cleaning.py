@@ -2,151 +2,46 @@
 #1. IMPORTING NECESSARY MODULES AND CREATING CLASS INSTANCES
 import db_utils
 import db_cleaning
+import db_storage
+import db_analysis
 import pandas as pd
+from typing import Union
 
 db_extract = db_utils.RDSDatabaseConnector()
 db_info = db_utils.DataFrameInfo()
 db_clean = db_cleaning.DataFrameTransform()
 db_plotter = db_utils.Plotter()
+db_store = db_storage.get_store('parquet')
+db_cube = db_analysis.AggregateCube()
 engine = db_extract.init_db_engine()
-conn = engine.connect()
+chunksize = 50000 # Rows streamed from the database at a time
+out_of_core = False # Set to True when customer_activity does not fit in memory
+n_workers = 1 # Processes cleaning each chunk when out_of_core is True
+select_transformations = False # Set to True to choose the skewness transformations and collinear columns from the data (kept in the saved params) instead of the lists below
 
-#2. CREATING FUNCTIONS FOR CLEANING - TO BE USED BELOW
-def null_cleaning(df: pd.DataFrame) -> pd.DataFrame:
-    '''
-    Imputes or drops null values across columns, and cleans format and other errors
-
-    Inputs:
-        Dataframe
-    
-    Returns:
-        Dataframe without nulls
-    '''
-    # Imputations for more categorical variables (stored as floats though)
-    for column in ['administrative','product_related']:
-        df = db_clean.impute_categorical(df, column)
-    ## Imputations for purely numeric variables
-    var_pairs = [['administrative','administrative_duration'],
-                ['informational','informational_duration'],
-                ['product_related','product_related_duration']]
-    for vars in var_pairs:
-        df = db_clean.impute_numerical(df,vars[0],vars[1])
-    ## Removing null for some of the other variables
-    df = db_clean.drop_null(df,'operating_systems')
-    df = db_clean.drop_null(df, 'product_related_duration') # Dropping one row for which the impute method did not work
-    ## Cleaning datatype format
-    df = db_clean.format_cleaning(df)
-    df = db_clean.region_cleaning(df)
-    print('Dataframe after null cleaning')
-    print(df.info())
-    return df
+#2. DEFINING THE CLEANING STEPS - TO BE RUN AS ONE PIPELINE BELOW
+## Steps are listed in db_cleaning: NULL_STEPS (imputing or dropping null values, and cleaning format and other errors),
+## OUTLIER_STEPS, SKEWNESS_STEPS (transforming skewed variables), COLLINEARITY_STEPS and the ordering of COLUMN_ORDER
+skewness_steps = db_cleaning.SKEWNESS_STEPS
+collinearity_steps = db_cleaning.COLLINEARITY_STEPS
+cleaning_pipeline = db_cleaning.CleaningPipeline(db_cleaning.cleaning_steps(), db_clean)
 
-def outlier_cleaning(df: pd.DataFrame) -> pd.DataFrame:
+def skewness_pre_post(df: Union[pd.DataFrame, db_utils.DataFrameProfile]) -> None:
     '''
-    Cleans all outlier values
-
-    Inputs:
-        Dataframe
+    Summarises skewness of original and transformed variable (for the variables kept after cleaning)
     
-    Returns:
-        Dataframe removing outliers
-    '''
-    cond = (df['product_related_duration'] < 20000)
-    df = db_clean.product_related_outliers_transformation(df,cond)
-    print('Dataframe after outlier cleaning')
-    print(df.info())
-    return df
-
-def skewness_cleaning(df: pd.DataFrame) -> pd.DataFrame:
-    '''
-    Transforms skewed variables
-
     Inputs:
-        Dataframe
-    
-    Returns:
-        Dataframe with transformed variables
-    ''' 
-    ## Transforming variables
-    df = df
-    db_clean.skewness_log_transformation(df, 'administrative_duration','transformed_administrative_duration')
-    db_clean.skewness_log_transformation(df, 'informational_duration', 'transformed_informational_duration')
-    db_clean.skewness_boxcox_transformation(df, 'product_related_duration', 'transformed_product_related_duration', 0.01)
-    db_clean.skewness_boxcox_transformation(df, 'bounce_rates', 'transformed_bounce_rates', 1e-10)
-    db_clean.skewness_boxcox_transformation(df, 'exit_rates','transformed_exit_rates', 1e-10)
-    db_clean.skewness_log_transformation(df, 'page_values','transformed_page_values')
-    return df
-
-def skewness_pre_post(df: pd.DataFrame) -> None:
-    '''
-    Summarises skewness of original and transformed variable
-    
-    Inputs:
-        Dataframe
+        Dataframe or its profile
     
     Returns:
         None
     ''' 
-    var_list_pairs = [['administrative_duration','transformed_administrative_duration'],
-                    ['informational_duration','transformed_informational_duration' ],
-                    ['product_related_duration','transformed_product_related_duration' ],
-                    ['bounce_rates','transformed_bounce_rates'],
-                    ['exit_rates','transformed_exit_rates'],
-                    ['page_values','transformed_page_values'] ]
-    for var in var_list_pairs:
-        db_info.compare_skewness(df, var[0], var[1])
-
-def collinearity_cleaning(df: pd.DataFrame) -> pd.DataFrame:
-    '''
-    Cleans collinear variables
-
-    Inputs:
-        Dataframe
-    
-    Returns:
-        Dataframe cleaned for collinearity
-    ''' 
-    df.drop(['bounce_rates', 'transformed_bounce_rates'], axis = 1, inplace=True)
-    return df
-
-def ordering_columns(df: pd.DataFrame) -> pd.DataFrame:
-    '''
-    Orders dataframe columns consistently
-
-    Inputs:
-        Dataframe
-    
-    Returns:
-        Dataframe with columns in desired order
-    ''' 
-    desired_order =['administrative', 
-                'administrative_duration', 
-                'transformed_administrative_duration',
-                'informational', 
-                'informational_duration', 
-                'transformed_informational_duration', 
-                'product_related', 
-                'product_related_duration', 
-                'transformed_product_related_duration', 
-                'exit_rates', 
-                'transformed_exit_rates',
-                'page_values', 
-                'transformed_page_values',
-                'month', 
-                'operating_systems', 
-                'browser', 
-                'region', 
-                'traffic_type', 
-                'visitor_type', 
-                'weekend', 
-                'revenue' 
-                ]
-    df = df[desired_order]
-    return df
+    columns = df.statistics.index if isinstance(df, db_utils.DataFrameProfile) else df.columns
+    for name, args in skewness_steps:
+        if args['column1'] in columns and args['column2'] in columns:
+            db_info.compare_skewness(df, args['column1'], args['column2'])
 
 #3. EXTRACTING THE DATA FROM THE DATABASE
-df = db_extract.read_rds_data(engine, 'customer_activity')
-db_extract.df_to_csv(df, '/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/customer_data.csv')
 numeric_features = ['administrative',
                     'administrative_duration',
                     'informational',
@@ -156,13 +51,54 @@ numeric_features = ['administrative',
                     'bounce_rates',
                     'exit_rates',
                     'page_values']
-categorical_features = [col for col in df.columns if col not in numeric_features]
+if not out_of_core:
+    chunks = db_extract.read_rds_data_chunks(engine, 'customer_activity', chunksize)
+    chunks = db_extract.stream_to_csv(chunks, '/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/customer_data.csv')
+    df = db_clean.collect_chunks(chunks, db_cleaning.CATEGORICAL_COLUMNS)
+    categorical_features = [col for col in df.columns if col not in numeric_features]
 
 #4. TRANSFORMING THE DATA
-df = null_cleaning(df) #Dealing with Nulls
-df = outlier_cleaning(df) #Dealing with Outliers
-df = skewness_cleaning(df) #Dealing with Skewness
-skewness_pre_post(df) #See skewness pre and post transformation
-df = collinearity_cleaning(df) #Dealing with Collinearity
-df = ordering_columns(df) #Ordering columns as required
-db_extract.df_to_csv(df,'/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/Cleaned_customer_data')
\ No newline at end of file
+if select_transformations: # Replacing the skewness and collinearity lists with the ones chosen from the null-cleaned data
+    db_selector = db_cleaning.TransformSelector(db_clean)
+    selection_pipeline = db_cleaning.CleaningPipeline(db_cleaning.NULL_STEPS + db_cleaning.OUTLIER_STEPS, db_clean)
+    skewed_features = [args['column1'] for name, args in skewness_steps]
+    if not out_of_core:
+        db_selector.fit(selection_pipeline.run(df.copy()), skewed_features, numeric_features, 'revenue')
+    else:
+        selection_cleaner = db_cleaning.OutOfCoreCleaner(selection_pipeline)
+        selection_cleaner.fit(lambda: db_extract.read_rds_data_chunks(engine, 'customer_activity', chunksize))
+        db_selector.fit(lambda: selection_cleaner.transform(lambda: db_extract.read_rds_data_chunks(engine, 'customer_activity', chunksize)),
+                        skewed_features, numeric_features, 'revenue')
+    skewness_steps = db_selector.skewness_steps()
+    collinearity_steps = db_selector.collinearity_steps()
+    cleaning_pipeline = db_cleaning.CleaningPipeline(db_cleaning.cleaning_steps(skewness_steps, collinearity_steps), db_clean)
+    print('Chosen transformations', db_clean.params['selection'])
+if not out_of_core:
+    df = cleaning_pipeline.run(df) #Dealing with Nulls, Outliers, Skewness and Collinearity, and ordering columns
+    print('Dataframe after cleaning')
+    print(df.info())
+    skewness_pre_post(df) #See skewness pre and post transformation
+    db_extract.df_to_csv(df,'/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/Cleaned_customer_data')
+    db_store.write(df,'/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/Cleaned_customer_data.parquet') # Keeps category and int dtypes for analysis
+    db_extract.df_to_feather(df,'/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/Cleaned_customer_data.arrow') # Memory-mapped by analysis sessions
+    db_cube.build(df, '/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/Cleaned_customer_data.arrow') # Aggregates answering the analysis questions
+else: # Fitting the statistics in passes over the streamed table, then cleaning and saving one chunk at a time
+    read_chunks = lambda: db_extract.read_rds_data_chunks(engine, 'customer_activity', chunksize)
+    db_cleaner = db_cleaning.OutOfCoreCleaner(cleaning_pipeline)
+    db_cleaner.fit(read_chunks)
+    raw_chunks = lambda: db_extract.stream_to_csv(read_chunks(), '/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/customer_data.csv') # Raw csv saved on the last pass
+    db_executor = db_cleaning.PartitionExecutor(n_workers) if n_workers > 1 else None
+    cleaned_chunks = db_extract.stream_to_csv(db_cleaner.transform(raw_chunks, db_executor), '/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/Cleaned_customer_data')
+    cleaned_chunks = db_extract.stream_to_feather(cleaned_chunks, '/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/Cleaned_customer_data.arrow') # Memory-mapped by analysis sessions
+    cleaned_sketches = {} # Mergeable statistics of the cleaned data, as it is never in memory at once
+    for i, chunk in enumerate(cleaned_chunks):
+        db_info.sketch(chunk, cleaned_sketches)
+        if i == 0:
+            db_store.write(chunk,'/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/Cleaned_customer_data.parquet')
+        else:
+            db_store.append(chunk,'/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/Cleaned_customer_data.parquet')
+        db_cube.update(chunk)
+    db_cube.set_source('/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/Cleaned_customer_data.arrow') # The file analysis sessions load, complete once every chunk is written
+    skewness_pre_post(db_info.sketch_profile(cleaned_sketches))
+db_cube.save('/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/Cleaned_customer_data_cube')
+db_clean.save_params('/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/cleaning_params.yaml') #Fitted values - new batches can be cleaned with cleaning_pipeline.run(new_df, fit=False) after db_clean.load_params (with the chosen steps from db_cleaning.TransformSelector(db_clean) if select_transformations)
@@ -0,0 +1,532 @@
+import copy
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+from typing import Union
+import yaml
+import db_storage
+
+
+CUBE_DIMENSIONS = ['region', 'traffic_type', 'month', 'weekend', 'visitor_type']
+CUBE_MEASURES = ['page_values', 'revenue', 'administrative_duration', 'informational_duration', 'product_related_duration', 'exit_rates']
+TRAFFIC_CATEGORY = {'Twitter': 'Social', 'Google search': 'Search', 'Instagram ads': 'Ads', 'Youtube channel': 'Social',
+                    'Instagram Page': 'Social', 'Affiliate marketing': 'Ads', 'Facebook ads': 'Ads', 'Youtube ads': 'Ads',
+                    'Tik Tok ads': 'Ads', 'Bing search': 'Search', 'Direct Traffic': 'Direct/Other', 'Newsletter': 'Direct/Other',
+                    'Other': 'Direct/Other', 'Yahoo Search': 'Search', 'Pinterest': 'Social', 'Yandex search': 'Search',
+                    'Tik Tok page': 'Social', 'Facebook page': 'Social', 'DuckDuckGo search': 'Search'}
+# Columns derived from a stored column with a mapping - (source column, mapping, value for unmapped values)
+DERIVED_COLUMNS = {'traffic_category': ('traffic_type', TRAFFIC_CATEGORY, None),
+                   'device_type': ('operating_systems', {'Android': 'mobile', 'iOS': 'mobile'}, 'desktop')}
+OPERATORS = ['==', '!=', '<', '<=', '>', '>=', 'in', 'not in', 'contains']
+BYTE_COUNTS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1) # Rows set in each byte value of a bitmap
+
+
+def derive_column(values: pd.Series, mapping: dict, default=None) -> pd.Series:
+    '''
+    Maps the values of a column - for category columns only the categories are mapped
+
+    Inputs:
+        Series, dictionary of values to derived values and value for unmapped values (left null if None)
+
+    Returns:
+        Series of derived values
+    '''
+    derived = values.map(mapping)
+    if default is not None:
+        derived = derived.astype(object).fillna(default)
+    return derived
+
+
+def match(values: pd.Series, op: str, value) -> pd.Series:
+    '''
+    Evaluates a filter over values
+
+    Inputs:
+        Series, operator (one of OPERATORS) and value (a list for 'in' and 'not in', a substring for 'contains')
+
+    Returns:
+        Boolean series
+    '''
+    if op == 'in':
+        return values.isin(value)
+    if op == 'not in':
+        return ~values.isin(value)
+    if op == 'contains':
+        return values.astype(str).str.contains(value, regex=False)
+    return {'==': values.__eq__, '!=': values.__ne__, '<': values.__lt__, '<=': values.__le__,
+            '>': values.__gt__, '>=': values.__ge__}[op](value)
+
+
+def dataset_version(path: str) -> str:
+    '''
+    Returns a fingerprint of a data file or store directory, which changes whenever a file is written
+
+    Inputs:
+        Path of the file or directory
+
+    Returns:
+        Fingerprint made of the number of files, total size and latest modification time, None if the path does not exist
+    '''
+    if not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        stats = [os.stat(path)]
+    else:
+        stats = [os.stat(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files]
+    return f'{len(stats)}-{sum(s.st_size for s in stats)}-{max((s.st_mtime_ns for s in stats), default=0)}'
+
+
+class AggregateCube():
+    '''
+    This is class created for answering aggregate questions without scanning every session. One pass over the data
+    keeps the session count and the sums of the measures for each combination of the dimensions (a few thousand cells),
+    which any breakdown over a subset of the dimensions (or a mapping of one, e.g. traffic_category) is rolled up from
+    '''
+    def __init__(self, dimensions: list = None, measures: list = None, derived: dict = None) -> None:
+        self.dimensions = dimensions if dimensions is not None else CUBE_DIMENSIONS
+        self.measures = measures if measures is not None else CUBE_MEASURES
+        self.derived = derived if derived is not None else {'traffic_category': DERIVED_COLUMNS['traffic_category']}
+        self.cells = None
+        self.source = None
+        self.version = None
+
+    def aggregate(self, df: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Aggregates a dataframe into cube cells
+
+        Inputs:
+            Dataframe with the dimension and measure columns
+
+        Returns:
+            Dataframe with a row per combination of dimensions present, its session count, number of sessions
+            with positive page values and the sum of each measure
+        '''
+        values = df[self.measures].copy()
+        values['sessions'] = 1
+        values['converted_sessions'] = df['page_values'] > 0
+        for dimension in self.dimensions:
+            values[dimension] = df[dimension]
+        cells = values.groupby(self.dimensions, observed=True, dropna=False).sum().reset_index()
+        return cells
+
+    def build(self, df: pd.DataFrame, source: str = None) -> None:
+        '''
+        Builds the cube from a dataframe
+
+        Inputs:
+            Dataframe and optionally the path of the file or store it was read from, used to check the cube is current
+
+        Returns:
+            None
+        '''
+        self.cells = self.aggregate(df)
+        self.source = source
+        self.version = dataset_version(source) if source else None
+
+    def update(self, df: pd.DataFrame, source: str = None) -> None:
+        '''
+        Adds new rows (e.g. an appended batch or chunk) to the cube - sums and counts are added cell by cell
+
+        Inputs:
+            Dataframe of the new rows and optionally the path of the updated file or store
+
+        Returns:
+            None
+        '''
+        if self.cells is None:
+            self.build(df, source)
+            return
+        cells = pd.concat([self.cells, self.aggregate(df)], ignore_index=True)
+        self.cells = cells.groupby(self.dimensions, observed=True, dropna=False).sum().reset_index()
+        self.source = source if source else self.source
+        self.version = dataset_version(self.source) if self.source else None
+
+    def set_source(self, source: str) -> None:
+        '''
+        Records the file or store holding the data the cube was built from, e.g. once a streamed file is complete
+
+        Inputs:
+            Path of the file or store
+
+        Returns:
+            None
+        '''
+        self.source = source
+        self.version = dataset_version(source)
+
+    def is_current(self) -> bool:
+        '''
+        Checks that the data the cube was built from has not changed since
+
+        Inputs:
+            None
+
+        Returns:
+            True if the cube has been built and its source has the same version
+        '''
+        return self.cells is not None and self.source is not None and dataset_version(self.source) == self.version
+
+    def save(self, path: str) -> None:
+        '''
+        Saves the cube cells as a parquet store, with the source and version in a yaml file next to it
+
+        Inputs:
+            Directory of the store
+
+        Returns:
+            None
+        '''
+        db_storage.ParquetStore().write(self.cells, path)
+        with open(f'{path}.yaml', 'w') as file:
+            yaml.safe_dump({'source': self.source, 'version': self.version, 'dimensions': self.dimensions, 'measures': self.measures}, file)
+
+    def load(self, path: str) -> bool:
+        '''
+        Loads a saved cube
+
+        Inputs:
+            Directory of the store
+
+        Returns:
+            True if a cube with the same dimensions and measures was loaded
+        '''
+        store = db_storage.ParquetStore()
+        if not (store.exists(path) and os.path.isfile(f'{path}.yaml')):
+            return False
+        with open(f'{path}.yaml', 'r') as file:
+            metadata = yaml.safe_load(file)
+        if metadata['dimensions'] != self.dimensions or metadata['measures'] != self.measures:
+            return False
+        self.cells = store.read(path)
+        self.source = metadata['source']
+        self.version = metadata['version']
+        return True
+
+    def query(self, dimensions: list, measures: list = None, filters: dict = None) -> Union[pd.DataFrame, pd.Series]:
+        '''
+        Rolls the cube up to a breakdown
+
+        Inputs:
+            List of dimensions to group by (cube or derived dimensions - none for the overall totals),
+            list of measures (all, including sessions and converted_sessions, if None) and filters as a
+            dictionary of dimension to a list of values to keep, or to a function returning a boolean mask
+            e.g. {'traffic_type': lambda s: s.str.contains('ads')}
+
+        Returns:
+            Dataframe of the summed measures indexed by the dimensions (series of totals if there are no dimensions)
+        '''
+        measures = measures if measures is not None else self.measures + ['sessions', 'converted_sessions']
+        cells = self.cells
+        for dimension in set(dimensions) | set(filters or {}):
+            if dimension in self.derived:
+                source, mapping, default = self.derived[dimension]
+                cells = cells.assign(**{dimension: derive_column(cells[source], mapping, default)})
+        for dimension, condition in (filters or {}).items():
+            mask = condition(cells[dimension].astype(str)) if callable(condition) else cells[dimension].isin(condition)
+            cells = cells[mask]
+        if not dimensions:
+            return cells[measures].sum()
+        return cells.groupby(dimensions, observed=True)[measures].sum()
+
+
+class LazyQuery():
+    '''
+    This is class created for querying the cleaned data store without materialising intermediate dataframes.
+    Filters, derived columns, projections and an aggregation are collected first, then the plan is optimised
+    and run in one pass. Every filter is pushed into the columnar reader - filters on derived columns are
+    rewritten as filters on their source column, and 'contains' is resolved over the distinct values - and
+    only the columns the result needs are read
+    '''
+    def __init__(self, path: str, store: db_storage.DataStore = None, derived: dict = None) -> None:
+        self.path = path
+        self.store = store if store is not None else db_storage.ParquetStore()
+        self.derived = dict(derived if derived is not None else DERIVED_COLUMNS)
+        self.filters = []
+        self.columns = None
+        self.by = None
+        self.aggregation = None
+
+    def copy(self) -> 'LazyQuery':
+        '''
+        Returns a copy of the query, so a base query can be extended in different ways
+
+        Inputs:
+            None
+
+        Returns:
+            Query
+        '''
+        query = copy.copy(self)
+        query.derived = dict(self.derived)
+        query.filters = list(self.filters)
+        return query
+
+    def derive(self, name: str, source: str, mapping: dict, default=None) -> 'LazyQuery':
+        '''
+        Adds a column derived from a stored column
+
+        Inputs:
+            Name of the new column, source column, dictionary of values to derived values and value for unmapped values
+
+        Returns:
+            New query
+        '''
+        query = self.copy()
+        query.derived[name] = (source, mapping, default)
+        return query
+
+    def filter(self, column: str, op: str, value) -> 'LazyQuery':
+        '''
+        Keeps the rows matching a condition
+
+        Inputs:
+            Stored or derived column, operator (one of OPERATORS) and value
+
+        Returns:
+            New query
+        '''
+        if op not in OPERATORS:
+            raise ValueError(f'Unknown operator {op}, expected one of {OPERATORS}')
+        query = self.copy()
+        query.filters.append((column, op, value))
+        return query
+
+    def select(self, columns: list) -> 'LazyQuery':
+        '''
+        Keeps only some (stored or derived) columns
+
+        Inputs:
+            List of columns
+
+        Returns:
+            New query
+        '''
+        query = self.copy()
+        query.columns = list(columns)
+        return query
+
+    def aggregate(self, by: list, aggregation: dict) -> 'LazyQuery':
+        '''
+        Groups the rows and aggregates them
+
+        Inputs:
+            List of columns to group by and dictionary of columns to aggregation functions, as for DataFrame.agg
+
+        Returns:
+            New query
+        '''
+        query = self.copy()
+        query.by = list(by)
+        query.aggregation = dict(aggregation)
+        return query
+
+    def pushdown(self, column: str, op: str, value) -> tuple:
+        '''
+        Rewrites a filter as a filter the reader can evaluate on a stored column
+
+        Inputs:
+            Column, operator and value
+
+        Returns:
+            Tuple of (stored column, operator, value)
+        '''
+        if column in self.derived:
+            source, mapping, default = self.derived[column]
+            derived_values = pd.Series(list(set(mapping.values()) | ({default} if default is not None else set())), dtype=object)
+            matched = set(derived_values[match(derived_values, op, value).to_numpy()])
+            if default is not None and default in matched: # Unmapped values match too, so excluding the mapped values which do not
+                return (source, 'not in', [key for key, derived in mapping.items() if derived not in matched])
+            return (source, 'in', [key for key, derived in mapping.items() if derived in matched])
+        if op == 'contains':
+            values = pd.Series(self.store.distinct(self.path, column), dtype=object)
+            return (column, 'in', values[match(values, op, value).to_numpy()].tolist())
+        return (column, op, value)
+
+    def plan(self) -> dict:
+        '''
+        Optimises the query into the filter expression and columns passed to the reader, and the columns to derive
+
+        Inputs:
+            None
+
+        Returns:
+            Dictionary with the pushed filters, the pyarrow filter expression, the stored columns to read and the columns to derive
+        '''
+        pushed = [self.pushdown(*condition) for condition in self.filters]
+        expression = None
+        for column, op, value in pushed:
+            field = pc.field(column)
+            if op == 'in':
+                condition = field.isin(value)
+            elif op == 'not in':
+                condition = ~field.isin(value)
+            else:
+                condition = {'==': field.__eq__, '!=': field.__ne__, '<': field.__lt__, '<=': field.__le__,
+                             '>': field.__gt__, '>=': field.__ge__}[op](value)
+            expression = condition if expression is None else expression & condition
+        if self.aggregation is not None:
+            output = self.by + [column for column in self.aggregation if column not in self.by]
+        else:
+            output = self.columns
+        if output is None:
+            return {'filters': pushed, 'expression': expression, 'columns': None, 'derive': []}
+        derive = [column for column in output if column in self.derived]
+        columns = []
+        for column in output:
+            column = self.derived[column][0] if column in self.derived else column
+            if column not in columns:
+                columns.append(column)
+        return {'filters': pushed, 'expression': expression, 'columns': columns, 'derive': derive}
+
+    def explain(self) -> str:
+        '''
+        Describes the optimised plan
+
+        Inputs:
+            None
+
+        Returns:
+            Description of the plan
+        '''
+        plan = self.plan()
+        lines = [f'read {self.path} columns={plan["columns"] or "all"} filter={plan["expression"]}']
+        lines += [f'derive {column} from {self.derived[column][0]}' for column in plan['derive']]
+        if self.aggregation is not None:
+            lines.append(f'aggregate {self.aggregation} by {self.by}')
+        elif self.columns is not None:
+            lines.append(f'select {self.columns}')
+        return '\n'.join(lines)
+
+    def collect(self) -> pd.DataFrame:
+        '''
+        Runs the query
+
+        Inputs:
+            None
+
+        Returns:
+            Dataframe - the selected columns, or the aggregation indexed by the group columns
+        '''
+        plan = self.plan()
+        df = self.store.read(self.path, columns=plan['columns'], filters=plan['expression'])
+        for column in plan['derive']:
+            source, mapping, default = self.derived[column]
+            df[column] = derive_column(df[source], mapping, default)
+        if self.aggregation is not None:
+            return df.groupby(self.by, observed=True).agg(self.aggregation)
+        return df[self.columns] if self.columns is not None else df
+
+
+class RowBitmap():
+    '''
+    Set of row positions stored as a packed bitmap (one bit per row). Bitmaps of the same rows are combined
+    with & (and), | (or) and ~ (not), eight rows per byte operation
+    '''
+    def __init__(self, bits: np.ndarray, n_rows: int) -> None:
+        self.bits = bits
+        self.n_rows = n_rows
+
+    def __and__(self, other: 'RowBitmap') -> 'RowBitmap':
+        return RowBitmap(self.bits & other.bits, self.n_rows)
+
+    def __or__(self, other: 'RowBitmap') -> 'RowBitmap':
+        return RowBitmap(self.bits | other.bits, self.n_rows)
+
+    def __invert__(self) -> 'RowBitmap':
+        bits = ~self.bits
+        if self.n_rows % 8: # Clearing the padding bits of the last byte
+            bits[-1] &= np.uint8(0xFF << (8 - self.n_rows % 8) & 0xFF)
+        return RowBitmap(bits, self.n_rows)
+
+    def count(self) -> int:
+        '''
+        Returns the number of rows in the set
+
+        Inputs:
+            None
+
+        Returns:
+            Number of rows
+        '''
+        return int(BYTE_COUNTS[self.bits].sum())
+
+    def mask(self) -> np.ndarray:
+        '''
+        Returns the set as a boolean mask
+
+        Inputs:
+            None
+
+        Returns:
+            Boolean array with a value per row
+        '''
+        return np.unpackbits(self.bits, count=self.n_rows).astype(bool)
+
+    def positions(self) -> np.ndarray:
+        '''
+        Returns the row positions in the set
+
+        Inputs:
+            None
+
+        Returns:
+            Sorted array of row positions
+        '''
+        filled = np.flatnonzero(self.bits) # Only the bytes holding a matching row are unpacked
+        bits = np.unpackbits(self.bits[filled]).reshape(-1, 8).astype(bool)
+        return (filled[:, None] * 8 + np.arange(8))[bits]
+
+
+class CategoryIndex():
+    '''
+    This is class created for filtering category columns without comparing every row. It is built once on a
+    dataframe and keeps, for each column, the category codes and the bitmap of the rows of each code. A predicate is
+    evaluated over the categories only (a few values) and resolves to the union of their bitmaps
+    '''
+    def __init__(self, df: pd.DataFrame, columns: list = None) -> None:
+        columns = columns if columns is not None else [column for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)]
+        self.n_rows = len(df)
+        self.categories = {}
+        self.codes = {}
+        self.bitmaps = {}
+        for column in columns:
+            codes = df[column].cat.codes.to_numpy()
+            self.codes[column] = codes
+            self.categories[column] = df[column].cat.categories
+            self.bitmaps[column] = np.stack([np.packbits(codes == code) for code in range(len(self.categories[column]))]) \
+                if len(self.categories[column]) else np.zeros((0, (self.n_rows + 7) // 8), dtype=np.uint8)
+
+    def lookup(self, column: str, op: str, value) -> RowBitmap:
+        '''
+        Returns the rows whose category matches a predicate
+
+        Inputs:
+            Indexed column, operator (one of OPERATORS) and value
+
+        Returns:
+            Bitmap of the matching rows (rows with a null category never match)
+        '''
+        categories = pd.Series(self.categories[column], dtype=object)
+        codes = np.flatnonzero(match(categories, op, value).to_numpy())
+        return RowBitmap(np.bitwise_or.reduce(self.bitmaps[column][codes], axis=0) if len(codes) else
+                         np.zeros(self.bitmaps[column].shape[1], dtype=np.uint8), self.n_rows)
+
+    def aggregate(self, df: pd.DataFrame, rows: RowBitmap, by: str, column: str) -> pd.Series:
+        '''
+        Sums a column by an indexed column over the rows of a bitmap - only the matching rows are read, and their
+        groups come from the codes kept by the index
+
+        Inputs:
+            Dataframe the index was built on, bitmap of rows, indexed column to group by and column to sum
+
+        Returns:
+            Series of sums indexed by the categories present in the rows
+        '''
+        positions = rows.positions()
+        codes = self.codes[by][positions]
+        values = df[column].take(positions).to_numpy(dtype=float, na_value=np.nan)
+        present = codes >= 0
+        sums = np.bincount(codes[present], weights=np.nan_to_num(values[present]), minlength=len(self.categories[by])) # Nulls add nothing, as in groupby
+        counts = np.bincount(codes[present], minlength=len(self.categories[by]))
+        return pd.Series(sums, index=self.categories[by], name=column)[counts > 0]
@@ -0,0 +1,503 @@
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+from scipy.stats import boxcox
+from multiprocessing.connection import Connection
+from typing import Callable
+from typing import Iterator
+import db_analysis
+import db_cleaning
+import db_storage
+import db_utils
+
+
+def time_function(function, *args, repeat: int = 3, **kwargs) -> dict:
+    '''
+    Times a function call, keeping the best of several runs
+
+    Inputs:
+        Function, its arguments, number of runs and its keyword arguments
+
+    Returns:
+        Dictionary with the best and mean run time in seconds
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return {'best_seconds': min(times), 'mean_seconds': sum(times) / len(times)}
+
+
+def create_sqlite_standin(db_file: str, df: pd.DataFrame, table_name: str = 'customer_activity', copies: int = 1) -> db.engine.Engine:
+    '''
+    Creates a local SQLite copy of the customer_activity table, with an integer session_id key,
+    to stand in for the RDS database
+
+    Inputs:
+        SQLite file name, dataframe to load, table name and number of times to repeat the dataframe
+
+    Returns:
+        Engine to the SQLite file
+    '''
+    engine = db.create_engine(f'sqlite:///{db_file}')
+    for i in range(copies):
+        copy_df = df.copy()
+        copy_df.insert(0, 'session_id', range(i * len(df), (i + 1) * len(df)))
+        copy_df.to_sql(table_name, engine, index=False, if_exists='replace' if i == 0 else 'append')
+    return engine
+
+
+def extraction_benchmark(engine: db.engine.Engine, table_name: str, partition_column: str, workers: list, repeat: int = 3) -> pd.DataFrame:
+    '''
+    Compares the single-query read with parallel partitioned reads for different numbers of workers
+
+    Inputs:
+        Engine, table name, key column to partition on, list of worker counts and number of runs
+
+    Returns:
+        Dataframe with the run time and speed-up for each reader
+    '''
+    connector = db_utils.RDSDatabaseConnector()
+    results = [{'reader': 'read_rds_data', 'workers': 1, **time_function(connector.read_rds_data, engine, table_name, repeat=repeat)}]
+    for n in workers:
+        timing = time_function(connector.read_rds_data_parallel, engine, table_name, partition_column,
+                               n_partitions=n, max_workers=n, repeat=repeat)
+        results.append({'reader': 'read_rds_data_parallel', 'workers': n, **timing})
+    results_df = pd.DataFrame(results)
+    results_df['speed_up'] = (results_df['best_seconds'].iloc[0] / results_df['best_seconds']).round(2)
+    return results_df
+
+
+def transform_benchmark(df: pd.DataFrame, log_columns: list, boxcox_columns: dict, repeat: int = 3) -> pd.DataFrame:
+    '''
+    Compares the previous per-row lambda log transformation and per-column BoxCox calls with
+    DataFrameTransform.skewness_transformation
+
+    Inputs:
+        Dataframe without nulls in the columns, columns to log transform, dictionary of columns to BoxCox transform
+        with their constants, and number of runs
+
+    Returns:
+        Dataframe with the run time and speed-up for each implementation
+    '''
+    transformer = db_cleaning.DataFrameTransform()
+    out = np.empty((len(df), len(log_columns)), order='F')
+
+    def previous_log():
+        for column in log_columns:
+            df[column].map(lambda i: np.log(i+1))
+
+    def previous_boxcox():
+        for column, constant in boxcox_columns.items():
+            boxcox(df[column] + constant)
+
+    results = [{'transformation': 'log', 'implementation': 'map lambda', **time_function(previous_log, repeat=repeat)},
+               {'transformation': 'log', 'implementation': 'skewness_transformation',
+                **time_function(transformer.skewness_transformation, df, log_columns, 'log', out=out, repeat=repeat)},
+               {'transformation': 'boxcox', 'implementation': 'scipy boxcox', **time_function(previous_boxcox, repeat=repeat)},
+               {'transformation': 'boxcox', 'implementation': 'skewness_transformation',
+                **time_function(transformer.skewness_transformation, df, list(boxcox_columns), 'boxcox',
+                                list(boxcox_columns.values()), out=np.empty((len(df), len(boxcox_columns)), order='F'), repeat=repeat)}]
+    results_df = pd.DataFrame(results)
+    first = results_df.groupby('transformation')['best_seconds'].transform('first')
+    results_df['speed_up'] = (first / results_df['best_seconds']).round(2)
+    return results_df
+
+
+def partition_benchmark(pipeline: db_cleaning.CleaningPipeline, df: pd.DataFrame, workers: list, repeat: int = 3) -> pd.DataFrame:
+    '''
+    Compares cleaning with a fitted pipeline in one process with PartitionExecutor for different numbers of workers
+
+    Inputs:
+        Pipeline whose transformer has fitted params, dataframe, list of worker counts and number of runs
+
+    Returns:
+        Dataframe with the run time and speed-up for each number of workers
+    '''
+    results = [{'workers': 1, **time_function(lambda: pipeline.run(df.copy(), fit=False), repeat=repeat)}]
+    for n in workers:
+        executor = db_cleaning.PartitionExecutor(n)
+        results.append({'workers': n, **time_function(executor.run, pipeline, df, repeat=repeat)})
+    results_df = pd.DataFrame(results)
+    results_df['speed_up'] = (results_df['best_seconds'].iloc[0] / results_df['best_seconds']).round(2)
+    return results_df
+
+
+class SyntheticSessions():
+    '''
+    Class to generate customer_activity data of any size from a sample of it (e.g. customer_data.csv). Rows are drawn
+    with replacement from the sample, which keeps the schema, the nulls, the category frequencies and the joint
+    distribution of the columns, and the durations and page values are scaled by a small random factor so repeated
+    rows are not identical. Rows are generated in chunks, so sizes larger than memory can be streamed
+    '''
+    jitter_columns = ['administrative_duration', 'informational_duration', 'product_related_duration', 'page_values']
+
+    def __init__(self, sample: pd.DataFrame, seed: int = 0, jitter: float = 0.05) -> None:
+        self.sample = db_utils.RDSDatabaseConnector().encode_session_columns(sample.copy())
+        self.seed = seed
+        self.jitter = jitter
+
+    def chunks(self, n_rows: int, chunk_rows: int = 1000000) -> Iterator[pd.DataFrame]:
+        '''
+        Generates rows in chunks, the same rows for the same seed and chunk size
+
+        Inputs:
+            Number of rows and rows per chunk
+
+        Returns:
+            Iterator of dataframes, encoded as read_rds_data_chunks returns them
+        '''
+        rng = np.random.default_rng(self.seed)
+        for start in range(0, n_rows, chunk_rows):
+            size = min(chunk_rows, n_rows - start)
+            chunk = self.sample.take(rng.integers(0, len(self.sample), size)).reset_index(drop=True)
+            for column in self.jitter_columns:
+                chunk[column] = chunk[column].to_numpy(dtype=float) * rng.lognormal(0, self.jitter, size)
+            yield chunk
+
+    def frame(self, n_rows: int) -> pd.DataFrame:
+        '''
+        Generates rows as one dataframe
+
+        Inputs:
+            Number of rows
+
+        Returns:
+            Dataframe
+        '''
+        return pd.concat(self.chunks(n_rows), ignore_index=True)
+
+
+def peak_rss_mb() -> float:
+    '''
+    Returns the peak resident memory of the current process so far - ru_maxrss is in bytes on macOS and in
+    kilobytes on Linux
+
+    Inputs:
+        None
+
+    Returns:
+        Peak resident memory in MB
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def traced_run(function: Callable, setup: Callable = None, connection: Connection = None) -> dict:
+    '''
+    Runs a function once with tracemalloc, after its setup. In a forked process (given the connection to report back
+    on) the resident memory the run adds is measured too - a forked process's peak starts from its own resident memory,
+    so the rise of ru_maxrss over the run belongs to this case alone
+
+    Inputs:
+        Function, optionally a setup function returning its arguments as a tuple, and the connection to send the
+        result on
+
+    Returns:
+        Dictionary with the peak memory allocated by Python and numpy and the peak resident memory added, in MB
+    '''
+    try:
+        args = setup() if setup is not None else ()
+        start = peak_rss_mb()
+        tracemalloc.start()
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result = {'peak_mb': peak / 2 ** 20, 'rss_mb': peak_rss_mb() - start if connection is not None else None}
+    except BaseException as error:
+        if connection is None:
+            raise
+        result = {'error': f'{type(error).__name__}: {error}'}
+    if connection is not None:
+        connection.send(result)
+        connection.close()
+    return result
+
+
+def measure(case: str, stage: str, n_rows: int, function: Callable, setup: Callable = None, repeat: int = 3) -> dict:
+    '''
+    Times a function, keeping the best of several runs, then runs it once more, in a forked process where the
+    platform has fork, with tracemalloc to find its peak memory. Setup is run before each run and not timed - its
+    result is passed to the function
+
+    Inputs:
+        Case name, stage (e.g. 'load', 'cleaning'), number of rows processed, function, optionally a setup
+        function returning the arguments of each run as a tuple, and number of runs
+
+    Returns:
+        Dictionary with the run times in seconds, rows per second, peak memory allocated by Python and numpy in MB
+        and the peak resident memory the run added in MB (Arrow's own buffers are only in the latter, which can also be
+        lower, as memory the allocator already holds is reused; None without fork)
+    '''
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    if 'fork' in multiprocessing.get_all_start_methods():
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.get_context('fork').Process(target=traced_run, args=(function, setup, sender))
+        process.start()
+        sender.close()
+        try:
+            memory = receiver.recv()
+        except EOFError: # The process died without reporting, e.g. killed when out of memory
+            memory = {'error': 'no result'}
+        process.join()
+        if 'error' in memory:
+            raise RuntimeError(f'Traced run of {case} failed (exit code {process.exitcode}): {memory["error"]}')
+    else:
+        memory = traced_run(function, setup)
+    best = min(times)
+    return {'case': case, 'stage': stage, 'rows': n_rows, 'best_seconds': best, 'mean_seconds': sum(times) / len(times),
+            'rows_per_second': n_rows / best if best > 0 else None, **memory}
+
+
+def cleaning_cases(df: pd.DataFrame, steps: list, repeat: int = 3) -> list:
+    '''
+    Times each cleaning step on the data as the steps before it leave it, then the whole pipeline
+
+    Inputs:
+        Dataframe as read from the database, list of cleaning steps (e.g. db_cleaning.cleaning_steps()) and number of runs
+
+    Returns:
+        List of results (from measure)
+    '''
+    results = []
+    transformer = db_cleaning.DataFrameTransform()
+    current = df
+    for i, step in enumerate(steps):
+        pipeline = db_cleaning.CleaningPipeline([step], transformer)
+        target = step[1].get('column', step[1].get('column1', ''))
+        results.append(measure(f'{i:02d} {step[0]} {target}'.strip(), 'cleaning step', len(current),
+                               lambda frame: pipeline.run(frame), lambda: (current.copy(),), repeat))
+        current = pipeline.run(current.copy())
+    pipeline = db_cleaning.CleaningPipeline(steps, db_cleaning.DataFrameTransform())
+    results.append(measure('cleaning pipeline', 'cleaning', len(df), lambda frame: pipeline.run(frame), lambda: (df.copy(),), repeat))
+    results.append(measure('cleaning pipeline (fitted)', 'cleaning', len(df), lambda frame: pipeline.run(frame, fit=False),
+                           lambda: (df.copy(),), repeat))
+    return results
+
+
+def analysis_cases(df: pd.DataFrame, parquet_path: str, repeat: int = 3) -> list:
+    '''
+    Times the profiling calls of data_exploration.py and the aggregations of data_analysis.py on cleaned data,
+    with the pandas group-bys the cube replaced as a reference
+
+    Inputs:
+        Cleaned dataframe, parquet store of it and number of runs
+
+    Returns:
+        List of results (from measure)
+    '''
+    n = len(df)
+    info = db_utils.DataFrameInfo()
+    plotter = db_utils.Plotter()
+    results = [measure('profile', 'profiling', n, lambda: info.profile(df), repeat=repeat),
+               measure('sketch', 'profiling', n, lambda: info.sketch(df), repeat=repeat),
+               measure('correlations', 'profiling', n, lambda: plotter.correlations(df), repeat=repeat)]
+    cube = db_analysis.AggregateCube()
+    results.append(measure('cube build', 'aggregation', n, lambda: cube.build(df), repeat=repeat))
+    cube.build(df)
+    queries = [(['weekend'], ['sessions', 'revenue', 'page_values']), (['region'], ['page_values']),
+               (['traffic_type'], ['page_values']), (['month'], ['informational_duration', 'administrative_duration', 'product_related_duration']),
+               (['region', 'traffic_type'], ['page_values'])]
+    results.append(measure('cube queries', 'aggregation', n, lambda: [cube.query(*query) for query in queries], repeat=repeat))
+    results.append(measure('group-by queries', 'aggregation', n,
+                           lambda: [df.groupby(dimensions, observed=True)[[m for m in measures if m != 'sessions']].sum() for dimensions, measures in queries],
+                           repeat=repeat))
+    results.append(measure('share table', 'aggregation', n,
+                           lambda: info.share_table(df, 'region', 'traffic_type', values='page_values', normalize='index'), repeat=repeat))
+    index = db_analysis.CategoryIndex(df)
+    results.append(measure('index lookup', 'aggregation', n,
+                           lambda: index.aggregate(df, index.lookup('region', '==', 'Western Europe'), 'traffic_type', 'page_values'), repeat=repeat))
+    results.append(measure('lazy query', 'aggregation', n,
+                           lambda: db_analysis.LazyQuery(parquet_path).filter('region', '==', 'Western Europe').select(['traffic_type', 'page_values']).collect(),
+                           repeat=repeat))
+    return results
+
+
+def in_memory_cases(sessions: SyntheticSessions, n_rows: int, work_dir: str, repeat: int = 3) -> list:
+    '''
+    Benchmarks the in-memory path of the scripts - loading the data from csv and from the columnar stores,
+    each cleaning step and the pipeline, then profiling and aggregating the cleaned data
+
+    Inputs:
+        Data generator, number of rows, directory for the data files and number of runs
+
+    Returns:
+        List of results (from measure)
+    '''
+    connector = db_utils.RDSDatabaseConnector()
+    store = db_storage.get_store('parquet')
+    df = sessions.frame(n_rows)
+    csv_file = os.path.join(work_dir, f'sessions_{n_rows}.csv')
+    parquet_path = os.path.join(work_dir, f'sessions_{n_rows}.parquet')
+    arrow_file = os.path.join(work_dir, f'sessions_{n_rows}.arrow')
+    results = [measure('write csv', 'load', n_rows, lambda: df.to_csv(csv_file, index=False), repeat=1),
+               measure('write parquet', 'load', n_rows, lambda: store.write(df, parquet_path), repeat=1),
+               measure('write arrow', 'load', n_rows, lambda: connector.df_to_feather(df, arrow_file), repeat=1),
+               measure('load csv', 'load', n_rows, lambda: connector.encode_session_columns(pd.read_csv(csv_file)), repeat=repeat),
+               measure('load parquet', 'load', n_rows, lambda: store.read(parquet_path), repeat=repeat),
+               measure('load arrow (memory-mapped)', 'load', n_rows, lambda: connector.load_mapped_data(arrow_file), repeat=repeat)]
+    results += cleaning_cases(df, db_cleaning.cleaning_steps(), repeat)
+    cleaned = db_cleaning.CleaningPipeline(db_cleaning.cleaning_steps()).run(df)
+    cleaned_path = os.path.join(work_dir, f'cleaned_{n_rows}.parquet')
+    store.write(cleaned, cleaned_path)
+    results += analysis_cases(cleaned, cleaned_path, repeat)
+    return results
+
+
+def streaming_cases(sessions: SyntheticSessions, n_rows: int, work_dir: str, chunk_rows: int = 1000000) -> list:
+    '''
+    Benchmarks the out-of-core path of the scripts, for sizes larger than memory - each case streams the data once
+    in chunks: writing it to csv and parquet, reading it back, fitting and running the cleaning with OutOfCoreCleaner,
+    sketching the cleaned data and updating the aggregate cube
+
+    Inputs:
+        Data generator, number of rows, directory for the data files and rows per chunk
+
+    Returns:
+        List of results (from measure, with one timed run)
+    '''
+    store = db_storage.get_store('parquet')
+    csv_file = os.path.join(work_dir, f'sessions_{n_rows}.csv')
+    parquet_path = os.path.join(work_dir, f'sessions_{n_rows}.parquet')
+
+    def write_csv():
+        for i, chunk in enumerate(sessions.chunks(n_rows, chunk_rows)):
+            chunk.to_csv(csv_file, index=False, mode='w' if i == 0 else 'a', header=i == 0)
+
+    def write_parquet():
+        for i, chunk in enumerate(sessions.chunks(n_rows, chunk_rows)):
+            if i == 0:
+                store.write(chunk, parquet_path)
+            else:
+                store.append(chunk, parquet_path)
+
+    def drain(chunks):
+        for _ in chunks:
+            pass
+
+    read_chunks = lambda: (chunk for batch in store.dataset(parquet_path).to_batches(batch_size=chunk_rows)
+                           for chunk in [batch.to_pandas()])
+    cleaner = db_cleaning.OutOfCoreCleaner(db_cleaning.CleaningPipeline(db_cleaning.cleaning_steps()))
+    results = [measure('write csv', 'load', n_rows, write_csv, repeat=1),
+               measure('write parquet', 'load', n_rows, write_parquet, repeat=1),
+               measure('load csv', 'load', n_rows, lambda: drain(pd.read_csv(csv_file, chunksize=chunk_rows)), repeat=1),
+               measure('load parquet', 'load', n_rows, lambda: drain(read_chunks()), repeat=1),
+               measure('out-of-core fit', 'cleaning', n_rows, lambda: cleaner.fit(read_chunks), repeat=1),
+               measure('out-of-core transform', 'cleaning', n_rows, lambda: drain(cleaner.transform(read_chunks)), repeat=1)]
+    info = db_utils.DataFrameInfo()
+    cube = db_analysis.AggregateCube()
+
+    def sketch():
+        sketches = {}
+        for chunk in cleaner.transform(read_chunks):
+            info.sketch(chunk, sketches)
+        return info.sketch_profile(sketches)
+
+    def update_cube():
+        for chunk in cleaner.transform(read_chunks):
+            cube.update(chunk)
+
+    results += [measure('clean and sketch', 'profiling', n_rows, sketch, repeat=1),
+                measure('clean and update cube', 'aggregation', n_rows, update_cube, repeat=1)]
+    return results
+
+
+def run_suite(sample: pd.DataFrame, sizes: list = (10000, 1000000, 100000000), work_dir: str = 'benchmark_data',
+              repeat: int = 3, in_memory_rows: int = 2000000, chunk_rows: int = 1000000, seed: int = 0) -> dict:
+    '''
+    Runs the benchmarks for each size of generated data - in memory up to in_memory_rows, streamed above that
+
+    Inputs:
+        Sample of the customer_activity data, numbers of rows, directory for the data files, number of runs,
+        largest size to benchmark in memory, rows per chunk when streaming and seed of the generator
+
+    Returns:
+        Dictionary with the run's metadata and the list of results, ready for save_results
+    '''
+    os.makedirs(work_dir, exist_ok=True)
+    sessions = SyntheticSessions(sample, seed)
+    results = []
+    for n_rows in sizes:
+        if n_rows <= in_memory_rows:
+            cases = in_memory_cases(sessions, n_rows, work_dir, repeat)
+        else:
+            cases = streaming_cases(sessions, n_rows, work_dir, chunk_rows)
+        results += [{**case, 'mode': 'in memory' if n_rows <= in_memory_rows else 'streaming'} for case in cases]
+    metadata = {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'), 'platform': platform.platform(),
+                'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                'cpus': os.cpu_count(), 'repeat': repeat, 'seed': seed}
+    return {'metadata': metadata, 'results': results}
+
+
+def save_results(run: dict, file: str) -> None:
+    '''
+    Saves the results of run_suite as json
+
+    Inputs:
+        Results and file name
+
+    Returns:
+        None
+    '''
+    with open(file, 'w') as results_file:
+        json.dump(run, results_file, indent=2)
+
+
+def load_results(file: str) -> pd.DataFrame:
+    '''
+    Loads results saved with save_results
+
+    Inputs:
+        File name
+
+    Returns:
+        Dataframe with one row per case and size
+    '''
+    with open(file, 'r') as results_file:
+        return pd.DataFrame(json.load(results_file)['results'])
+
+
+def compare_results(baseline_file: str, current_file: str, tolerance: float = 0.1, memory_tolerance: float = None,
+                    min_memory_mb: float = 1.0) -> pd.DataFrame:
+    '''
+    Compares two saved runs case by case - ratios above 1 are slower or use more memory than the baseline. A case is
+    flagged when its time, or its peak allocated or resident memory, grew by more than the tolerance (memory changes
+    under min_memory_mb are left out, as small cases are mostly noise)
+
+    Inputs:
+        Baseline and current results files, the relative change in time to flag as a regression, the relative change
+        in memory to flag (the time tolerance if None) and the smallest change in memory to flag in MB
+
+    Returns:
+        Dataframe with the best times and memory of both runs, their ratios and regression flags
+    '''
+    memory_tolerance = memory_tolerance if memory_tolerance is not None else tolerance
+    keys = ['case', 'stage', 'mode', 'rows']
+    baseline, current = load_results(baseline_file), load_results(current_file)
+    memory = [column for column in ['peak_mb', 'rss_mb'] if column in baseline.columns and column in current.columns] # rss_mb is missing from older runs
+    columns = ['best_seconds'] + memory
+    comparison = baseline[keys + columns].merge(current[keys + columns], on=keys, suffixes=('_baseline', ''))
+    comparison['time_ratio'] = (comparison['best_seconds'] / comparison['best_seconds_baseline']).round(2)
+    comparison['time_regression'] = comparison['time_ratio'] > 1 + tolerance
+    comparison['memory_regression'] = False
+    for column in memory:
+        before, after = comparison[f'{column}_baseline'].astype(float), comparison[column].astype(float)
+        comparison[{'peak_mb': 'memory_ratio', 'rss_mb': 'rss_ratio'}[column]] = (after / before).round(2)
+        comparison['memory_regression'] |= (after > before * (1 + memory_tolerance)) & (after - before > min_memory_mb)
+    comparison['regression'] = comparison['time_regression'] | comparison['memory_regression']
+    return comparison
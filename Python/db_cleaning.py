@@ -1,45 +1,223 @@
+import itertools
+import os
 import pandas as pd
 import sqlalchemy as db
 from sqlalchemy.engine import Connection
+from typing import Iterable
 from typing import TextIO
 import yaml
 import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.stats import boxcox
+from scipy.stats import boxcox_normmax
+from scipy.stats import yeojohnson
+from scipy.stats import yeojohnson_normmax
+from scipy import special
+from typing import Union
+from pandas.api.types import union_categoricals
+from typing import Callable
+from typing import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import db_sketches
+
+CATEGORICAL_COLUMNS = ['month','browser','operating_systems','region','traffic_type','visitor_type']
+INTEGER_COLUMNS = ['administrative','informational','product_related']
+
+# The cleaning steps of the customer_activity data, run by data_extraction_and_cleaning.py and the benchmarks
+# Imputing or dropping null values across columns, and cleaning format and other errors
+NULL_STEPS = [('impute_categorical', {'column': 'administrative'}), # Imputations for more categorical variables (stored as floats though)
+              ('impute_categorical', {'column': 'product_related'}),
+              ('impute_numerical_pairs', {'var_pairs': [['administrative','administrative_duration'], # Imputations for purely numeric variables
+                                                        ['informational','informational_duration'],
+                                                        ['product_related','product_related_duration']],
+                                          'fit_all_groups': True}), # All group medians are saved for cleaning new batches
+              ('drop_null', {'column': 'operating_systems'}), # Removing null for some of the other variables
+              ('drop_null', {'column': 'product_related_duration'}), # Dropping one row for which the impute method did not work
+              ('format_cleaning', {}), # Cleaning datatype format
+              ('region_cleaning', {})]
+# Removing outliers
+OUTLIER_STEPS = [('filter', {'column': 'product_related_duration', 'op': '<', 'value': 20000})]
+# Transforming skewed variables
+SKEWNESS_STEPS = [('skewness_log_transformation', {'column1': 'administrative_duration', 'column2': 'transformed_administrative_duration'}),
+                  ('skewness_log_transformation', {'column1': 'informational_duration', 'column2': 'transformed_informational_duration'}),
+                  ('skewness_boxcox_transformation', {'column1': 'product_related_duration', 'column2': 'transformed_product_related_duration', 'constant': 0.01}),
+                  ('skewness_boxcox_transformation', {'column1': 'bounce_rates', 'column2': 'transformed_bounce_rates', 'constant': 1e-10}),
+                  ('skewness_boxcox_transformation', {'column1': 'exit_rates', 'column2': 'transformed_exit_rates', 'constant': 1e-10}),
+                  ('skewness_log_transformation', {'column1': 'page_values', 'column2': 'transformed_page_values'})]
+# Removing collinear variables
+COLLINEARITY_STEPS = [('drop_columns', {'columns': ['bounce_rates', 'transformed_bounce_rates']})]
+# Ordering columns consistently (without the dropped ones)
+COLUMN_ORDER = ['administrative', 
+                'administrative_duration', 
+                'transformed_administrative_duration',
+                'informational', 
+                'informational_duration', 
+                'transformed_informational_duration', 
+                'product_related', 
+                'product_related_duration', 
+                'transformed_product_related_duration', 
+                'bounce_rates',
+                'transformed_bounce_rates',
+                'exit_rates', 
+                'transformed_exit_rates',
+                'page_values', 
+                'transformed_page_values',
+                'month', 
+                'operating_systems', 
+                'browser', 
+                'region', 
+                'traffic_type', 
+                'visitor_type', 
+                'weekend', 
+                'revenue']
 
 
 class DataFrameTransform():
-    ''' Class with methods to transform original data'''
+    '''
+    Class with methods to transform original data.
+    Methods which need statistics of the data (imputation, BoxCox) take fit=True to compute them and keep them in params,
+    or fit=False to reuse the kept ones - so new batches can be cleaned without the historical data
+    '''
+    param_groups = ('impute_categorical', 'impute_numerical', 'skewness', 'outliers', 'selection')
+
     def __init__(self) -> None:
-        pass
+        self.params = {group: {} for group in self.param_groups}
+
+    def save_params(self, file: str) -> None:
+        '''
+        Saves the fitted parameters to a yaml file
+
+        Inputs:
+            File name
+
+        Returns:
+            None
+        '''
+        with open(file, 'w') as params_file:
+            yaml.safe_dump(self.params, params_file)
+
+    def load_params(self, file: str) -> None:
+        '''
+        Loads fitted parameters saved with save_params. Groups missing from the file (e.g. saved before they
+        were added) start empty
+
+        Inputs:
+            File name
+
+        Returns:
+            None
+        '''
+        with open(file, 'r') as params_file:
+            loaded = yaml.safe_load(params_file) or {}
+        self.params = {group: {} for group in self.param_groups}
+        self.params.update(loaded)
+
+    def collect_chunks(self, chunks: Iterable[pd.DataFrame], categorical_columns: list) -> pd.DataFrame:
+        '''
+        Builds one dataframe from streamed chunks, converting categorical columns chunk by chunk
+        so the full table of raw python strings is never held in memory. Categories keep their order
+        (e.g. the stable vocabularies of read_rds_data_chunks) - categories first seen in later chunks go after them
+
+        Inputs:
+            Iterable of dataframes (e.g. from read_rds_data_chunks) and list of categorical columns
+
+        Returns:
+            Dataframe with categorical columns stored as category - an empty stream raises ValueError, as it has no
+            columns to build the dataframe from (a table with no rows still streams one empty chunk with its columns)
+        '''
+        frames = []
+        for chunk in chunks:
+            for column in categorical_columns:
+                chunk[column] = chunk[column].astype('category')
+            frames.append(chunk)
+        if not frames:
+            raise ValueError('No chunks to collect - the stream was empty, so the columns of the table are unknown')
+        for column in categorical_columns:
+            if all(frame[column].cat.categories.equals(frames[0][column].cat.categories) for frame in frames):
+                continue
+            categories = union_categoricals([frame[column] for frame in frames]).categories
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories)
+        df = pd.concat(frames, ignore_index=True)
+        return df
 
-    def impute_numerical(self, df: pd.DataFrame, column1: str, column2: str) -> pd.DataFrame:
+    def impute_numerical(self, df: pd.DataFrame, column1: str, column2: str, fit: bool = True) -> pd.DataFrame:
         ''' 
         Imputes missing values based on median value corresponding to the variable correlated with it
 
         Inputs:
-            dataframe, categorical column, numerical column
+            dataframe, categorical column, numerical column, and whether to fit the group medians
+            (or reuse the ones in params)
+
+        Returns:
+            Dataframe with imputed values for the null values 
+        '''
+        return self.impute_numerical_pairs(df, [[column1, column2]], fit, fit_all_groups=True)
+
+    def impute_numerical_pairs(self, df: pd.DataFrame, var_pairs: list, fit: bool = True, fit_all_groups: bool = False) -> pd.DataFrame:
+        ''' 
+        Imputes missing values of several numerical columns with the median of their group, in one grouped pass per group column.
+        Groups are indexed once, medians are only computed over the groups which have nulls to fill, and only the
+        null positions are written
+
+        Inputs:
+            dataframe, list of [categorical column, numerical column] pairs, whether to fit the group medians
+            (or reuse the ones in params) and whether to fit every group rather than only those with nulls
+            (needed when the saved params will clean other batches)
 
         Returns:
             Dataframe with imputed values for the null values 
         '''
-        df['median'] = df.groupby(column1)[column2].transform('median')
-        df[column2] = df[column2].fillna(df['median'])
-        df.drop(['median'], axis=1, inplace=True)
+        value_columns = {}
+        for column1, column2 in var_pairs:
+            value_columns.setdefault(column1, []).append(column2)
+        for column1, columns in value_columns.items():
+            codes, groups = pd.factorize(df[column1])
+            values = df[columns].to_numpy(dtype=float)
+            nulls = np.isnan(values)
+            if not nulls.any() and not (fit and fit_all_groups):
+                if fit: # Nothing to fill - medians fitted on earlier data are not kept
+                    for column2 in columns:
+                        self.params['impute_numerical'][column2] = {'group_column': column1, 'medians': {}}
+                continue
+            medians = np.full((len(groups) + 1, len(columns)), np.nan) # Last row is for rows whose group is null (code -1)
+            if fit:
+                needed = np.ones(len(groups), dtype=bool) if fit_all_groups else np.isin(np.arange(len(groups)), codes[nulls.any(axis=1)])
+                rows = needed[codes] & (codes >= 0)
+                group_medians = pd.DataFrame(values[rows]).groupby(codes[rows]).median()
+                medians[group_medians.index] = group_medians.to_numpy()
+                for i, column2 in enumerate(columns):
+                    fitted = {groups[code].item() if isinstance(groups[code], np.generic) else groups[code]: float(medians[code, i])
+                              for code in group_medians.index}
+                    self.params['impute_numerical'][column2] = {'group_column': column1, 'medians': fitted}
+            else:
+                for i, column2 in enumerate(columns):
+                    fitted = self.params['impute_numerical'][column2]['medians']
+                    medians[:-1, i] = [fitted.get(group, np.nan) for group in groups]
+            for i, column2 in enumerate(columns):
+                positions = np.flatnonzero(nulls[:, i])
+                if len(positions) == 0:
+                    continue
+                filled = values[:, i]
+                filled[positions] = medians[codes[positions], i]
+                df[column2] = filled
         return df
     
-    def impute_categorical(self, df: pd.DataFrame, column: str) -> pd.DataFrame:
+    def impute_categorical(self, df: pd.DataFrame, column: str, fit: bool = True) -> pd.DataFrame:
         ''' 
         Imputes missing values for categorical columns using modal value
 
         Inputs:
-            dataframe, categorical column (albeit stored as float)
+            dataframe, categorical column (albeit stored as float), and whether to fit the mode (or reuse the one in params)
 
         Returns:
             Dataframe with imputed values for the null values       
         '''
-        mode = df[column].mode().iloc[0]
+        if fit:
+            mode = df[column].mode().iloc[0]
+            self.params['impute_categorical'][column] = mode.item() if isinstance(mode, np.generic) else mode
+        mode = self.params['impute_categorical'][column]
         condition = (df[column].isna())
         df.loc[condition,column] = mode
         return df
@@ -67,9 +245,9 @@ class DataFrameTransform():
         Returns:
             Cleaned Dataframe        
         '''
-        for x in ['month','browser','operating_systems','region','traffic_type','visitor_type']:
+        for x in CATEGORICAL_COLUMNS:
             df[x] = df[x].astype('category')
-        for x in ['administrative','informational','product_related']:
+        for x in INTEGER_COLUMNS:
             df[x] = df[x].astype(int)
         return df
 
@@ -83,10 +261,61 @@ class DataFrameTransform():
         Returns:
             Cleaned Dataframe        
         '''
+        if isinstance(df['region'].dtype, pd.CategoricalDtype): # Remapping the (few) categories and looking codes up, instead of comparing every row
+            categories = df['region'].cat.categories
+            merged = categories.where(~categories.isin(['Northern Africa', 'Southern Africa']), 'Africa')
+            new_categories = merged.unique()
+            lookup = np.append(new_categories.get_indexer(merged), -1) # Code -1 (null) stays null
+            df['region'] = pd.Categorical.from_codes(lookup[df['region'].cat.codes.to_numpy()], new_categories)
+            return df
         condition = (df['region'] == 'Northern Africa') | (df['region'] == 'Southern Africa')
         df.loc[condition, 'region'] = 'Africa'
         return df
     
+    def skewness_transformation(self, df: pd.DataFrame, columns: list, method: str = 'log', constants: Union[float, list] = None, new_columns: list = None, out: np.ndarray = None, lambdas: list = None) -> dict:
+        '''
+        Vectorised log, BoxCox or Yeo-Johnson transformation of several columns in one call. Each column is
+        shifted by its constant straight into a float array and transformed in place there
+
+        Inputs:
+            Dataframe, list of columns, method ('log', 'boxcox' or 'yeojohnson'), constant(s) added before
+            transforming (default 1 for log, else 0), new column names (default 'transformed_' + column)
+            optionally a preallocated (rows x columns) float array - if given the results are only written there,
+            and optionally already fitted lambdas for BoxCox/Yeo-Johnson (fitted on this data if None)
+
+        Returns:
+            Fitted parameters for each column - method, constant and lambda (None for log)
+        '''
+        if constants is None:
+            constants = 1.0 if method == 'log' else 0.0
+        if not isinstance(constants, (list, tuple)):
+            constants = [constants] * len(columns)
+        write_df = out is None
+        if write_df:
+            out = np.empty((len(df), len(columns)), order='F')
+        params = {}
+        for i, column in enumerate(columns):
+            values = out[:, i]
+            np.add(df[column].to_numpy(dtype=float), constants[i], out=values)
+            if method == 'log':
+                np.log(values, out=values)
+                lambda_value = None
+            elif method == 'boxcox':
+                lambda_value = boxcox_normmax(values, method='mle') if lambdas is None else lambdas[i]
+                special.boxcox(values, lambda_value, out=values)
+            elif method == 'yeojohnson':
+                lambda_value = yeojohnson_normmax(values) if lambdas is None else lambdas[i]
+                values[:] = yeojohnson(values, lambda_value)
+            else:
+                raise ValueError(f"method must be 'log', 'boxcox' or 'yeojohnson', not {method}")
+            params[column] = {'method': method, 'constant': float(constants[i]),
+                              'lambda': None if lambda_value is None else float(lambda_value)}
+        if write_df:
+            new_columns = new_columns if new_columns is not None else ['transformed_' + column for column in columns]
+            for i, column in enumerate(new_columns):
+                df[column] = out[:, i]
+        return params
+
     def skewness_log_transformation(self, df: pd.DataFrame, column1: str, column2: str) -> None:
         '''
         Log transformation to reduce skewness
@@ -97,19 +326,37 @@ class DataFrameTransform():
         Returns:
             None       
         '''
-        df[column2] = df[column1].map(lambda i: np.log(i+1))
+        params = self.skewness_transformation(df, [column1], 'log', 1.0, [column2])
+        self.params['skewness'][column2] = {'column': column1, **params[column1]}
     
-    def skewness_boxcox_transformation (self, df: pd.DataFrame, column1: str, column2: str, constant: float) -> None:
+    def skewness_boxcox_transformation (self, df: pd.DataFrame, column1: str, column2: str, constant: float, fit: bool = True) -> None:
         '''
         BoxCox transformation to reduce skewness
         
         Inputs:
-            Original column name and new column name
+            Original column name, new column name, constant added before transforming
+            and whether to fit lambda (or reuse the one in params)
         
         Returns:
             None       
         '''        
-        df[column2], lambda_value = boxcox(df[column1] + constant)
+        lambdas = None if fit else [self.params['skewness'][column2]['lambda']]
+        params = self.skewness_transformation(df, [column1], 'boxcox', constant, [column2], lambdas=lambdas)
+        self.params['skewness'][column2] = {'column': column1, **params[column1]}
+
+    def skewness_yeojohnson_transformation(self, df: pd.DataFrame, column1: str, column2: str, fit: bool = True) -> None:
+        '''
+        Yeo-Johnson transformation to reduce skewness - like BoxCox, but defined for zero and negative values too
+
+        Inputs:
+            Original column name, new column name and whether to fit lambda (or reuse the one in params)
+
+        Returns:
+            None
+        '''
+        lambdas = None if fit else [self.params['skewness'][column2]['lambda']]
+        params = self.skewness_transformation(df, [column1], 'yeojohnson', 0.0, [column2], lambdas=lambdas)
+        self.params['skewness'][column2] = {'column': column1, **params[column1]}
 
     def product_related_outliers_transformation(self, df: pd.DataFrame, condition: pd.Series) -> pd.DataFrame:
         '''
@@ -122,4 +369,631 @@ class DataFrameTransform():
             Cleaned Dataframe removing outliers from the column       
         '''
         dff = df[condition]
-        return dff
\ No newline at end of file
+        return dff
+
+
+class CleaningPipeline():
+    '''
+    Class to run an ordered list of cleaning steps on DataFrameTransform in as few passes as possible.
+    Each step is a (name, arguments) pair where name is a DataFrameTransform method, or one of
+    'filter' (column, op, value), 'drop_columns' (columns) and 'order_columns' (columns).
+    Before running, the steps are planned:
+        - steps whose output columns are dropped later, and not used in between, are skipped
+        - row filters (drop_null and filter) are moved ahead of row-local steps that do not change the filtered
+          columns, and adjacent filters are combined into one mask applied with a single copy
+        - column drops and ordering are combined into one final selection
+    The result is the same as running the steps one after another. With fit=False the fitted steps only apply
+    parameters, so they no longer depend on the rows present and filters can be moved ahead of them too
+    '''
+    fitted_steps = ('impute_categorical', 'impute_numerical', 'impute_numerical_pairs', 'skewness_boxcox_transformation',
+                    'skewness_yeojohnson_transformation')
+    filter_ops = {'<': pd.Series.lt, '<=': pd.Series.le, '>': pd.Series.gt, '>=': pd.Series.ge, '==': pd.Series.eq, '!=': pd.Series.ne}
+
+    def __init__(self, steps: list, transformer: DataFrameTransform = None) -> None:
+        self.steps = steps
+        self.transformer = transformer if transformer is not None else DataFrameTransform()
+
+    def step_columns(self, name: str, args: dict, fit: bool = True) -> tuple:
+        '''
+        Describes which columns a step reads and writes, and whether it depends on which rows are present
+        (i.e. it fits statistics, so row filters cannot be moved across it)
+
+        Inputs:
+            Step name, arguments and whether statistics are being fitted
+
+        Returns:
+            Tuple of (columns read, columns written, depends on rows)
+        '''
+        if name == 'impute_categorical':
+            return {args['column']}, {args['column']}, fit
+        if name == 'impute_numerical':
+            return {args['column1'], args['column2']}, {args['column2']}, fit
+        if name == 'impute_numerical_pairs':
+            return {column for pair in args['var_pairs'] for column in pair}, {pair[1] for pair in args['var_pairs']}, fit
+        if name in ('drop_null', 'filter'):
+            return {args['column']}, set(), False
+        if name == 'format_cleaning':
+            columns = set(CATEGORICAL_COLUMNS + INTEGER_COLUMNS)
+            return columns, columns, False
+        if name == 'region_cleaning':
+            return {'region'}, {'region'}, False
+        if name == 'skewness_log_transformation':
+            return {args['column1']}, {args['column2']}, False
+        if name in ('skewness_boxcox_transformation', 'skewness_yeojohnson_transformation'):
+            return {args['column1']}, {args['column2']}, fit
+        raise ValueError(f'Unknown cleaning step {name}')
+
+    def output_columns(self, columns: list) -> list:
+        '''
+        Works out the columns left after all steps, without running them
+
+        Inputs:
+            Columns of the input dataframe
+
+        Returns:
+            List of output columns in order
+        '''
+        columns = list(columns)
+        for name, args in self.steps:
+            if name == 'drop_columns':
+                columns = [column for column in columns if column not in args['columns']]
+            elif name == 'order_columns':
+                columns = list(args['columns'])
+            else:
+                columns += [column for column in sorted(self.step_columns(name, args)[1]) if column not in columns]
+        return columns
+
+    def plan(self, columns: list, fit: bool = True) -> tuple:
+        '''
+        Plans the steps for a dataframe with the given columns
+
+        Inputs:
+            Columns of the input dataframe and whether statistics are being fitted
+
+        Returns:
+            Tuple of (planned steps, output columns). Combined filters appear as ('mask', list of filter steps)
+        '''
+        output = self.output_columns(columns)
+        steps = [(name, args) for name, args in self.steps if name not in ('drop_columns', 'order_columns')]
+        # Skipping steps whose results are never used
+        live = set(output)
+        kept = []
+        for name, args in reversed(steps):
+            reads, writes, _ = self.step_columns(name, args, fit)
+            if name not in ('drop_null', 'filter') and not (writes & live):
+                continue
+            live |= reads
+            kept.append((name, args))
+        kept.reverse()
+        # Moving filters ahead of row-local steps and combining adjacent filters
+        planned = []
+        for name, args in kept:
+            if name not in ('drop_null', 'filter'):
+                planned.append((name, args))
+                continue
+            position = len(planned)
+            while position > 0:
+                previous_name, previous_args = planned[position - 1]
+                if previous_name == 'mask':
+                    break
+                _, writes, depends_on_rows = self.step_columns(previous_name, previous_args, fit)
+                if depends_on_rows or writes & {args['column']}:
+                    break
+                position -= 1
+            if position > 0 and planned[position - 1][0] == 'mask':
+                planned[position - 1][1].append((name, args))
+            else:
+                planned.insert(position, ('mask', [(name, args)]))
+        return planned, output
+
+    def run(self, df: pd.DataFrame, fit: bool = True) -> pd.DataFrame:
+        '''
+        Plans and runs the cleaning steps
+
+        Inputs:
+            Dataframe, and whether to fit the statistics (imputation values, BoxCox lambdas, outlier thresholds)
+            or to reuse the ones already in the transformer's params
+
+        Returns:
+            Cleaned dataframe
+        '''
+        planned, output = self.plan(df.columns, fit)
+        return self.execute(df, planned, output, fit)
+
+    def execute(self, df: pd.DataFrame, planned: list, output: list = None, fit: bool = True) -> pd.DataFrame:
+        '''
+        Runs already planned steps
+
+        Inputs:
+            Dataframe, planned steps and output columns (from plan), and whether to fit the statistics
+
+        Returns:
+            Cleaned dataframe
+        '''
+        outliers = self.transformer.params['outliers']
+        for name, args in planned:
+            if name == 'mask':
+                condition = pd.Series(True, index=df.index)
+                for filter_name, filter_args in args:
+                    if filter_name == 'drop_null':
+                        condition &= df[filter_args['column']].notna()
+                        continue
+                    if fit:
+                        outliers[filter_args['column']] = {'op': filter_args['op'], 'value': filter_args['value']}
+                    threshold = outliers[filter_args['column']]
+                    compare = self.filter_ops[threshold['op']]
+                    condition &= compare(df[filter_args['column']], threshold['value'])
+                df = self.transformer.product_related_outliers_transformation(df, condition)
+                df = df.copy(deep=False) # The filtered frame is already new - mark it as owned so later steps can write to it
+            else:
+                if name in self.fitted_steps:
+                    args = {**args, 'fit': fit}
+                result = getattr(self.transformer, name)(df, **args)
+                if result is not None:
+                    df = result
+        if output is not None and list(df.columns) != output:
+            df = df[output]
+        return df
+
+
+
+class OutOfCoreCleaner():
+    '''
+    Class to fit and run a CleaningPipeline over data read in chunks, for tables larger than memory.
+    The statistics are collected in passes over the chunks, each pass applying the steps fitted so far:
+        - modes (impute_categorical) from exact count tables
+        - group medians (impute_numerical, impute_numerical_pairs) from KLL quantile sketches, which are exact
+          until a group has more than quantile_k values and after that have a rank error of about 2/quantile_k
+        - BoxCox and Yeo-Johnson lambdas from the log-likelihood on a grid of lambdas, refined by a second pass on a finer grid
+          around the best point and a parabola fit, which puts lambda within about 1e-4 of the full-data optimum
+    Memory is bounded by the chunk size plus the sketches, whatever the number of rows
+    '''
+    def __init__(self, pipeline: CleaningPipeline, quantile_k: int = 8192) -> None:
+        self.pipeline = pipeline
+        self.quantile_k = quantile_k
+
+    def stat_pass(self, chunks: Callable[[], Iterator[pd.DataFrame]], planned: list, collect: Callable[[pd.DataFrame], None]) -> None:
+        '''
+        Reads all chunks once, applying the planned steps with the parameters fitted so far
+
+        Inputs:
+            Function returning a new iterator of chunks, the planned steps to apply, and a function collecting
+            statistics from each cleaned chunk
+
+        Returns:
+            None
+        '''
+        for chunk in chunks():
+            collect(self.pipeline.execute(chunk, planned, fit=False))
+
+    def fit(self, chunks: Callable[[], Iterator[pd.DataFrame]]) -> dict:
+        '''
+        Fits all the statistics of the pipeline, one group of independent steps per pass
+
+        Inputs:
+            Function returning a new iterator of chunks, e.g. lambda: pd.read_csv(file, chunksize=100000)
+
+        Returns:
+            Fitted parameters (also kept in the pipeline's transformer)
+        '''
+        transformer = self.pipeline.transformer
+        # The columns come from the first chunk, and the first pass carries on reading the same iterator
+        iterator = iter(chunks())
+        first = next(iterator, None)
+        if first is None:
+            return transformer.params
+        first_pass = [itertools.chain([first], iterator)]
+
+        def passes() -> Iterator[pd.DataFrame]:
+            return first_pass.pop() if first_pass else chunks()
+
+        try:
+            planned, _ = self.pipeline.plan(first.columns, fit=True)
+            for name, args in planned:
+                if name == 'mask':
+                    for filter_name, filter_args in args:
+                        if filter_name == 'filter':
+                            transformer.params['outliers'][filter_args['column']] = {'op': filter_args['op'], 'value': filter_args['value']}
+            position = 0
+            while position < len(planned):
+                if planned[position][0] not in self.pipeline.fitted_steps:
+                    position += 1
+                    continue
+                # Steps fitted in the same pass must not read what the others write
+                group = [planned[position]]
+                written = self.pipeline.step_columns(*planned[position])[1]
+                while position + len(group) < len(planned):
+                    name, args = planned[position + len(group)]
+                    if name not in self.pipeline.fitted_steps:
+                        break
+                    reads, writes, _ = self.pipeline.step_columns(name, args)
+                    if reads & written:
+                        break
+                    group.append((name, args))
+                    written |= writes
+                self.fit_group(passes, planned[:position], group)
+                position += len(group)
+        finally:
+            if hasattr(iterator, 'close'): # Releases e.g. the database connection of a stream no pass read to the end
+                iterator.close()
+        return transformer.params
+
+    def fit_group(self, chunks: Callable[[], Iterator[pd.DataFrame]], prefix: list, group: list) -> None:
+        '''
+        Fits a group of independent fitted steps in one pass (two for BoxCox and Yeo-Johnson) and stores their parameters
+
+        Inputs:
+            Function returning a new iterator of chunks, the planned steps before the group and the group of steps
+
+        Returns:
+            None
+        '''
+        params = self.pipeline.transformer.params
+        modes, medians, likelihoods, null_groups = {}, {}, {}, {}
+        for name, args in group:
+            if name == 'impute_categorical':
+                modes[args['column']] = db_sketches.CountTable()
+            elif name == 'skewness_boxcox_transformation':
+                likelihoods[args['column2']] = ({'constant': 0.0, **args}, db_sketches.BoxCoxLikelihood())
+            elif name == 'skewness_yeojohnson_transformation':
+                likelihoods[args['column2']] = ({'constant': 0.0, **args}, db_sketches.YeoJohnsonLikelihood())
+            else:
+                pairs = args['var_pairs'] if name == 'impute_numerical_pairs' else [[args['column1'], args['column2']]]
+                all_groups = name == 'impute_numerical' or args.get('fit_all_groups', False)
+                for column1, column2 in pairs:
+                    medians[column2] = (column1, {}, all_groups)
+                    null_groups[column2] = set()
+
+        def collect(df: pd.DataFrame) -> None:
+            for column, table in modes.items():
+                table.update(df[column])
+            for column2, (column1, sketches, _) in medians.items():
+                null_groups[column2].update(df.loc[df[column2].isna(), column1].dropna().unique().tolist())
+                for group_value, values in df[column2].groupby(df[column1]):
+                    sketches.setdefault(group_value, db_sketches.QuantileSketch(self.quantile_k)).update(values.to_numpy())
+            for column2, (args, likelihood) in likelihoods.items():
+                likelihood.update(df[args['column1']].to_numpy(dtype=float) + args['constant'])
+
+        self.stat_pass(chunks, prefix, collect)
+        for column, table in modes.items():
+            mode = table.mode()
+            params['impute_categorical'][column] = mode.item() if isinstance(mode, np.generic) else mode
+        for column2, (column1, sketches, all_groups) in medians.items():
+            params['impute_numerical'][column2] = {'group_column': column1,
+                                                   'medians': {key.item() if isinstance(key, np.generic) else key: sketch.median()
+                                                               for key, sketch in sketches.items()
+                                                               if all_groups or key in null_groups[column2]}}
+        if likelihoods:
+            # Second pass on a finer grid around each coarse optimum
+            refined = {column2: (args, type(likelihood)(np.linspace(-0.05, 0.05, 41) + likelihood.best_lambda()))
+                       for column2, (args, likelihood) in likelihoods.items()}
+            likelihoods.clear()
+            likelihoods.update(refined)
+            modes.clear()
+            medians.clear()
+            self.stat_pass(chunks, prefix, collect)
+            for column2, (args, likelihood) in likelihoods.items():
+                method = 'yeojohnson' if isinstance(likelihood, db_sketches.YeoJohnsonLikelihood) else 'boxcox'
+                params['skewness'][column2] = {'column': args['column1'], 'method': method,
+                                               'constant': float(args['constant']), 'lambda': likelihood.best_lambda()}
+
+    def transform(self, chunks: Callable[[], Iterator[pd.DataFrame]], executor: 'PartitionExecutor' = None) -> Iterator[pd.DataFrame]:
+        '''
+        Cleans the chunks one at a time with the fitted parameters
+
+        Inputs:
+            Function returning a new iterator of chunks, and optionally a PartitionExecutor to clean each chunk on several cores
+
+        Returns:
+            Iterator of cleaned chunks, e.g. to pass to stream_to_csv or a store's append
+        '''
+        for chunk in chunks():
+            if executor is not None:
+                yield executor.run(self.pipeline, chunk)
+            else:
+                yield self.pipeline.run(chunk, fit=False)
+
+
+class TransformSelector():
+    '''
+    Class to choose the skewness transformation of each numerical column, and the collinear columns to drop,
+    from the data instead of by eye. The candidates are log (of 1 + x), BoxCox after each of boxcox_constants is
+    added (to the column shifted to a minimum of 0 if it has negative values) and Yeo-Johnson, and all of them are
+    evaluated for all columns together, in three passes over the chunks:
+        1. minimum of each column, and a correlation sketch of the columns and the target
+        2. BoxCox and Yeo-Johnson log-likelihoods of every candidate on a grid of lambdas
+        3. moments of every candidate transformed with its fitted lambda
+    Each column gets the candidate with the smallest absolute skew. Of each pair of columns with an absolute
+    correlation above max_correlation, the one less correlated with the target (or, without a target, more correlated
+    with the other columns) is dropped, and if max_vif is set, columns are dropped one at a time while the largest
+    variance inflation factor is above it.
+    The choices are kept in the transformer's params (saved with save_params), so after load_params new data is
+    cleaned with skewness_steps and collinearity_steps without choosing again. Rows with nulls in the columns are
+    left out of the likelihoods and moments, so this is meant to be fitted on data after the null cleaning steps
+    '''
+    def __init__(self, transformer: DataFrameTransform = None, boxcox_constants: list = (1e-10, 0.01, 1.0),
+                 max_correlation: float = 0.9, max_vif: float = None) -> None:
+        self.transformer = transformer if transformer is not None else DataFrameTransform()
+        self.boxcox_constants = list(boxcox_constants)
+        self.max_correlation = max_correlation
+        self.max_vif = max_vif
+
+    def candidates(self, minimums: np.ndarray) -> list:
+        '''
+        Lists the candidate transformations of the columns
+
+        Inputs:
+            Array of the minimum of each column
+
+        Returns:
+            List of (method, column position, constant) tuples - log first, then BoxCox for each constant, then Yeo-Johnson
+        '''
+        shifts = np.maximum(-minimums, 0.0)
+        candidates = [('log', i, 1.0) for i in range(len(minimums))]
+        candidates += [('boxcox', i, float(shifts[i] + constant)) for constant in self.boxcox_constants for i in range(len(minimums))]
+        candidates += [('yeojohnson', i, 0.0) for i in range(len(minimums))]
+        return candidates
+
+    def fit(self, chunks: Union[pd.DataFrame, Callable[[], Iterator[pd.DataFrame]]], columns: list,
+            collinearity_columns: list = None, target: str = None) -> dict:
+        '''
+        Chooses the transformations and the columns to drop
+
+        Inputs:
+            Dataframe, or function returning a new iterator of chunks (e.g. lambda: cleaner.transform(read_chunks)),
+            the columns to transform, the columns to check for collinearity (default the columns to transform)
+            and optionally a target column to keep the columns most related to
+
+        Returns:
+            Chosen parameters (also kept in the transformer's params under 'selection')
+        '''
+        if isinstance(chunks, pd.DataFrame):
+            df = chunks
+            chunks = lambda: iter([df])
+        collinearity_columns = list(collinearity_columns) if collinearity_columns is not None else list(columns)
+        correlations = db_sketches.CorrelationSketch(collinearity_columns + ([target] if target is not None else []))
+        minimums = np.full(len(columns), np.inf)
+
+        def blocks() -> Iterator[np.ndarray]:
+            for chunk in chunks():
+                values = np.column_stack([chunk[column].to_numpy(dtype=float, na_value=np.nan) for column in columns])
+                yield chunk, values[~np.isnan(values).any(axis=1)]
+
+        for chunk, values in blocks():
+            correlations.update(chunk)
+            if len(values):
+                minimums = np.minimum(minimums, values.min(axis=0))
+        candidates = self.candidates(minimums)
+        boxcox_positions = [i for i, (method, _, _) in enumerate(candidates) if method == 'boxcox']
+        boxcox_columns = np.array([candidates[i][1] for i in boxcox_positions])
+        boxcox_constants = np.array([candidates[i][2] for i in boxcox_positions])
+        boxcox = db_sketches.BoxCoxLikelihood()
+        yeojohnson = db_sketches.YeoJohnsonLikelihood()
+        for _, values in blocks():
+            boxcox.update(values[:, boxcox_columns] + boxcox_constants)
+            yeojohnson.update(values)
+        boxcox_lambdas = boxcox.best_lambdas()
+        yeojohnson_lambdas = yeojohnson.best_lambdas()
+        moments = [db_sketches.MomentSketch() for _ in candidates]
+        for _, values in blocks():
+            with np.errstate(invalid='ignore', divide='ignore'):
+                transformed = np.hstack([np.log(values + 1.0),
+                                         special.boxcox(values[:, boxcox_columns] + boxcox_constants, boxcox_lambdas),
+                                         db_sketches.YeoJohnsonLikelihood.transform(values, yeojohnson_lambdas)])
+            transformed[~np.isfinite(transformed)] = np.nan
+            for i, sketch in enumerate(moments):
+                sketch.update(transformed[:, i])
+        rows = max(sketch.n for sketch in moments)
+        skews = np.array([sketch.skew() if sketch.n == rows else np.nan for sketch in moments]) # Candidates undefined for some values are left out
+        lambdas = np.concatenate([np.full(len(columns), np.nan), boxcox_lambdas, yeojohnson_lambdas])
+        skewness = {}
+        for i, column in enumerate(columns):
+            positions = [j for j, candidate in enumerate(candidates) if candidate[1] == i]
+            best = positions[int(np.nanargmin(np.abs(skews[positions])))]
+            method, _, constant = candidates[best]
+            skewness[column] = {'method': method, 'constant': constant, 'skew': float(skews[best]),
+                                'lambda': None if method == 'log' else float(lambdas[best])}
+        selection = {'skewness': skewness, 'drop': self.collinear_columns(correlations.correlation(), collinearity_columns, target)}
+        self.transformer.params['selection'] = selection
+        return selection
+
+    def collinear_columns(self, correlation: pd.DataFrame, columns: list, target: str = None) -> list:
+        '''
+        Chooses the columns to drop from a correlation matrix
+
+        Inputs:
+            Correlation matrix, the columns to check and optionally the target column
+
+        Returns:
+            List of columns to drop
+        '''
+        kept = list(columns)
+        dropped = []
+        absolute = correlation.abs()
+        while len(kept) > 1:
+            pairs = absolute.loc[kept, kept].where(~np.eye(len(kept), dtype=bool))
+            if not pairs.max().max() > self.max_correlation:
+                break
+            column1, column2 = pairs.stack().idxmax()
+            if target is not None:
+                relevance = absolute.loc[[column1, column2], target]
+            else:
+                relevance = -pairs.loc[[column1, column2]].mean(axis=1)
+            column = relevance.idxmin()
+            kept.remove(column)
+            dropped.append(column)
+        while self.max_vif is not None and len(kept) > 1:
+            vif = pd.Series(np.diag(np.linalg.pinv(correlation.loc[kept, kept].to_numpy())), index=kept)
+            if not vif.max() > self.max_vif:
+                break
+            kept.remove(vif.idxmax())
+            dropped.append(vif.idxmax())
+        return dropped
+
+    def skewness_steps(self) -> list:
+        '''
+        Returns the chosen transformations as cleaning steps, writing each column to 'transformed_' + column
+
+        Inputs:
+            None
+
+        Returns:
+            List of steps for CleaningPipeline
+        '''
+        steps = []
+        for column, choice in self.transformer.params['selection']['skewness'].items():
+            args = {'column1': column, 'column2': 'transformed_' + column}
+            if choice['method'] == 'log':
+                steps.append(('skewness_log_transformation', args))
+            elif choice['method'] == 'boxcox':
+                steps.append(('skewness_boxcox_transformation', {**args, 'constant': choice['constant']}))
+            else:
+                steps.append(('skewness_yeojohnson_transformation', args))
+        return steps
+
+    def collinearity_steps(self) -> list:
+        '''
+        Returns the chosen columns to drop, with their transformed columns, as cleaning steps
+
+        Inputs:
+            None
+
+        Returns:
+            List of steps for CleaningPipeline (empty if nothing is dropped)
+        '''
+        selection = self.transformer.params['selection']
+        dropped = list(selection['drop'])
+        dropped += ['transformed_' + column for column in selection['drop'] if column in selection['skewness']]
+        return [('drop_columns', {'columns': dropped})] if dropped else []
+
+
+
+def cleaning_steps(skewness_steps: list = None, collinearity_steps: list = None) -> list:
+    '''
+    Returns the cleaning steps of the customer_activity data, from the null cleaning to the ordering of the columns
+
+    Inputs:
+        Optionally skewness and collinearity steps to use instead of SKEWNESS_STEPS and COLLINEARITY_STEPS
+        (e.g. from TransformSelector)
+
+    Returns:
+        List of steps for CleaningPipeline, ordering the columns of COLUMN_ORDER which are not dropped
+    '''
+    skewness_steps = skewness_steps if skewness_steps is not None else SKEWNESS_STEPS
+    collinearity_steps = collinearity_steps if collinearity_steps is not None else COLLINEARITY_STEPS
+    dropped = [column for name, args in collinearity_steps for column in args['columns']]
+    ordering_steps = [('order_columns', {'columns': [column for column in COLUMN_ORDER if column not in dropped]})]
+    return NULL_STEPS + OUTLIER_STEPS + skewness_steps + collinearity_steps + ordering_steps
+
+
+def clean_partition(pipeline: CleaningPipeline, n_rows: int, inputs: list, outputs: list, start: int, stop: int) -> tuple:
+    '''
+    Cleans rows start:stop of a dataframe held in shared memory and writes the kept rows to the start of the same
+    rows of the output buffers - run in the worker processes of PartitionExecutor
+
+    Inputs:
+        Fitted pipeline, number of rows, input and output column specs (column, kind, shared memory name, dtype and
+        categories for inputs), and the partition's first and last row
+
+    Returns:
+        Tuple of (number of rows kept, dictionary of the categories of each categorical output column)
+    '''
+    handles = []
+    try:
+        data = {}
+        for column, kind, name, dtype, categories in inputs:
+            handles.append(SharedMemory(name=name))
+            values = np.ndarray((n_rows,), dtype=dtype, buffer=handles[-1].buf)[start:stop]
+            data[column] = pd.Categorical.from_codes(values, categories) if kind == 'codes' else values
+        part = pd.DataFrame(data, index=pd.RangeIndex(start, stop), copy=False)
+        cleaned = pipeline.run(part, fit=False)
+        kept = len(cleaned)
+        categories = {}
+        for column, kind, name, dtype in outputs:
+            handles.append(SharedMemory(name=name))
+            out = np.ndarray((n_rows,), dtype=dtype, buffer=handles[-1].buf)[start:start + kept]
+            if column is None: # Row positions, to rebuild the index
+                out[:] = cleaned.index.to_numpy()
+            elif kind == 'codes':
+                out[:] = cleaned[column].cat.codes.to_numpy()
+                categories[column] = cleaned[column].cat.categories.tolist()
+            else:
+                out[:] = cleaned[column].to_numpy()
+        return kept, categories
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+class PartitionExecutor():
+    '''
+    Class to run a fitted CleaningPipeline (fit=False, where every step only needs its own rows) on row partitions
+    in a process pool. Columns are placed once in shared memory (strings and categories as integer codes), workers
+    read their rows from there and write the kept rows back to shared output buffers, and the partitions are
+    reassembled in their original order
+    '''
+    def __init__(self, n_workers: int = None, n_partitions: int = None) -> None:
+        self.n_workers = n_workers if n_workers is not None else os.cpu_count()
+        self.n_partitions = n_partitions if n_partitions is not None else self.n_workers
+
+    def run(self, pipeline: CleaningPipeline, df: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Cleans a dataframe partition by partition in parallel
+
+        Inputs:
+            Pipeline whose transformer has fitted params, and dataframe
+
+        Returns:
+            Cleaned dataframe, the same as pipeline.run(df, fit=False)
+        '''
+        sample = pipeline.run(df.head(1000).copy(), fit=False) # Output columns and dtypes
+        n_rows = len(df)
+        handles = []
+
+        def shared_array(values: np.ndarray) -> SharedMemory:
+            handles.append(SharedMemory(create=True, size=max(values.nbytes, 1)))
+            np.ndarray(values.shape, dtype=values.dtype, buffer=handles[-1].buf)[:] = values
+            return handles[-1]
+
+        try:
+            inputs = []
+            for column in df.columns:
+                series = df[column]
+                if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object:
+                    categorical = series.astype('category') if series.dtype == object else series
+                    codes = categorical.cat.codes.to_numpy()
+                    inputs.append((column, 'codes', shared_array(codes).name, codes.dtype, categorical.cat.categories.tolist()))
+                else:
+                    values = series.to_numpy(dtype=float, na_value=np.nan) if pd.api.types.is_extension_array_dtype(series.dtype) else series.to_numpy()
+                    inputs.append((column, 'values', shared_array(values).name, values.dtype, None))
+            outputs = [(None, 'values', shared_array(np.zeros(n_rows, dtype=np.int64)).name, np.dtype(np.int64))]
+            for column in sample.columns:
+                if isinstance(sample[column].dtype, pd.CategoricalDtype):
+                    kind, dtype = 'codes', np.dtype(np.int32)
+                else:
+                    kind, dtype = 'values', sample[column].dtype
+                outputs.append((column, kind, shared_array(np.zeros(n_rows, dtype=dtype)).name, dtype))
+            bounds = np.linspace(0, n_rows, self.n_partitions + 1).astype(int)
+            with ProcessPoolExecutor(max_workers=self.n_workers) as pool:
+                futures = [pool.submit(clean_partition, pipeline, n_rows, inputs, outputs, bounds[i], bounds[i+1])
+                           for i in range(self.n_partitions)]
+                results = [future.result() for future in futures]
+            # Reassembling in partition order
+            data = {}
+            for (column, kind, name, dtype), handle in zip(outputs, handles[len(inputs):]):
+                buffer = np.ndarray((n_rows,), dtype=dtype, buffer=handle.buf)
+                parts = [buffer[bounds[i]:bounds[i] + kept] for i, (kept, _) in enumerate(results)]
+                if kind == 'codes':
+                    categories = pd.Index(pd.unique(np.array([c for _, part_categories in results for c in part_categories[column]], dtype=object)))
+                    parts = [np.append(categories.get_indexer(part_categories[column]), -1)[part] if len(part) else part # Null codes stay -1
+                             for part, (_, part_categories) in zip(parts, results)]
+                    data[column] = pd.Categorical.from_codes(np.concatenate(parts), categories)
+                else:
+                    data[column] = np.concatenate(parts)
+            index = df.index[data.pop(None)]
+            cleaned = pd.DataFrame(data, index=index)
+            return cleaned
+        finally:
+            for handle in handles:
+                handle.close()
+                handle.unlink()
@@ -0,0 +1,793 @@
+import copy
+import pickle
+import numpy as np
+import pandas as pd
+from scipy import special
+from typing import Union
+
+
+class CountTable():
+    '''
+    Mergeable table of value counts - exact modes and distributions of categorical columns, in memory
+    proportional to the number of distinct values
+    '''
+    def __init__(self) -> None:
+        self.counts = pd.Series(dtype=float)
+
+    def update(self, values: pd.Series) -> None:
+        '''
+        Adds the non-null values of a chunk
+
+        Inputs:
+            Series of values
+
+        Returns:
+            None
+        '''
+        self.counts = self.counts.add(values.value_counts(dropna=True), fill_value=0)
+
+    def merge(self, other: 'CountTable') -> None:
+        '''
+        Adds the counts of another table
+
+        Inputs:
+            Count table
+
+        Returns:
+            None
+        '''
+        self.counts = self.counts.add(other.counts, fill_value=0)
+
+    def mode(self):
+        '''
+        Returns the most frequent value - the smallest one if there is a tie, as pandas' mode().iloc[0] does
+
+        Inputs:
+            None
+
+        Returns:
+            Modal value
+        '''
+        top = self.counts[self.counts == self.counts.max()]
+        return top.index.sort_values()[0]
+
+
+class QuantileSketch():
+    '''
+    Mergeable KLL quantile sketch. Values are kept exactly until more than k have been added, after which
+    full levels are compacted (every other sorted value is kept, with double weight). The rank error of a
+    quantile is then about 2/k of the number of values with high probability, in memory of about 3k values
+    '''
+    def __init__(self, k: int = 8192, seed: int = 0) -> None:
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def capacity(self, level: int) -> int:
+        '''
+        Returns the number of values a level can hold - levels lower than the top get geometrically smaller
+
+        Inputs:
+            Level
+
+        Returns:
+            Capacity
+        '''
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - level - 1))))
+
+    def compact(self) -> None:
+        '''
+        Compacts every level over its capacity into the level above
+
+        Inputs:
+            None
+
+        Returns:
+            None
+        '''
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                values = np.sort(self.levels[level])
+                keep = values[-1:] if len(values) % 2 else values[:0]
+                values = values[:len(values) - len(keep)]
+                promoted = values[self.rng.integers(2)::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def update(self, values: np.ndarray) -> None:
+        '''
+        Adds the non-null values of a chunk
+
+        Inputs:
+            Array of values
+
+        Returns:
+            None
+        '''
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        self.n += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compact()
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        '''
+        Adds the values summarised by another sketch
+
+        Inputs:
+            Quantile sketch
+
+        Returns:
+            None
+        '''
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, values in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], values])
+        self.n += other.n
+        self.compact()
+
+    def is_exact(self) -> bool:
+        '''
+        Checks whether no values have been compacted yet, i.e. quantiles are exact
+
+        Inputs:
+            None
+
+        Returns:
+            True if exact
+        '''
+        return len(self.levels) == 1
+
+    def quantile(self, q: float) -> float:
+        '''
+        Returns a quantile - exact (with the same interpolation as pandas) while is_exact(), else within the rank error
+
+        Inputs:
+            Quantile between 0 and 1
+
+        Returns:
+            Quantile value, NaN if the sketch is empty
+        '''
+        if self.n == 0:
+            return np.nan
+        if self.is_exact():
+            return float(np.quantile(self.levels[0], q))
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** i) for i, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        position = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+        return float(values[order][min(position, len(values) - 1)])
+
+    def rank(self, values: np.ndarray) -> np.ndarray:
+        '''
+        Returns the (mid) rank of values as a fraction of the values summarised - ties get the average of their ranks,
+        so these are exact fractional ranks while is_exact(), else within the rank error
+
+        Inputs:
+            Array of values
+
+        Returns:
+            Array of fractional ranks between 0 and 1 (NaN for null values)
+        '''
+        values = np.asarray(values, dtype=float)
+        if self.n == 0:
+            return np.full(len(values), np.nan)
+        summary = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** i) for i, level in enumerate(self.levels)])
+        order = np.argsort(summary, kind='stable')
+        summary = summary[order]
+        cumulative = np.concatenate([[0.0], np.cumsum(weights[order])])
+        below = cumulative[np.searchsorted(summary, values, side='left')]
+        up_to = cumulative[np.searchsorted(summary, values, side='right')]
+        ranks = (below + up_to) / 2 / cumulative[-1]
+        ranks[np.isnan(values)] = np.nan
+        return ranks
+
+    def median(self) -> float:
+        '''
+        Returns the median
+
+        Inputs:
+            None
+
+        Returns:
+            Median value
+        '''
+        if self.n and self.is_exact():
+            return float(np.median(self.levels[0]))
+        return self.quantile(0.5)
+
+
+class BoxCoxLikelihood():
+    '''
+    Mergeable BoxCox log-likelihood over a grid of lambdas. For each lambda it keeps the count, mean and sum of
+    squared deviations of the transformed values (combined across chunks with Chan's formula), and the sum of
+    log values, which is all the likelihood needs. The fitted lambda is the best grid point refined by
+    fitting a parabola through it and its neighbours. Several columns are accumulated together by passing
+    (rows x columns) arrays, and best_lambdas then fits one lambda per column
+    '''
+    block_size = 4096
+
+    @staticmethod
+    def transform(values: np.ndarray, lambdas: np.ndarray) -> np.ndarray:
+        '''
+        Transforms values at every lambda of the grid
+
+        Inputs:
+            Array of values with a trailing axis of length 1, and the lambdas
+
+        Returns:
+            Array of transformed values, with a trailing lambda axis
+        '''
+        return special.boxcox(values, lambdas)
+
+    @staticmethod
+    def log_terms(values: np.ndarray) -> np.ndarray:
+        '''
+        Returns the terms whose sum is multiplied by (lambda - 1) in the log-likelihood
+
+        Inputs:
+            Array of values
+
+        Returns:
+            Array of terms
+        '''
+        return np.log(values)
+
+    def __init__(self, lambdas: np.ndarray = None) -> None:
+        self.lambdas = np.asarray(lambdas) if lambdas is not None else np.linspace(-3, 3, 121)
+        self.n = 0
+        self.means = np.zeros(len(self.lambdas))
+        self.squares = np.zeros(len(self.lambdas))
+        self.log_sum = 0.0
+
+    def update(self, values: np.ndarray) -> None:
+        '''
+        Adds the (positive, non-null) values of a chunk
+
+        Inputs:
+            Array of values, or (rows x columns) array for several columns
+
+        Returns:
+            None
+        '''
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        block_size = max(1, self.block_size // (values.shape[1] if values.ndim == 2 else 1))
+        if len(values) > block_size: # Keeps the (rows x lambdas) array small
+            for start in range(0, len(values), block_size):
+                self.update(values[start:start + block_size])
+            return
+        transformed = self.transform(values[..., None], self.lambdas)
+        n = len(values)
+        means = transformed.mean(axis=0)
+        squares = ((transformed - means) ** 2).sum(axis=0)
+        total = self.n + n
+        delta = means - self.means
+        self.squares = self.squares + squares + delta ** 2 * self.n * n / total
+        self.means = self.means + delta * n / total
+        self.n = total
+        self.log_sum = self.log_sum + self.log_terms(values).sum(axis=0)
+
+    def merge(self, other: 'BoxCoxLikelihood') -> None:
+        '''
+        Adds another accumulator over the same lambda grid
+
+        Inputs:
+            BoxCox likelihood accumulator
+
+        Returns:
+            None
+        '''
+        if other.n == 0:
+            return
+        total = self.n + other.n
+        delta = other.means - self.means
+        self.squares = self.squares + other.squares + delta ** 2 * self.n * other.n / total
+        self.means = self.means + delta * other.n / total
+        self.n = total
+        self.log_sum = self.log_sum + other.log_sum
+
+    def log_likelihood(self) -> np.ndarray:
+        '''
+        Returns the log-likelihood at every lambda of the grid
+
+        Inputs:
+            None
+
+        Returns:
+            Array of log-likelihoods ((columns x lambdas) for several columns)
+        '''
+        return (self.lambdas - 1) * np.expand_dims(self.log_sum, -1) - self.n / 2 * np.log(self.squares / self.n)
+
+    def best_lambda(self) -> float:
+        '''
+        Returns the lambda maximising the log-likelihood
+
+        Inputs:
+            None
+
+        Returns:
+            Lambda
+        '''
+        return self.refine(self.log_likelihood())
+
+    def best_lambdas(self) -> np.ndarray:
+        '''
+        Returns the lambda maximising the log-likelihood of each column, when several columns were accumulated
+
+        Inputs:
+            None
+
+        Returns:
+            Array of lambdas
+        '''
+        return np.array([self.refine(llf) for llf in np.atleast_2d(self.log_likelihood())])
+
+    def refine(self, llf: np.ndarray) -> float:
+        '''
+        Returns the best grid lambda, refined with a parabola through its neighbours
+
+        Inputs:
+            Log-likelihood at every lambda of the grid
+
+        Returns:
+            Lambda
+        '''
+        i = int(np.nanargmax(llf))
+        if 0 < i < len(llf) - 1:
+            x = self.lambdas[i-1:i+2]
+            a, b, _ = np.polyfit(x - x[1], llf[i-1:i+2], 2)
+            if a < 0:
+                return float(x[1] - b / (2 * a))
+        return float(self.lambdas[i])
+
+
+class YeoJohnsonLikelihood(BoxCoxLikelihood):
+    '''
+    Mergeable Yeo-Johnson log-likelihood over a grid of lambdas, accumulated as BoxCoxLikelihood. Yeo-Johnson is
+    BoxCox of 1 + x for non-negative values and minus BoxCox of 1 - x with 2 - lambda for negative ones, so any
+    non-null values can be added
+    '''
+    @staticmethod
+    def transform(values: np.ndarray, lambdas: np.ndarray) -> np.ndarray:
+        '''
+        Transforms values at every lambda of the grid
+
+        Inputs:
+            Array of values with a trailing axis of length 1, and the lambdas
+
+        Returns:
+            Array of transformed values, with a trailing lambda axis
+        '''
+        return np.where(values >= 0, special.boxcox(1 + np.abs(values), lambdas), -special.boxcox(1 + np.abs(values), 2 - lambdas))
+
+    @staticmethod
+    def log_terms(values: np.ndarray) -> np.ndarray:
+        '''
+        Returns the terms whose sum is multiplied by (lambda - 1) in the log-likelihood
+
+        Inputs:
+            Array of values
+
+        Returns:
+            Array of terms
+        '''
+        return np.sign(values) * np.log1p(np.abs(values))
+
+
+class MomentSketch():
+    '''
+    Mergeable count, mean, minimum, maximum and central moment sums up to the fourth, combined across chunks with
+    Pébay's formulas. Mean, variance, skew and kurtosis are exact up to floating point error
+    '''
+    def __init__(self) -> None:
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.m3 = 0.0
+        self.m4 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values: np.ndarray) -> None:
+        '''
+        Adds the non-null values of a chunk
+
+        Inputs:
+            Array of values
+
+        Returns:
+            None
+        '''
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        chunk = MomentSketch()
+        chunk.n = len(values)
+        chunk.mean = values.mean()
+        deviations = values - chunk.mean
+        squares = deviations * deviations
+        chunk.m2 = squares.sum()
+        chunk.m3 = (squares * deviations).sum()
+        chunk.m4 = (squares * squares).sum()
+        chunk.min = values.min()
+        chunk.max = values.max()
+        self.merge(chunk)
+
+    def merge(self, other: 'MomentSketch') -> None:
+        '''
+        Adds the values summarised by another sketch
+
+        Inputs:
+            Moment sketch
+
+        Returns:
+            None
+        '''
+        if other.n == 0:
+            return
+        na, nb = self.n, other.n
+        n = na + nb
+        delta = other.mean - self.mean
+        m2 = self.m2 + other.m2 + delta ** 2 * na * nb / n
+        m3 = (self.m3 + other.m3 + delta ** 3 * na * nb * (na - nb) / n ** 2
+              + 3 * delta * (na * other.m2 - nb * self.m2) / n)
+        m4 = (self.m4 + other.m4 + delta ** 4 * na * nb * (na ** 2 - na * nb + nb ** 2) / n ** 3
+              + 6 * delta ** 2 * (na ** 2 * other.m2 + nb ** 2 * self.m2) / n ** 2
+              + 4 * delta * (na * other.m3 - nb * self.m3) / n)
+        self.mean = self.mean + delta * nb / n
+        self.m2, self.m3, self.m4 = m2, m3, m4
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def std(self) -> float:
+        '''
+        Returns the sample standard deviation, as Series.std
+
+        Inputs:
+            None
+
+        Returns:
+            Standard deviation, NaN for fewer than 2 values
+        '''
+        return float(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else np.nan
+
+    def skew(self) -> float:
+        '''
+        Returns the bias-corrected skew, as Series.skew
+
+        Inputs:
+            None
+
+        Returns:
+            Skew, NaN for fewer than 3 values
+        '''
+        n = self.n
+        if n < 3:
+            return np.nan
+        if self.m2 == 0:
+            return 0.0
+        return float(np.sqrt(n * (n - 1)) / (n - 2) * (self.m3 / n) / (self.m2 / n) ** 1.5)
+
+    def kurtosis(self) -> float:
+        '''
+        Returns the bias-corrected excess kurtosis, as Series.kurt
+
+        Inputs:
+            None
+
+        Returns:
+            Kurtosis, NaN for fewer than 4 values
+        '''
+        n = self.n
+        if n < 4:
+            return np.nan
+        if self.m2 == 0:
+            return 0.0
+        return float((n + 1) * n * (n - 1) * self.m4 / ((n - 2) * (n - 3) * self.m2 ** 2) - 3 * (n - 1) ** 2 / ((n - 2) * (n - 3)))
+
+
+class HyperLogLog():
+    '''
+    Mergeable HyperLogLog distinct count. Values are hashed to 64 bits, the first p bits pick one of 2^p registers,
+    which keeps the longest run of leading zeros seen in the remaining bits. The relative error is about 1.04 / sqrt(2^p)
+    (0.8% for the default p = 14, in 16KB)
+    '''
+    def __init__(self, p: int = 14) -> None:
+        self.p = p
+        self.registers = np.zeros(2 ** p, dtype=np.uint8)
+
+    def update(self, values: Union[pd.Series, np.ndarray]) -> None:
+        '''
+        Adds the non-null values of a chunk - numbers are hashed as floats, so 1 and 1.0 are the same value
+
+        Inputs:
+            Series or array of values
+
+        Returns:
+            None
+        '''
+        values = pd.Series(values)
+        values = values[values.notna()]
+        if len(values) == 0:
+            return
+        if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+            array = values.to_numpy(dtype=float)
+        else:
+            array = values.astype(str).to_numpy(dtype=object)
+        hashes = pd.util.hash_array(array, categorize=False)
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = (hashes & np.uint64((1 << (64 - self.p)) - 1)).astype(float) # Exact - fewer than 53 bits
+        bit_length = np.where(rest > 0, np.frexp(rest)[1], 0)
+        rank = (64 - self.p - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        '''
+        Adds the values summarised by another sketch with the same p
+
+        Inputs:
+            HyperLogLog sketch
+
+        Returns:
+            None
+        '''
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> float:
+        '''
+        Returns the estimated number of distinct values
+
+        Inputs:
+            None
+
+        Returns:
+            Estimate
+        '''
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m ** 2 / np.sum(2.0 ** -self.registers.astype(float))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros > 0: # Linear counting is more accurate for small counts
+            estimate = m * np.log(m / zeros)
+        return float(estimate)
+
+
+class ColumnSketch():
+    '''
+    Mergeable statistics of a column - row and null counts, a distinct count, and moments and quantiles for numeric
+    columns or value counts for the others. Partitions or daily batches are sketched separately and merged,
+    and DataFrameInfo.sketch_profile turns merged sketches into a profile
+    '''
+    def __init__(self, dtype: str, numeric: bool, k: int = 8192, p: int = 14) -> None:
+        self.dtype = dtype
+        self.numeric = numeric
+        self.rows = 0
+        self.nulls = 0
+        self.distinct = HyperLogLog(p)
+        self.moments = MomentSketch() if numeric else None
+        self.quantiles = QuantileSketch(k) if numeric else None
+        self.counts = None if numeric else CountTable()
+
+    def update(self, values: pd.Series) -> None:
+        '''
+        Adds a chunk of the column
+
+        Inputs:
+            Series
+
+        Returns:
+            None
+        '''
+        nulls = int(values.isna().sum())
+        self.rows += len(values)
+        self.nulls += nulls
+        self.distinct.update(values)
+        if self.numeric:
+            array = values.to_numpy(dtype=float, na_value=np.nan)
+            self.moments.update(array)
+            self.quantiles.update(array)
+        else:
+            self.counts.update(values)
+
+    def merge(self, other: 'ColumnSketch') -> None:
+        '''
+        Adds the chunks summarised by another sketch of the same column
+
+        Inputs:
+            Column sketch
+
+        Returns:
+            None
+        '''
+        self.rows += other.rows
+        self.nulls += other.nulls
+        self.distinct.merge(other.distinct)
+        if self.numeric:
+            self.moments.merge(other.moments)
+            self.quantiles.merge(other.quantiles)
+        else:
+            self.counts.merge(other.counts)
+
+    def statistics(self) -> tuple:
+        '''
+        Returns the statistics in the layout of DataFrameInfo.column_statistics
+
+        Inputs:
+            None
+
+        Returns:
+            Tuple of a dictionary of statistics and the value counts (None for numeric columns)
+        '''
+        statistics = {'dtype': self.dtype, 'numeric': self.numeric, 'count': self.rows - self.nulls, 'nulls': self.nulls}
+        if not self.numeric:
+            counts = self.counts.counts.sort_values(ascending=False, kind='stable').astype(int)
+            statistics.update(unique=int((counts > 0).sum()), top=counts.index[0] if len(counts) else None,
+                              freq=int(counts.iloc[0]) if len(counts) else 0)
+            return statistics, counts
+        if self.moments.n == 0:
+            return statistics, None
+        statistics.update({'mean': self.moments.mean, 'std': self.moments.std(), 'min': self.moments.min,
+                           '25%': self.quantiles.quantile(0.25), '50%': self.quantiles.quantile(0.5),
+                           '75%': self.quantiles.quantile(0.75), 'max': self.moments.max,
+                           'skew': self.moments.skew(), 'kurtosis': self.moments.kurtosis(),
+                           'unique': int(round(self.distinct.count()))})
+        return statistics, None
+
+
+def save_sketches(sketches: dict, file: str) -> None:
+    '''
+    Saves a dictionary of sketches (e.g. the column sketches of one day) to a file
+
+    Inputs:
+        Dictionary of sketches and file name
+
+    Returns:
+        None
+    '''
+    with open(file, 'wb') as f:
+        pickle.dump(sketches, f)
+
+
+def load_sketches(file: str) -> dict:
+    '''
+    Loads a dictionary of sketches saved with save_sketches
+
+    Inputs:
+        File name
+
+    Returns:
+        Dictionary of sketches
+    '''
+    with open(file, 'rb') as f:
+        return pickle.load(f)
+
+
+class CorrelationSketch():
+    '''
+    Mergeable pairwise-complete correlation matrix. Each chunk adds, for every pair of columns, the count of rows where
+    both are present, their sums, sums of squares and cross-products - all from one matrix product of
+    [present mask | values | squared values] with itself. Values are shifted by the first chunk's means to keep the
+    sums well conditioned. Given quantile sketches of the columns (e.g. from ColumnSketch), values are replaced by their
+    ranks first, which gives Spearman correlations - with each column ranked over all its values rather than per pair,
+    so with nulls they differ slightly from DataFrame.corr('spearman')
+    '''
+    def __init__(self, columns: list, ranks: dict = None, block_size: int = 65536) -> None:
+        self.columns = list(columns)
+        self.ranks = ranks
+        self.block_size = block_size
+        self.shift = None
+        self.products = np.zeros((3 * len(self.columns), 3 * len(self.columns)))
+
+    def update(self, df: pd.DataFrame) -> None:
+        '''
+        Adds a chunk of rows
+
+        Inputs:
+            DataFrame with the columns
+
+        Returns:
+            None
+        '''
+        values = np.column_stack([df[column].to_numpy(dtype=float, na_value=np.nan) for column in self.columns]) \
+            if len(self.columns) else np.empty((len(df), 0))
+        if self.ranks is not None:
+            values = np.column_stack([self.ranks[column].rank(values[:, i]) for i, column in enumerate(self.columns)])
+        if self.shift is None:
+            with np.errstate(invalid='ignore'):
+                self.shift = np.nan_to_num(np.nanmean(values, axis=0)) if len(values) else np.zeros(len(self.columns))
+        for start in range(0, len(values), self.block_size):
+            block = values[start:start + self.block_size] - self.shift
+            present = ~np.isnan(block)
+            block = np.where(present, block, 0.0)
+            stacked = np.hstack([present.astype(float), block, block * block])
+            self.products += stacked.T @ stacked
+
+    def reshift(self, shift: np.ndarray) -> None:
+        '''
+        Re-expresses the sums relative to another shift, so sketches with different shifts can be merged
+
+        Inputs:
+            Array of shifts, one per column
+
+        Returns:
+            None
+        '''
+        if self.shift is None:
+            self.shift = shift
+            return
+        p = len(self.columns)
+        counts, sums, squares, cross = self.statistics()
+        d = shift - self.shift
+        new_sums = sums - d[:, None] * counts
+        new_squares = squares - 2 * d[:, None] * sums + (d ** 2)[:, None] * counts
+        new_cross = cross - d[None, :] * sums - d[:, None] * sums.T + np.outer(d, d) * counts
+        self.products[:p, :p] = counts
+        self.products[p:2 * p, :p] = new_sums
+        self.products[:p, p:2 * p] = new_sums.T
+        self.products[2 * p:, :p] = new_squares
+        self.products[:p, 2 * p:] = new_squares.T
+        self.products[p:2 * p, p:2 * p] = new_cross
+        self.shift = shift
+
+    def merge(self, other: 'CorrelationSketch') -> None:
+        '''
+        Adds the rows summarised by another sketch of the same columns
+
+        Inputs:
+            Correlation sketch
+
+        Returns:
+            None
+        '''
+        if other.shift is None:
+            return
+        if self.shift is None:
+            self.shift = other.shift
+        elif not np.array_equal(self.shift, other.shift):
+            other = copy.deepcopy(other)
+            other.reshift(self.shift)
+        self.products += other.products
+
+    def statistics(self) -> tuple:
+        '''
+        Returns the pairwise statistics of the (shifted) values - element [i, j] is over the rows where both column i
+        and column j are present
+
+        Inputs:
+            None
+
+        Returns:
+            Tuple of the count, sum of column i, sum of squares of column i and cross-product matrices
+        '''
+        p = len(self.columns)
+        return (self.products[:p, :p], self.products[p:2 * p, :p], self.products[2 * p:, :p], self.products[p:2 * p, p:2 * p])
+
+    def correlation(self) -> pd.DataFrame:
+        '''
+        Returns the correlation matrix (Pearson, or Spearman when built with ranks)
+
+        Inputs:
+            None
+
+        Returns:
+            Dataframe indexed by the columns both ways, NaN where a pair has fewer than 2 rows or no variance
+        '''
+        counts, sums, squares, cross = self.statistics()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            covariance = counts * cross - sums * sums.T
+            variance = counts * squares - sums ** 2
+            correlation = covariance / np.sqrt(variance * variance.T)
+        correlation[counts < 2] = np.nan
+        correlation = np.clip(correlation, -1, 1)
+        return pd.DataFrame(correlation, index=self.columns, columns=self.columns)
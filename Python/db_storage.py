@@ -0,0 +1,181 @@
+import os
+import shutil
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+class DataStore():
+    '''
+    This is class created for defining methods to store dataframes in a columnar format on disk.
+    Subclasses set the file format - dtypes (including categories and ints) are kept through the pandas metadata
+    '''
+    file_format = None
+
+    def __init__(self) -> None:
+        pass
+
+    def write(self, df: pd.DataFrame, path: str, partition_cols: list = None) -> None:
+        '''
+        Writes a dataframe to a store directory, replacing what was there. The files are written to a sibling
+        directory which is then renamed into place, so a failed write leaves the previous store as it was
+
+        Inputs:
+            Dataframe, directory of the store and optionally columns to partition the files by
+
+        Returns:
+            None
+        '''
+        path = os.path.normpath(path)
+        temp_path = f'{path}.tmp-{uuid.uuid4().hex}'
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            ds.write_dataset(table, temp_path, format=self.file_format,
+                             partitioning=partition_cols, partitioning_flavor='hive' if partition_cols else None)
+        except BaseException:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+        if os.path.isdir(path):
+            old_path = f'{path}.old-{uuid.uuid4().hex}'
+            os.replace(path, old_path)
+            os.replace(temp_path, path)
+            shutil.rmtree(old_path)
+        else:
+            os.replace(temp_path, path)
+
+    def append(self, df: pd.DataFrame, path: str, partition_cols: list = None) -> None:
+        '''
+        Appends a dataframe to a store directory as new files, leaving existing files untouched
+
+        Inputs:
+            Dataframe, directory of the store and optionally columns to partition the files by
+
+        Returns:
+            None
+        '''
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        ds.write_dataset(table, path, format=self.file_format,
+                         partitioning=partition_cols, partitioning_flavor='hive' if partition_cols else None,
+                         basename_template=f'part-{uuid.uuid4().hex}-{{i}}.{self.file_format}',
+                         existing_data_behavior='overwrite_or_ignore')
+
+    def dataset(self, path: str) -> ds.Dataset:
+        '''
+        Opens the store directory as a pyarrow dataset
+
+        Inputs:
+            Directory of the store
+
+        Returns:
+            Pyarrow dataset
+        '''
+        partitioning = ds.HivePartitioning.discover(infer_dictionary=True)
+        return ds.dataset(path, format=self.file_format, partitioning=partitioning)
+
+    def read(self, path: str, columns: list = None, filters: list = None) -> pd.DataFrame:
+        '''
+        Reads a store into a dataframe, only reading the requested columns and the row groups/partitions
+        which can match the filters
+
+        Inputs:
+            Directory of the store, optionally list of columns and filters as a list of (column, op, value) tuples,
+            e.g. [('region', 'in', ['Asia', 'Oceania']), ('page_values', '>', 0)], or as a pyarrow expression
+
+        Returns:
+            Dataframe
+        '''
+        dataset = self.dataset(path)
+        if isinstance(filters, ds.Expression):
+            expression = filters
+        else:
+            expression = pq.filters_to_expression(filters) if filters else None
+        table = dataset.to_table(columns=columns, filter=expression)
+        df = table.to_pandas()
+        return df
+
+    def distinct(self, path: str, column: str) -> list:
+        '''
+        Returns the distinct values of a column - only the one column is read, and category columns are
+        dictionary encoded, so this is cheap
+
+        Inputs:
+            Directory of the store and column
+
+        Returns:
+            List of values (without nulls)
+        '''
+        values = self.dataset(path).to_table(columns=[column]).column(column).unique()
+        if isinstance(values, pa.DictionaryArray):
+            values = values.dictionary.take(values.indices.drop_null())
+        return values.drop_null().to_pylist()
+
+    def max(self, path: str, column: str):
+        '''
+        Returns the largest value of a column - parquet files answer from their row group statistics, so only their
+        footers are read, and other files read the one column
+
+        Inputs:
+            Directory of the store and column
+
+        Returns:
+            Largest value (None if the store has no non-null values)
+        '''
+        largest = []
+        for fragment in self.dataset(path).get_fragments():
+            statistics = None
+            if isinstance(fragment, ds.ParquetFileFragment) and column in fragment.physical_schema.names:
+                metadata = fragment.metadata
+                index = metadata.schema.to_arrow_schema().get_field_index(column)
+                statistics = [metadata.row_group(i).column(index).statistics for i in range(metadata.num_row_groups)]
+            if statistics is not None and all(statistic is not None and (statistic.has_min_max or statistic.num_values == 0)
+                                              for statistic in statistics): # Row groups of only nulls have no min and max
+                largest += [statistic.max for statistic in statistics if statistic.has_min_max]
+            else: # No statistics for the column, e.g. an arrow file
+                largest.append(pc.max(fragment.to_table(columns=[column]).column(column)).as_py())
+        largest = [value for value in largest if value is not None]
+        return max(largest) if largest else None
+
+    def exists(self, path: str) -> bool:
+        '''
+        Checks if a store has been written
+
+        Inputs:
+            Directory of the store
+
+        Returns:
+            True if the directory exists and has files
+        '''
+        return os.path.isdir(path) and len(os.listdir(path)) > 0
+
+
+class ParquetStore(DataStore):
+    '''
+    Compressed parquet store - best for data written once and read many times with filters
+    '''
+    file_format = 'parquet'
+
+
+class ArrowStore(DataStore):
+    '''
+    Uncompressed Arrow IPC (feather) store - fastest to read back
+    '''
+    file_format = 'ipc'
+
+
+STORES = {'parquet': ParquetStore, 'arrow': ArrowStore}
+
+
+def get_store(file_format: str) -> DataStore:
+    '''
+    Returns the store for a file format
+
+    Inputs:
+        File format - 'parquet' or 'arrow'
+
+    Returns:
+        Instance of the store class
+    '''
+    return STORES[file_format]()
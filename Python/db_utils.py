@@ -1,6 +1,15 @@
+import hashlib
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
 import sqlalchemy as db
 from sqlalchemy.engine import Connection
+from typing import Iterator
 from typing import TextIO
 from typing import Union
 import yaml
@@ -8,14 +17,65 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
 from statsmodels.graphics.gofplots import qqplot
+import db_sketches
+import db_storage
+
+
+DATABASE_URL_ENV = 'EDA_DATABASE_URL' # Full SQLAlchemy url, e.g. sqlite:///customer.db - overrides the credentials file
+CREDENTIALS_ENV = 'EDA_DB_CREDENTIALS' # Path to the credentials yaml
+DEFAULT_CREDENTIALS = '/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/credentials.yaml'
+
+# Stable vocabularies of the session columns - a value always gets the same category code, whichever chunk,
+# batch or store it comes from. Values missing from a vocabulary are added after it, in the order they are first read
+SESSION_VOCABULARIES = {'month': ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'June', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'],
+                        'operating_systems': ['Android', 'ChromeOS', 'MACOS', 'Other', 'Ubuntu', 'Windows', 'iOS'],
+                        'browser': ['Android', 'Google Chrome', 'Internet Explorer', 'Microsoft Edge', 'Mozilla Firefox', 'Opera',
+                                    'QQ', 'Safari', 'Samsung Internet', 'Sogou Explorer', 'UC Browser', 'Undetermined', 'Yandex'],
+                        'region': ['Africa', 'Asia', 'Eastern Europe', 'North America', 'Northern Africa', 'Oceania',
+                                   'South America', 'Southern Africa', 'Western Europe'],
+                        'traffic_type': ['Affiliate marketing', 'Bing search', 'Direct Traffic', 'DuckDuckGo search', 'Facebook ads',
+                                         'Facebook page', 'Google search', 'Instagram Page', 'Instagram ads', 'Newsletter', 'Other',
+                                         'Pinterest', 'Tik Tok ads', 'Tik Tok page', 'Twitter', 'Yahoo Search', 'Yandex search',
+                                         'Youtube ads', 'Youtube channel'],
+                        'visitor_type': ['New_Visitor', 'Other', 'Returning_Visitor']}
+COUNT_COLUMNS = ['administrative', 'informational', 'product_related'] # Page counts, stored as nullable 16-bit integers
+BOOLEAN_COLUMNS = ['weekend', 'revenue']
+
+_ENGINES = {} # Process-wide engines, keyed by url and pool settings
+_DB_URLS = {} # Urls already resolved from credential files
+_REGISTRY_LOCK = threading.Lock()
+
+
+def dispose_engines() -> None:
+    '''
+    Closes the pooled connections of every registered engine and empties the registry
+    (e.g. after forking worker processes, or at the end of a scheduled job)
+
+    Inputs:
+        None
+
+    Returns:
+        None
+    '''
+    with _REGISTRY_LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+        _DB_URLS.clear()
 
 
 class RDSDatabaseConnector():
     '''
     This is class created for defining methods to extract data from RDS Database
     '''
-    def __init__(self):
-        pass
+    def __init__(self, creds_file: str = None, pool_size: int = 5, max_overflow: int = 10, pool_pre_ping: bool = True, pool_recycle: int = 1800):
+        self.creds_file = creds_file
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_pre_ping = pool_pre_ping
+        self.pool_recycle = pool_recycle
+        self.vocabularies = {column: list(vocabulary) for column, vocabulary in SESSION_VOCABULARIES.items()}
+        self.vocabulary_lock = threading.Lock()
 
     def read_db_creds(self, file: yaml) -> dict:
         '''
@@ -31,9 +91,30 @@ class RDSDatabaseConnector():
             data_creds = yaml.safe_load(creds)
         return data_creds
 
+    def resolve_db_url(self) -> str:
+        '''
+        Resolves the database url once per process - from the EDA_DATABASE_URL environment variable if set,
+        else from the credentials file given to the class, in EDA_DB_CREDENTIALS, or the default location
+
+        Inputs:
+            None
+
+        Returns:
+            Database url
+        '''
+        if os.environ.get(DATABASE_URL_ENV):
+            return os.environ[DATABASE_URL_ENV]
+        file = self.creds_file or os.environ.get(CREDENTIALS_ENV, DEFAULT_CREDENTIALS)
+        with _REGISTRY_LOCK:
+            if file not in _DB_URLS:
+                creds = list(self.read_db_creds(file).values())
+                _DB_URLS[file] = (f"{creds[0]}+{creds[1]}://{creds[2]}:{creds[3]}@{creds[4]}:{creds[5]}/{creds[6]}")
+            return _DB_URLS[file]
+
     def init_db_engine(self) -> Connection:
         '''
-        Starts the engine to the database
+        Returns the pooled engine to the database, creating it on first use. Later calls with
+        the same url and pool settings reuse the engine and its open connections
 
         Inputs:
             None
@@ -41,103 +122,852 @@ class RDSDatabaseConnector():
         Returns:
             Engine to the database
         '''
-        path = '/Users/keshavparthasarathy/Documents/AICore_projects/exploratory-data-analysis---online-shopping-in-retail285/'
-        creds_dict = self.read_db_creds(path+'credentials.yaml')
-        creds = list(creds_dict.values())
-        url = (f"{creds[0]}+{creds[1]}://{creds[2]}:{creds[3]}@{creds[4]}:{creds[5]}/{creds[6]}")
-        engine = db.create_engine(url)
-        return engine
+        url = self.resolve_db_url()
+        key = (url, self.pool_size, self.max_overflow, self.pool_pre_ping, self.pool_recycle)
+        with _REGISTRY_LOCK:
+            if key not in _ENGINES:
+                pool_args = {'pool_pre_ping': self.pool_pre_ping, 'pool_recycle': self.pool_recycle}
+                if db.engine.make_url(url).get_backend_name() != 'sqlite': # SQLite's default pools do not take sizes
+                    pool_args.update(pool_size=self.pool_size, max_overflow=self.max_overflow)
+                _ENGINES[key] = db.create_engine(url, **pool_args)
+            return _ENGINES[key]
+
+    def connect(self) -> Connection:
+        '''
+        Checks out a connection from the pooled engine - use as a context manager so it is returned to the pool
+
+        Inputs:
+            None
+
+        Returns:
+            Connection to the database
+        '''
+        return self.init_db_engine().connect()
     
-    def read_rds_data(self, engine: Connection, table_name: str) -> pd.DataFrame:
+    def encode_session_columns(self, df: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Stores the session columns compactly - strings as categories with the stable SESSION_VOCABULARIES,
+        page counts as nullable 16-bit integers and flags as booleans. Values missing from a vocabulary are added
+        to the connector's copy of it (sorted, in the order chunks arrive), so they keep the same code in every
+        later chunk and earlier chunks' categories are a prefix of later ones
+
+        Inputs:
+            Dataframe (columns which are not present are skipped)
+
+        Returns:
+            Encoded dataframe
+        '''
+        for column in SESSION_VOCABULARIES:
+            if column in df.columns:
+                with self.vocabulary_lock:
+                    vocabulary = self.vocabularies[column]
+                    vocabulary += sorted(set(df[column].dropna().unique()) - set(vocabulary))
+                    categories = list(vocabulary)
+                df[column] = pd.Categorical(df[column], categories=categories)
+        for column in COUNT_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].astype('Int16')
+        for column in BOOLEAN_COLUMNS:
+            if column in df.columns and df[column].notna().all():
+                df[column] = df[column].astype(bool)
+        return df
+
+    def read_rds_data(self, engine: Connection, table_name: str, encode: bool = True) -> pd.DataFrame:
         '''
         Reads table from database into a dataframe
 
         Inputs:
-            Engine connected to database and the table name to read
+            Engine connected to database, the table name to read and whether to encode the session columns
+            compactly (see encode_session_columns)
 
         Returns:
             A dataframe
         '''
-        raw_df = pd.read_sql_table(table_name, engine)
+        with engine.connect() as conn:
+            raw_df = pd.read_sql_table(table_name, conn)
+        if encode:
+            raw_df = self.encode_session_columns(raw_df)
+        return raw_df
+
+    def read_rds_data_chunks(self, engine: Connection, table_name: str, chunksize: int = 50000, columns: list = None, encode: bool = True) -> Iterator[pd.DataFrame]:
+        '''
+        Streams table from database as fixed-size dataframe chunks using a server-side cursor
+
+        Inputs:
+            Engine connected to database, the table name to read, number of rows per chunk,
+            optionally a list of columns to read (all columns if None) and whether to encode the session columns
+
+        Returns:
+            An iterator of dataframes with at most chunksize rows each
+        '''
+        with engine.connect().execution_options(stream_results=True, max_row_buffer=chunksize) as conn:
+            for chunk in pd.read_sql_table(table_name, conn, columns=columns, chunksize=chunksize):
+                yield self.encode_session_columns(chunk) if encode else chunk
+
+    def partition_queries(self, engine: Connection, table_name: str, partition_column: str, n_partitions: int, mode: str = 'range', columns: list = None) -> list:
+        '''
+        Splits a table into non-overlapping queries on a key column. Rows with a null key go to the first partition
+
+        Inputs:
+            Engine connected to database, the table name, the key column, number of partitions,
+            'range' (equal-width ranges of a numeric key between min and max) or 'hash' (key modulo n_partitions, taken as non-negative, integer keys only)
+            and optionally a list of columns to read
+
+        Returns:
+            List of select statements, one per partition
+        '''
+        table = db.Table(table_name, db.MetaData(), autoload_with=engine)
+        key = table.c[partition_column]
+        query = db.select(*[table.c[column] for column in columns]) if columns else db.select(table)
+        if mode == 'hash':
+            conditions = [(key % n_partitions + n_partitions) % n_partitions == i for i in range(n_partitions)] # SQL modulo keeps the sign of negative keys
+        elif mode == 'range':
+            with engine.connect() as conn:
+                low, high = conn.execute(db.select(db.func.min(key), db.func.max(key))).one()
+            if low is None:
+                return [query]
+            bounds = np.linspace(low, high, n_partitions + 1)
+            if isinstance(low, int):
+                bounds = np.unique(np.ceil(bounds).astype(int))
+            bounds = bounds.tolist()
+            if len(bounds) == 1:
+                bounds = bounds * 2
+            conditions = [db.and_(key >= bounds[i], key < bounds[i+1]) for i in range(len(bounds) - 2)]
+            conditions.append(db.and_(key >= bounds[-2], key <= bounds[-1]))
+        else:
+            raise ValueError(f"mode must be 'range' or 'hash', not {mode}")
+        conditions[0] = db.or_(conditions[0], key.is_(None))
+        return [query.where(condition) for condition in conditions]
+
+    def read_rds_data_parallel(self, engine: Connection, table_name: str, partition_column: str, n_partitions: int = 4, max_workers: int = 4, mode: str = 'range', columns: list = None, store_path: str = None) -> Union[pd.DataFrame, int]:
+        '''
+        Reads a table as partitions on a key column, each on its own pooled connection in a thread pool.
+        The engine pool should allow at least max_workers connections
+
+        Inputs:
+            Engine connected to database, the table name, the key column, number of partitions, number of threads,
+            partitioning mode ('range' or 'hash', see partition_queries), optionally a list of columns and optionally
+            the directory of a parquet store to stream the partitions into instead of concatenating them
+
+        Returns:
+            A dataframe with the partitions in order, or the number of rows written if store_path is given
+        '''
+        queries = self.partition_queries(engine, table_name, partition_column, n_partitions, mode, columns)
+        store = db_storage.ParquetStore() if store_path is not None else None
+
+        def read_partition(query):
+            with engine.connect() as conn:
+                partition_df = self.encode_session_columns(pd.read_sql(query, conn))
+            if store is None:
+                return partition_df
+            store.append(partition_df, store_path)
+            return len(partition_df)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(read_partition, queries))
+        if store is not None:
+            return sum(results)
+        raw_df = pd.concat(results, ignore_index=True)
         return raw_df
 
-    def df_to_csv(self, df: pd.DataFrame, csv_name: str) -> TextIO:
+    def read_watermark(self, state_file: str, table_name: str):
+        '''
+        Reads the persisted watermark (last extracted key or timestamp) for a table
+
+        Inputs:
+            Path to the yaml state file and the table name
+
+        Returns:
+            The watermark value, or None if the table has not been extracted before
+        '''
+        if not os.path.exists(state_file):
+            return None
+        with open(state_file, 'r') as state:
+            watermarks = yaml.safe_load(state) or {}
+        return watermarks.get(table_name)
+
+    def write_watermark(self, state_file: str, table_name: str, value) -> None:
+        '''
+        Persists the watermark for a table, replacing the state file atomically
+
+        Inputs:
+            Path to the yaml state file, the table name and the new watermark value
+
+        Returns:
+            None
+        '''
+        watermarks = {}
+        if os.path.exists(state_file):
+            with open(state_file, 'r') as state:
+                watermarks = yaml.safe_load(state) or {}
+        if isinstance(value, pd.Timestamp):
+            value = value.to_pydatetime()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        watermarks[table_name] = value
+        temp_file = state_file + '.tmp'
+        with open(temp_file, 'w') as state:
+            yaml.safe_dump(watermarks, state)
+        os.replace(temp_file, state_file)
+
+    def read_rds_data_incremental(self, engine: Connection, table_name: str, watermark_column: str, state_file: str, store_path: str,
+                                  chunksize: int = 50000, key_column: str = None) -> int:
+        '''
+        Extracts only the rows at or after the persisted watermark and appends the ones not stored yet to a local
+        parquet store. Rows sharing the watermark value are told apart by a unique key - those already in the store
+        are skipped - so rows tied with the last stored one (split by a chunk boundary, or arriving later with the
+        same timestamp) are still extracted. The watermark is advanced after each chunk is written and is never
+        behind the store's largest value (read from the parquet statistics), so an interrupted run can be retried
+        without storing a row twice
+
+        Inputs:
+            Engine connected to database, the table name, a monotonically increasing column
+            (primary key or ingestion timestamp), yaml state file for the watermark,
+            directory of the parquet store, number of rows per chunk and the unique key column
+            (the watermark column itself if None)
+
+        Returns:
+            Number of new rows extracted
+        '''
+        key_column = key_column if key_column is not None else watermark_column
+        store = db_storage.ParquetStore()
+        watermark = self.read_watermark(state_file, table_name)
+        stored_keys = set()
+        if store.exists(store_path):
+            stored = store.max(store_path, watermark_column)
+            if stored is not None and (watermark is None or stored > watermark):
+                watermark = stored
+            if watermark is not None: # Only the row groups which can hold the watermark value are read
+                stored_keys = set(store.read(store_path, columns=[key_column], filters=[(watermark_column, '==', watermark)])[key_column])
+        table = db.Table(table_name, db.MetaData(), autoload_with=engine)
+        query = db.select(table).order_by(table.c[watermark_column], table.c[key_column])
+        if watermark is not None:
+            query = query.where(table.c[watermark_column] >= watermark)
+        rows = 0
+        with engine.connect().execution_options(stream_results=True, max_row_buffer=chunksize) as conn:
+            for chunk in pd.read_sql(query, conn, chunksize=chunksize):
+                if stored_keys:
+                    chunk = chunk[~((chunk[watermark_column] == watermark) & chunk[key_column].isin(stored_keys))]
+                if chunk.empty:
+                    continue
+                store.append(self.encode_session_columns(chunk), store_path)
+                self.write_watermark(state_file, table_name, chunk[watermark_column].max())
+                rows += len(chunk)
+        return rows
+
+    def df_to_csv(self, df: pd.DataFrame, csv_name: str, append: bool = False) -> TextIO:
         '''
         Converts a dataframe to csv object
 
         Inputs:
-            Dataframe
+            Dataframe, csv name and whether to append to an existing csv (header is then not rewritten)
 
         Returns:
             Nothing - saves file locally to csv object
         '''
-        df.to_csv(csv_name, index=False)
+        if append:
+            df.to_csv(csv_name, index=False, mode='a', header=False)
+        else:
+            df.to_csv(csv_name, index=False)
+
+    def stream_to_csv(self, chunks: Iterator[pd.DataFrame], csv_name: str) -> Iterator[pd.DataFrame]:
+        '''
+        Writes dataframe chunks to a single csv as they pass through, so extraction and cleaning share one read
+
+        Inputs:
+            Iterator of dataframes (e.g. from read_rds_data_chunks) and csv name
+
+        Returns:
+            The same chunks, after each one has been appended to the csv
+        '''
+        for i, chunk in enumerate(chunks):
+            self.df_to_csv(chunk, csv_name, append=(i > 0))
+            yield chunk
+
+    def df_to_feather(self, df: pd.DataFrame, feather_name: str) -> None:
+        '''
+        Saves a dataframe as an uncompressed Arrow/Feather file, which can later be memory-mapped
+
+        Inputs:
+            Dataframe and file name
+
+        Returns:
+            Nothing - saves file locally
+        '''
+        temp_name = feather_name + '.tmp'
+        feather.write_feather(df, temp_name, compression='uncompressed')
+        os.replace(temp_name, feather_name) # Sessions mapping the old file keep their pages until they close
+
+    def stream_to_feather(self, chunks: Iterator[pd.DataFrame], feather_name: str) -> Iterator[pd.DataFrame]:
+        '''
+        Writes chunks to one uncompressed Arrow/Feather file as they pass through, so streamed data can be
+        memory-mapped like a file saved with df_to_feather. Category columns keep the first chunk's categories,
+        with values first seen in later chunks added after them (written as dictionary deltas). The file replaces
+        the old one once the last chunk is written
+
+        Inputs:
+            Iterator of dataframes with the same columns and file name
+
+        Returns:
+            The same chunks, unchanged
+        '''
+        temp_name = feather_name + '.tmp'
+        writer = None
+        schema = None
+        categories = {}
+        try:
+            for chunk in chunks:
+                frame = chunk.copy(deep=False)
+                for column in frame.select_dtypes(include=['category']).columns:
+                    known = categories.get(column)
+                    new = frame[column].cat.categories
+                    categories[column] = new if known is None else known.append(new.difference(known, sort=False))
+                    if not categories[column].equals(new):
+                        frame[column] = frame[column].cat.set_categories(categories[column])
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                if writer is None:
+                    schema = table.schema
+                    writer = pa.ipc.new_file(temp_name, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+                writer.write_table(table.cast(schema))
+                yield chunk
+        except BaseException:
+            if writer is not None:
+                writer.close()
+                os.remove(temp_name)
+            raise
+        if writer is not None:
+            writer.close()
+            os.replace(temp_name, feather_name) # Sessions mapping the old file keep their pages until they close
+
+    def load_mapped_data(self, feather_name: str, columns: list = None) -> pd.DataFrame:
+        '''
+        Loads an uncompressed Arrow/Feather file by memory-mapping it. Numeric columns without nulls are
+        built directly on the mapped pages, so sessions on the same machine share one page-cached copy.
+        Those columns are read-only - add new columns rather than overwriting them
+
+        Inputs:
+            File name and optionally a list of columns to load
+
+        Returns:
+            Dataframe backed by the mapped file
+        '''
+        source = pa.memory_map(feather_name, 'r')
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+        df = table.to_pandas(split_blocks=True)
+        return df
 
     
-class DataFrameInfo():
+class DistributionCache():
+    '''
+    This is class created for computing the histogram and KDE of a column once. The bin edges, counts and a KDE on a grid
+    are kept per column and dataset version (a hash of the column's values, computed once per array, unless a version is
+    given), in memory and optionally as .npz files in a directory shared by processes. The KDE is a binned Gaussian KDE -
+    the values are linearly binned on a fine grid and convolved with the kernel by FFT - with Scott's bandwidth, as
+    seaborn uses, and is within 1e-4 of the peak of scipy's gaussian_kde unless the grid is capped by max_bins
+    '''
+    def __init__(self, cache_dir: str = None, bins: Union[str, int] = 'auto', grid_size: int = 512, cut: float = 3,
+                 max_bins: int = 2 ** 20) -> None:
+        self.cache_dir = cache_dir
+        self.bins = bins
+        self.grid_size = grid_size
+        self.cut = cut
+        self.max_bins = max_bins
+        self.statistics = {}
+        self.versions = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def column_version(self, df: pd.DataFrame, column: str) -> str:
+        '''
+        Returns a hash of a column's values, computed once per array holding them - a column replaced by assignment
+        gets a new array and so a new hash, while values changed in place need an explicit version passed to get
+
+        Inputs:
+            DataFrame and column
+
+        Returns:
+            Hash
+        '''
+        values = df[column].to_numpy()
+        base = values
+        while isinstance(base.base, np.ndarray):
+            base = base.base
+        memo = (column, id(base), values.__array_interface__['data'][0], values.shape, values.strides, values.dtype.str)
+        if memo in self.versions:
+            reference, version = self.versions[memo]
+            if reference() is base:
+                return version
+        version = hashlib.blake2b(df[column].to_numpy(dtype=float, na_value=np.nan).tobytes(), digest_size=16).hexdigest()
+        try: # Forgotten with the array
+            self.versions[memo] = (weakref.ref(base, lambda _, memo=memo: self.versions.pop(memo, None)), version)
+        except TypeError: # Not weakly referenceable - not remembered
+            pass
+        return version
+
+    def key(self, column: str, version: str) -> str:
+        '''
+        Returns the cache key of a column
+
+        Inputs:
+            Column name and the dataset version (e.g. from db_analysis.dataset_version, or column_version)
+
+        Returns:
+            Key
+        '''
+        return hashlib.blake2b(f'{column}|{version}|{self.bins}|{self.grid_size}|{self.cut}'.encode(), digest_size=16).hexdigest()
+
+    def kde(self, values: np.ndarray) -> tuple:
+        '''
+        Computes a binned Gaussian KDE of values
+
+        Inputs:
+            Array of finite values
+
+        Returns:
+            Tuple of the grid and the density on it
+        '''
+        n = len(values)
+        bandwidth = values.std(ddof=1) * n ** (-1 / 5) if n > 1 else 0.0
+        if not bandwidth > 0: # A single value - a spike
+            return np.array([values[0]]), np.array([np.inf])
+        low, high = values.min() - self.cut * bandwidth, values.max() + self.cut * bandwidth
+        # Values are binned on a grid fine enough for linear binning to stay within 1e-4 of the peak of the exact KDE (a
+        # step of at most a fortieth of the bandwidth - repeated values make coarser steps err by up to 2e-3), then the density is interpolated onto the returned grid
+        size = int(min(max(self.grid_size, np.ceil(40 * (high - low) / bandwidth) + 1), self.max_bins))
+        fine = np.linspace(low, high, size)
+        step = fine[1] - fine[0]
+        position = (values - low) / step
+        left = np.clip(np.floor(position).astype(int), 0, size - 2)
+        weight = position - left
+        counts = np.bincount(left, weights=1 - weight, minlength=size) + np.bincount(left + 1, weights=weight, minlength=size)
+        offsets = np.arange(-(size - 1), size) * step
+        kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (bandwidth * np.sqrt(2 * np.pi))
+        padded = 2 ** int(np.ceil(np.log2(3 * size)))
+        density = np.fft.irfft(np.fft.rfft(counts, padded) * np.fft.rfft(kernel, padded), padded)[size - 1:2 * size - 1]
+        grid = np.linspace(low, high, self.grid_size)
+        return grid, np.maximum(np.interp(grid, fine, density), 0) / n
+
+    def get(self, df: pd.DataFrame, column: str, version: str = None) -> dict:
+        '''
+        Returns the statistics of a column, computing them on the first request
+
+        Inputs:
+            DataFrame, column and optionally the dataset version
+
+        Returns:
+            Dictionary with the number of values, bin edges and counts, and the KDE grid and density
+        '''
+        key = self.key(column, version if version is not None else self.column_version(df, column))
+        if key in self.statistics:
+            return self.statistics[key]
+        path = os.path.join(self.cache_dir, f'{key}.npz') if self.cache_dir is not None else None
+        if path is not None and os.path.isfile(path):
+            with np.load(path) as file:
+                statistics = {name: file[name] for name in file.files}
+        else:
+            values = df[column].to_numpy(dtype=float, na_value=np.nan)
+            values = values[np.isfinite(values)]
+            edges = np.histogram_bin_edges(values, bins=self.bins)
+            counts, _ = np.histogram(values, bins=edges)
+            grid, density = self.kde(values) if len(values) else (np.empty(0), np.empty(0))
+            statistics = {'n': np.array(len(values)), 'edges': edges, 'counts': counts, 'grid': grid, 'density': density}
+            if path is not None:
+                np.savez(path, **statistics)
+        self.statistics[key] = statistics
+        return statistics
+
+
+DISTRIBUTIONS = DistributionCache() # Shared by the plotting classes of a process
+
+
+class FigureOutput():
+    '''
+    This is class created for defining where figures go - shown one at a time (the default), or saved to a directory.
+    Saved figures are drawn on one reused figure, cleared after each save, and their file names start with the
+    section (if given), e.g. 'outliers-distribution-page_values'. A name is only saved once per object
+    '''
+    def __init__(self, output_dir: str = None, file_format: str = 'png', dpi: int = 100, distributions: DistributionCache = None,
+                 section: str = None) -> None:
+        self.output_dir = output_dir
+        self.file_format = file_format
+        self.dpi = dpi
+        self.distributions = distributions if distributions is not None else DISTRIBUTIONS
+        self.section = section
+        self.saved = []
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def figure(self, figsize: tuple = (10, 6)) -> plt.Figure:
+        '''
+        Returns the figure to draw on - a new one when showing, the cleared reused one when saving
+
+        Inputs:
+            Figure size
+
+        Returns:
+            Figure, also made the current figure
+        '''
+        if self.output_dir is None:
+            return plt.figure(figsize=figsize)
+        figure = plt.figure(num=f'{type(self).__name__}-{id(self)}', figsize=figsize, clear=True)
+        figure.set_size_inches(figsize)
+        return figure
+
+    def histogram(self, ax: plt.Axes, df: pd.DataFrame, column: str) -> None:
+        '''
+        Draws the histogram of a column with its KDE scaled to the counts, from the cached statistics
+
+        Inputs:
+            Axes to draw on, DataFrame and column
+
+        Returns:
+            None
+        '''
+        statistics = self.distributions.get(df, column)
+        ax.stairs(statistics['counts'], statistics['edges'], fill=True, alpha=0.6)
+        if len(statistics['grid']) > 1:
+            width = statistics['edges'][1] - statistics['edges'][0]
+            ax.plot(statistics['grid'], statistics['density'] * statistics['n'] * width)
+        ax.set_xlabel(column)
+        ax.set_ylabel('Count')
+
+    def show(self, name: str, figure: plt.Figure = None) -> str:
+        '''
+        Shows a figure, or saves it to the output directory
+
+        Inputs:
+            Name of the figure (used as the file name) and the figure if it is not the current one
+            (e.g. from seaborn figure-level plots, which are closed after saving)
+
+        Returns:
+            Path of the saved file, None when shown
+        '''
+        if self.output_dir is None:
+            plt.show()
+            return None
+        name = f'{self.section}-{name}' if self.section else name
+        name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+        path = os.path.join(self.output_dir, f'{name}.{self.file_format}')
+        if path in self.saved:
+            if figure is not None:
+                plt.close(figure)
+            raise ValueError(f'Figure {name} has already been saved - give the figures different sections')
+        current = figure if figure is not None else plt.gcf()
+        current.savefig(path, format=self.file_format, dpi=self.dpi, bbox_inches='tight')
+        if figure is not None:
+            plt.close(figure)
+        else:
+            current.clear()
+        self.saved.append(path)
+        return path
+
+
+PROFILE_STATISTICS = ['dtype', 'numeric', 'count', 'nulls', 'mean', 'std', 'min', '25%', '50%', '75%', 'max', 'skew', 'kurtosis', 'unique', 'top', 'freq']
+
+
+class DataFrameProfile():
+    '''
+    This is class created for holding the per-column statistics of a dataframe, computed by DataFrameInfo.profile:
+    a table of statistics with a row per column (count, nulls, moments, quantiles, distinct values and mode), and
+    the value counts of the non-numeric columns
+    '''
+    def __init__(self, n_rows: int, statistics: pd.DataFrame, value_counts: dict, memory_usage: int = None) -> None:
+        self.n_rows = n_rows
+        self.statistics = statistics
+        self.value_counts = value_counts
+        self.memory_usage = memory_usage
+
+    def numeric_columns(self) -> list:
+        '''
+        Returns the numeric columns (booleans excluded, as in DataFrame.describe)
+
+        Inputs:
+            None
+
+        Returns:
+            List of columns
+        '''
+        return self.statistics.index[self.statistics['numeric'].astype(bool)].tolist()
+
+    def describe(self) -> pd.DataFrame:
+        '''
+        Returns the summary statistics of the numeric columns in the layout of DataFrame.describe
+
+        Inputs:
+            None
+
+        Returns:
+            Dataframe with a column per numeric column
+        '''
+        rows = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+        return self.statistics.loc[self.numeric_columns(), rows].astype(float).T
+
+    def null_percent(self) -> pd.Series:
+        '''
+        Returns the percent of null values of each column
+
+        Inputs:
+            None
+
+        Returns:
+            Series indexed by column
+        '''
+        nulls = self.statistics['nulls'].astype(float).rename(None)
+        return (nulls / self.n_rows) * 100 if self.n_rows else nulls
+
+    def info(self) -> str:
+        '''
+        Describes the columns in the layout of DataFrame.info
+
+        Inputs:
+            None
+
+        Returns:
+            Description
+        '''
+        table = pd.DataFrame({'Non-Null Count': self.statistics['count'].astype(int).astype(str) + ' non-null',
+                              'Dtype': self.statistics['dtype']})
+        lines = [f'{self.n_rows} entries, {len(table)} columns', table.to_string()]
+        if self.memory_usage is not None:
+            lines.append(f'memory usage: {self.memory_usage / 1e6:.1f} MB')
+        return '\n'.join(lines)
+
+
+class DataFrameInfo(FigureOutput):
     '''
     This is class created for defining methods to find more information about the dataframe
     '''
-    def __init__(self) -> None:
-        pass
+    def __init__(self, output_dir: str = None, file_format: str = 'png', dpi: int = 100, distributions: DistributionCache = None,
+                 section: str = None) -> None:
+        super().__init__(output_dir, file_format, dpi, distributions, section)
+
+    def column_statistics(self, values: pd.Series) -> tuple:
+        '''
+        Computes the statistics of one column in one vectorised pass - moments from the deviations to the mean,
+        quantiles and distinct values from one sort - or value counts for non-numeric columns
+
+        Inputs:
+            Series
+
+        Returns:
+            Tuple of a dictionary of statistics and the value counts (None for numeric columns)
+        '''
+        numeric = pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype)
+        statistics = {'dtype': str(values.dtype), 'numeric': numeric}
+        if not numeric:
+            counts = values.value_counts()
+            statistics.update(count=int(counts.sum()), nulls=len(values) - int(counts.sum()), unique=int((counts > 0).sum()),
+                              top=counts.index[0] if len(counts) and counts.iloc[0] > 0 else None,
+                              freq=int(counts.iloc[0]) if len(counts) else 0)
+            return statistics, counts
+        array = values.to_numpy(dtype=float, na_value=np.nan)
+        array = np.sort(array[~np.isnan(array)])
+        n = len(array)
+        statistics.update(count=n, nulls=len(values) - n)
+        if n == 0:
+            return statistics, None
+        mean = array.mean()
+        deviations = array - mean
+        squares = deviations * deviations
+        m2 = squares.mean()
+        m3 = (squares * deviations).mean()
+        m4 = (squares * squares).mean()
+        positions = np.array([0.25, 0.5, 0.75]) * (n - 1)
+        lower = np.floor(positions).astype(int)
+        upper = np.minimum(lower + 1, n - 1)
+        quantiles = array[lower] + (array[upper] - array[lower]) * (positions - lower) # Linear interpolation, as in Series.quantile
+        statistics.update({'mean': mean, 'std': np.sqrt(m2 * n / (n - 1)) if n > 1 else np.nan,
+                           'min': array[0], '25%': quantiles[0], '50%': quantiles[1], '75%': quantiles[2], 'max': array[-1],
+                           'unique': 1 + int(np.count_nonzero(np.diff(array)))})
+        if n > 2: # Bias-corrected, as in Series.skew and Series.kurt
+            statistics['skew'] = 0.0 if m2 == 0 else np.sqrt(n * (n - 1)) / (n - 2) * m3 / m2 ** 1.5
+        if n > 3:
+            statistics['kurtosis'] = 0.0 if m2 == 0 else ((n + 1) * n * (n - 1) * m4 / ((n - 2) * (n - 3) * m2 ** 2 * n)
+                                                          - 3 * (n - 1) ** 2 / ((n - 2) * (n - 3)))
+        return statistics, None
+
+    def profile(self, df: pd.DataFrame, columns: list = None, memory_usage: bool = True) -> DataFrameProfile:
+        '''
+        Profiles a dataframe - every statistic of a column is computed in one pass over it
+
+        Inputs:
+            DataFrame, optionally the columns to profile (all if None) and whether to measure memory usage
+
+        Returns:
+            Profile
+        '''
+        columns = columns if columns is not None else df.columns.tolist()
+        statistics = {}
+        value_counts = {}
+        for column in columns:
+            statistics[column], counts = self.column_statistics(df[column])
+            if counts is not None:
+                value_counts[column] = counts
+        table = pd.DataFrame.from_dict(statistics, orient='index').reindex(columns=PROFILE_STATISTICS)
+        return DataFrameProfile(len(df), table, value_counts, int(df[columns].memory_usage(deep=True).sum()) if memory_usage else None)
+
+    def sketch(self, df: pd.DataFrame, sketches: dict = None, columns: list = None) -> dict:
+        '''
+        Adds a chunk, partition or batch of a dataframe to mergeable column sketches, so a profile can be built
+        without the whole dataframe in one process (sketches of separate partitions are combined with merge_sketches)
+
+        Inputs:
+            DataFrame, optionally the sketches to add to (new ones if None) and the columns to sketch (all if None)
+
+        Returns:
+            Dictionary of column to db_sketches.ColumnSketch
+        '''
+        sketches = sketches if sketches is not None else {}
+        for column in (columns if columns is not None else df.columns):
+            if column not in sketches:
+                dtype = df[column].dtype
+                numeric = pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+                sketches[column] = db_sketches.ColumnSketch(str(dtype), numeric)
+            sketches[column].update(df[column])
+        return sketches
+
+    def merge_sketches(self, sketches: dict, other: dict) -> dict:
+        '''
+        Merges the column sketches of another partition or batch into sketches
 
-    def display_info(self, df: pd.DataFrame)-> None:
+        Inputs:
+            Dictionary of column sketches to merge into and dictionary of column sketches to add
+
+        Returns:
+            Merged dictionary
+        '''
+        for column, sketch in other.items():
+            if column in sketches:
+                sketches[column].merge(sketch)
+            else:
+                sketches[column] = sketch
+        return sketches
+
+    def sketch_profile(self, sketches: dict) -> DataFrameProfile:
+        '''
+        Builds a profile from column sketches - counts, nulls, moments, extremes and value counts are exact,
+        quantiles and numeric distinct counts approximate once the data outgrows the sketches
+
+        Inputs:
+            Dictionary of column sketches
+
+        Returns:
+            Profile
+        '''
+        statistics = {}
+        value_counts = {}
+        for column, sketch in sketches.items():
+            statistics[column], counts = sketch.statistics()
+            if counts is not None:
+                value_counts[column] = counts
+        table = pd.DataFrame.from_dict(statistics, orient='index').reindex(columns=PROFILE_STATISTICS)
+        n_rows = max((sketch.rows for sketch in sketches.values()), default=0)
+        return DataFrameProfile(n_rows, table, value_counts)
+
+    def as_profile(self, df: Union[pd.DataFrame, DataFrameProfile], columns: list = None) -> DataFrameProfile:
+        '''
+        Returns a profile as is, or profiles the needed columns of a dataframe
+
+        Inputs:
+            DataFrame or profile, and the columns needed
+
+        Returns:
+            Profile
+        '''
+        return df if isinstance(df, DataFrameProfile) else self.profile(df, columns, memory_usage=False)
+
+    def display_info(self, df: Union[pd.DataFrame, DataFrameProfile])-> None:
         '''
         Prints basic info about the dataframe
 
         Inputs:
-            DataFrame
+            DataFrame or its profile
 
         Returns:
             None
         '''
         print('DATAFRAME INFO:')
         print('___________________________________')
-        print(df.info())
+        print((df if isinstance(df, DataFrameProfile) else self.profile(df)).info())
         print('___________________________________')
         print('')
 
-    def summary_statistics(self, df: pd.DataFrame)-> None:
+    def summary_statistics(self, df: Union[pd.DataFrame, DataFrameProfile])-> None:
         '''
         Prints summary statistics of numerical columns
 
         Inputs:
-            DataFrame
+            DataFrame or its profile
 
         Returns:
             None
         '''
         print('SUMMARY STATISTICS:')
         print('___________________________________')
-        print(df.describe())
+        print(self.as_profile(df).describe())
         print('___________________________________')
         print('')
 
-    def explore_categorical_variable(self,df: pd.DataFrame, column: str)-> None:
+    def explore_categorical_variable(self,df: Union[pd.DataFrame, DataFrameProfile], column: str)-> None:
         '''
         Explores categorical variables using count plots
 
         Inputs:
-            DataFrame and categorical column
+            DataFrame or its profile, and categorical column
 
         Returns:
             None
         ''' 
-        plt.figure(figsize=(10,6))
-        order = df[column].value_counts().index
-        ax = sns.countplot(x=column, data = df,order=order)
+        profile = self.as_profile(df, [column])
+        counts = profile.value_counts[column] if column in profile.value_counts else df[column].value_counts()
+        counts = counts[counts > 0] # Categories of the vocabulary which do not occur are left out
+        ax = self.figure(figsize=(10,6)).gca()
+        ax.bar(counts.index.astype(str), counts.to_numpy(), color=sns.color_palette()[0])
+        ax.set_xlabel(column)
+        ax.set_ylabel('count')
         # Customize x-axis labels
         rotation_angle = 45
-        ax.set_xticklabels(ax.get_xticklabels(), rotation=rotation_angle, ha='right')  # Adjust rotation and horizontal alignment
+        ax.set_xticks(range(len(counts)))
+        ax.set_xticklabels(counts.index.astype(str), rotation=rotation_angle, ha='right')  # Adjust rotation and horizontal alignment
         # Calculating and annotating with percentage values
-        total = len(df[column])
+        total = profile.n_rows
         for p in ax.patches:
             percentage = '{:.1f}%'.format(100 * p.get_height()/total)
             x = p.get_x() + p.get_width() / 2 - 0.05
             y = p.get_height() + 0.5
             ax.annotate(percentage, (x, y), ha='center', va='bottom', fontsize=10, color='black')
         plt.title((f'Count values and percentages of {column}'))
-        plt.show()
+        self.show(f'categorical-{column}')
+
+    def share_table(self, df: pd.DataFrame, index: str, columns: str, values: str = None, normalize: str = 'columns', decimals: int = None) -> pd.DataFrame:
+        '''
+        Cross-tabulates two dimensions in one grouped pass, as percentage shares of each column, row or of the total.
+        Every category of both dimensions is kept (with 0 for combinations with no rows)
+
+        Inputs:
+            Dataframe, column whose values are the rows, column whose values are the columns, optionally a column to sum
+            (rows are counted if None), normalisation - 'columns', 'index' or 'all' - and optionally decimals to round to
+
+        Returns:
+            Dataframe of percentages
+        '''
+        grouped = df.groupby([index, columns], observed=False)
+        table = (grouped[values].sum() if values else grouped.size()).unstack(columns, fill_value=0)
+        if normalize == 'columns':
+            totals = table.sum(axis=0)
+            table = table.div(totals.where(totals != 0), axis=1)
+        elif normalize == 'index':
+            totals = table.sum(axis=1)
+            table = table.div(totals.where(totals != 0), axis=0)
+        elif normalize == 'all':
+            table = table / table.to_numpy().sum()
+        else:
+            raise ValueError(f"normalize must be 'columns', 'index' or 'all', not {normalize}")
+        table = (table * 100).fillna(0)
+        table.columns = list(table.columns)
+        return table.round(decimals) if decimals is not None else table
 
     def explore_continuous_variable(self,df: pd.DataFrame, column: str) -> None:
         '''
@@ -149,10 +979,9 @@ class DataFrameInfo():
         Returns:
             None
         '''
-        plt.figure(figsize=(10,6))
-        sns.histplot(df[column], bins = 'auto', kde=True)
+        self.histogram(self.figure(figsize=(10,6)).gca(), df, column)
         plt.title((f'Historgram of {column}'))
-        plt.show()
+        self.show(f'continuous-{column}')
 
     def visualise_missing_data(self, df: pd.DataFrame) -> None:
         '''
@@ -164,37 +993,37 @@ class DataFrameInfo():
         Returns:
             None        
         '''
-        plt.figure(figsize=(10,6))
+        self.figure(figsize=(10,6))
         sns.heatmap(df.isnull(),cbar=False,cmap='viridis')
         plt.title('Missing data visualisation')
-        plt.show()
+        self.show('missing-data')
 
-    def null_percent(self,df: pd.DataFrame, column: str) -> None:
+    def null_percent(self,df: Union[pd.DataFrame, DataFrameProfile], column: str) -> None:
         '''
         Calculate percent of values that are null
 
         Inputs:
-            DataFrame and column
+            DataFrame or its profile, and column
 
         Returns:
             None        
         '''     
-        null_percent = df[column].isnull().sum()/len(df)*100
+        null_percent = self.as_profile(df, [column]).null_percent()[column]
         null_percent = null_percent.round(1)
         print(f'Percent of null values for {column} is {null_percent}%')
         print('')
 
-    def null_summary(self, df: pd.DataFrame) -> None:
+    def null_summary(self, df: Union[pd.DataFrame, DataFrameProfile]) -> None:
         '''
         Generates summary of null values in percent across columns
 
         Inputs:
-            DataFrame
+            DataFrame or its profile
 
         Returns:
             None        
         '''     
-        null = (df.isnull().sum()/len(df))*100
+        null = self.as_profile(df).null_percent()
         null = null.round(1)
         print(f'% OF NULL VALUES: ')
         print('___________________________________')
@@ -202,53 +1031,126 @@ class DataFrameInfo():
         print('___________________________________')
         print('')
 
-    def var_skewness(self, df: pd.DataFrame, column: str) -> None:
+    def var_skewness(self, df: Union[pd.DataFrame, DataFrameProfile], column: str) -> None:
         '''
         Generates skewness of the variable
 
         Inputs:
-            DataFrame and column
+            DataFrame or its profile, and column
 
         Returns:
             None        
         '''     
-        print(f' Skewness for {column} is {df[column].skew().round(1)}')
+        skew = self.as_profile(df, [column]).statistics.loc[column, 'skew']
+        print(f' Skewness for {column} is {round(skew, 1)}')
         print('')
 
-    def compare_skewness(self, df: pd.DataFrame, column1: str, column2: str) -> None:
+    def compare_skewness(self, df: Union[pd.DataFrame, DataFrameProfile], column1: str, column2: str) -> None:
         '''
         Compares skewness of two variables
 
         Inputs:
-            DataFrame and two columns for comparison
+            DataFrame or its profile, and two columns for comparison
 
         Returns:
             None        
         '''    
-        print(f' Skewness for {column1} = {df[column1].skew().round(1)}')
-        print(f' Skewness for {column2} = {df[column2].skew().round(1)}')
+        skew = self.as_profile(df, [column1, column2]).statistics['skew']
+        print(f' Skewness for {column1} = {round(skew[column1], 1)}')
+        print(f' Skewness for {column2} = {round(skew[column2], 1)}')
         print('')
 
 
-class Plotter():
+class Plotter(FigureOutput):
     '''
-    This is class created for defining methods to plot charts about the data
+    This is class created for defining methods to plot charts about the data. Above large_data_rows rows, the
+    point-by-point plots (boxplot, scatterplot, corr_scatter) switch to statistics precomputed with numpy - quantile
+    summaries, 2D histograms and a stratified sample of points - so their drawing time does not grow with the data
     '''
-    def __init__(self) -> None:
-        pass
+    def __init__(self, output_dir: str = None, file_format: str = 'png', dpi: int = 100, distributions: DistributionCache = None, large_data_rows: int = 10000, sample_size: int = 2000, bins: int = 60, seed: int = 0, section: str = None) -> None:
+        super().__init__(output_dir, file_format, dpi, distributions, section)
+        self.large_data_rows = large_data_rows
+        self.sample_size = sample_size
+        self.bins = bins
+        self.rng = np.random.default_rng(seed)
+
+    def is_large(self, df: pd.DataFrame) -> bool:
+        '''
+        Checks if a dataframe is plotted in large-data mode
 
-    def corr_matrix(self, df: pd.DataFrame) -> None:
+        Inputs:
+            DataFrame
+
+        Returns:
+            True if it has more than large_data_rows rows
+        '''
+        return self.large_data_rows is not None and len(df) > self.large_data_rows
+
+    def stratified_sample(self, values: np.ndarray, size: int, n_strata: int = 10) -> np.ndarray:
+        '''
+        Samples values evenly across quantile strata, keeping the minimum and maximum, so the tails
+        are as visible as in the full data
+
+        Inputs:
+            Array of values (without nulls), sample size and number of strata
+
+        Returns:
+            Array of sampled positions
+        '''
+        if len(values) <= size:
+            return np.arange(len(values))
+        edges = np.quantile(values, np.linspace(0, 1, n_strata + 1)[1:-1])
+        strata = np.searchsorted(edges, values, side='right')
+        positions = [np.argmin(values), np.argmax(values)]
+        for stratum in range(n_strata):
+            members = np.flatnonzero(strata == stratum)
+            if len(members):
+                positions.extend(self.rng.choice(members, min(len(members), size // n_strata), replace=False))
+        return np.unique(positions)
+
+    def correlations(self, df: pd.DataFrame, method: str = 'pearson', correlations: db_sketches.CorrelationSketch = None,
+                     quantiles: dict = None) -> db_sketches.CorrelationSketch:
+        '''
+        Adds a dataframe, or a chunk or batch of one, to a correlation sketch of its numerical variables -
+        sketches of separate chunks are combined with merge. For spearman the values are ranked within the dataframe,
+        or, when adding chunks, through quantile sketches of the whole columns (e.g. from DataFrameInfo.sketch) - adding
+        to a spearman sketch built without them raises ValueError, as the chunk could only be ranked on its own. Each
+        column is ranked once over all its present values, whereas DataFrame.corr('spearman') ranks each pair over only
+        the rows where both are present - the two agree without nulls, and with nulls differ slightly (by up to 5.8e-4
+        on customer_activity, whose duration columns have 2-7% nulls)
+
+        Inputs:
+            DataFrame, method ('pearson' or 'spearman'), optionally the sketch to add to and a dictionary of column to
+            db_sketches.QuantileSketch to rank by
+
+        Returns:
+            db_sketches.CorrelationSketch
+        '''
+        if correlations is None:
+            columns = df.select_dtypes(include=['number']).columns
+            ranks = {column: quantiles[column] for column in columns} if method == 'spearman' and quantiles else None
+            correlations = db_sketches.CorrelationSketch(columns, ranks)
+        elif method == 'spearman' and correlations.ranks is None:
+            raise ValueError('Spearman correlations of chunks need a sketch built with quantiles - ranking each chunk on its own would be wrong')
+        if method == 'spearman' and correlations.ranks is None:
+            df = df[correlations.columns].rank(pct=True)
+        correlations.update(df)
+        return correlations
+
+    def corr_matrix(self, df: pd.DataFrame = None, method: str = 'pearson', correlations: db_sketches.CorrelationSketch = None) -> None:
         '''
         Displays correlation matrix across variables
 
         Inputs:
-            DataFrame
+            DataFrame, method ('pearson' or 'spearman'), or a correlation sketch already built with correlations
 
         Returns:
             None        
         '''   
-        numerical_columns = df.select_dtypes(include=['number'])
-        corr = numerical_columns.corr()
+        if correlations is None:
+            correlations = self.correlations(df, method)
+        self.figure()
+        corr = correlations.correlation()
         mask = np.zeros_like(corr, dtype=np.bool_)
         mask[np.triu_indices_from(mask)] = True
         cmap = sns.diverging_palette(220, 10, as_cmap=True)
@@ -256,7 +1158,7 @@ class Plotter():
                     square=True, linewidths=.5, annot=True, cmap=cmap)
         plt.yticks(rotation=0)
         plt.title('Correlation Matrix of Numerical Variables')
-        plt.show()
+        self.show('correlation-matrix' if method == 'pearson' else f'correlation-matrix-{method}')
 
     def corr_scatter(self, df: pd.DataFrame, columns: list) -> None:
         '''
@@ -268,8 +1170,27 @@ class Plotter():
         Returns:
             None        
         '''   
-        numerical_columns = df.select_dtypes(include=['number'])
-        sns.pairplot(df[columns])
+        if not self.is_large(df):
+            grid = sns.pairplot(df[columns])
+            self.show('correlation-scatter', grid.figure)
+            return
+        figure = self.figure(figsize=(2.5 * len(columns), 2.5 * len(columns)))
+        axes = figure.subplots(len(columns), len(columns), squeeze=False)
+        values = {column: df[column].to_numpy(dtype=float, na_value=np.nan) for column in columns}
+        for i, y_column in enumerate(columns):
+            for j, x_column in enumerate(columns):
+                ax = axes[i, j]
+                if i == j:
+                    x = values[x_column][~np.isnan(values[x_column])]
+                    counts, edges = np.histogram(x, bins=self.bins)
+                    ax.stairs(counts, edges, fill=True)
+                else:
+                    valid = ~(np.isnan(values[x_column]) | np.isnan(values[y_column]))
+                    counts, x_edges, y_edges = np.histogram2d(values[x_column][valid], values[y_column][valid], bins=self.bins)
+                    ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts.T, 0), cmap='viridis', norm='log')
+                ax.set_xlabel(x_column if i == len(columns) - 1 else '')
+                ax.set_ylabel(y_column if j == 0 else '')
+        self.show('correlation-scatter')
 
     def vars_distribution (self, df: pd.DataFrame, columns: list) -> None:
         '''
@@ -282,9 +1203,16 @@ class Plotter():
             None        
         '''   
         sns.set(font_scale=0.7)
-        f = pd.melt(df, value_vars=columns)
-        g = sns.FacetGrid(f, col="variable",  col_wrap=3, sharex=False, sharey=False)
-        g = g.map(sns.histplot, "value", kde=True)
+        n_rows = (len(columns) + 2) // 3
+        figure = self.figure(figsize=(9, 3 * n_rows))
+        axes = figure.subplots(n_rows, 3, squeeze=False).ravel()
+        for ax, column in zip(axes, columns):
+            self.histogram(ax, df, column)
+            ax.set_title(f'variable = {column}')
+        for ax in axes[len(columns):]:
+            ax.set_visible(False)
+        figure.tight_layout()
+        self.show('distributions')
 
     def var_distribution (self, df: pd.DataFrame, column: str) -> None:
         '''
@@ -296,8 +1224,8 @@ class Plotter():
         Returns:
             None        
         '''  
-        plt.figure(figsize=(10, 5))
-        sns.histplot(df[column], kde=True)
+        self.histogram(self.figure(figsize=(10, 5)).gca(), df, column)
+        self.show(f'distribution-{column}')
 
     def qqplot(self, df: pd.DataFrame, column:str) -> None:
         '''
@@ -309,8 +1237,8 @@ class Plotter():
         Returns:
             None        
         '''  
-        qq_plot = qqplot(df[column] , scale=1 ,line='q', fit=True)
-        plt.show()
+        qq_plot = qqplot(df[column].dropna().astype(float), scale=1 ,line='q', fit=True, ax=self.figure().gca()) # Nulls cannot be fitted
+        self.show(f'qqplot-{column}')
 
     def boxplot(self, df: pd.DataFrame, column: str) -> None:
         '''
@@ -323,11 +1251,27 @@ class Plotter():
             None        
         '''  
         sns.set(style="whitegrid")
-        plt.figure(figsize=(10,5))
-        sns.boxplot(y=column,data=df, color='lightgreen', showfliers=True)
-        sns.swarmplot(y=column, data=df, color='black', size=5)
+        figure = self.figure(figsize=(10,5))
+        if not self.is_large(df):
+            sns.boxplot(y=column,data=df, color='lightgreen', showfliers=True)
+            sns.swarmplot(y=column, data=df, color='black', size=5)
+        else: # Box drawn from the quantiles, with a stratified sample of points jittered over it
+            values = df[column].to_numpy(dtype=float, na_value=np.nan)
+            values = values[~np.isnan(values)]
+            q1, median, q3 = np.quantile(values, [0.25, 0.5, 0.75])
+            low = values[values >= q1 - 1.5 * (q3 - q1)].min()
+            high = values[values <= q3 + 1.5 * (q3 - q1)].max()
+            fliers = values[(values < low) | (values > high)]
+            fliers = fliers[self.stratified_sample(fliers, self.sample_size)]
+            ax = figure.gca()
+            ax.bxp([{'med': median, 'q1': q1, 'q3': q3, 'whislo': low, 'whishi': high, 'fliers': fliers}],
+                   positions=[0], widths=0.6, patch_artist=True, boxprops={'facecolor': 'lightgreen'})
+            sample = values[self.stratified_sample(values, self.sample_size)]
+            ax.scatter(self.rng.uniform(-0.2, 0.2, len(sample)), sample, color='black', s=4, alpha=0.3)
+            ax.set_xticks([])
+            ax.set_ylabel(column)
         plt.title(f'Box plot with scatter points for {column}')
-        plt.show()
+        self.show(f'boxplot-{column}')
 
     def scatterplot(self, df: pd.DataFrame, x_column: str, y_column: str) -> None:
         '''
@@ -339,9 +1283,24 @@ class Plotter():
         Returns:
             None        
         '''  
-        plt.figure(figsize=(10,5))
-        sns.scatterplot(x=df[x_column], y=df[y_column])
-        sns.regplot(x=df[x_column], y=df[y_column])
+        figure = self.figure(figsize=(10,5))
+        if not self.is_large(df):
+            sns.scatterplot(x=df[x_column], y=df[y_column])
+            sns.regplot(x=df[x_column], y=df[y_column])
+        else: # 2D histogram of the points, with the least squares line fitted on all of them
+            x = df[x_column].to_numpy(dtype=float, na_value=np.nan)
+            y = df[y_column].to_numpy(dtype=float, na_value=np.nan)
+            valid = ~(np.isnan(x) | np.isnan(y))
+            x, y = x[valid], y[valid]
+            counts, x_edges, y_edges = np.histogram2d(x, y, bins=self.bins)
+            ax = figure.gca()
+            mesh = ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts.T, 0), cmap='viridis', norm='log')
+            figure.colorbar(mesh, ax=ax, label='Rows')
+            slope, intercept = np.polyfit(x, y, 1)
+            ax.plot(x_edges[[0, -1]], intercept + slope * x_edges[[0, -1]], color='red')
+            ax.set_xlabel(x_column)
+            ax.set_ylabel(y_column)
+        self.show(f'scatterplot-{x_column}-{y_column}')
 
     def barplot(self, df: Union[pd.DataFrame, pd.Series], stack: bool, xlabel: str, ylabel: str, title: str, legend_title:str = None, ycolumn:str = None) -> None:
         '''
@@ -353,7 +1312,7 @@ class Plotter():
         Returns:
             None     
         '''
-        ax = df.plot(kind='bar',stacked=stack, figsize=(10, 6))
+        ax = df.plot(kind='bar',stacked=stack, ax=self.figure(figsize=(10, 6)).gca())
         # Add labels to the bars where needed
         if ycolumn is not None:        
             for i, value in enumerate(df[ycolumn]):
@@ -366,4 +1325,85 @@ class Plotter():
             ax.legend(title=legend_title, loc='upper right', bbox_to_anchor=(1.25, 1))
         else:
             ax.legend(loc='upper right', bbox_to_anchor=(1.25, 1))
-        plt.show()
\ No newline at end of file
+        self.show(f'barplot-{title}')
+
+REPORT_CLASSES = {'info': DataFrameInfo, 'plotter': Plotter}
+_REPORT_WORKER = {} # Dataframe and plotting objects of a report worker process
+
+
+def init_report_worker(df: pd.DataFrame, output_dir: str, file_format: str, dpi: int, section: str = None, headless: bool = True) -> None:
+    '''
+    Sets up a report worker process - the dataframe is sent once per process, and each plotting class
+    gets one instance (so one reused figure) per process. Worker processes switch to the Agg backend, as they
+    have no display
+
+    Inputs:
+        Dataframe, output directory, file format, resolution, section of the report (prefix of the file names)
+        and whether to switch to the Agg backend (False when rendering in the calling process)
+
+    Returns:
+        None
+    '''
+    if headless and output_dir is not None:
+        plt.switch_backend('Agg')
+    _REPORT_WORKER['df'] = df
+    _REPORT_WORKER['objects'] = {name: cls(output_dir, file_format, dpi, section=section) for name, cls in REPORT_CLASSES.items()}
+
+
+def render_report_task(task: tuple) -> list:
+    '''
+    Draws one figure of a report in a worker process
+
+    Inputs:
+        Tuple of (class name in REPORT_CLASSES, method name, tuple of arguments after the dataframe)
+
+    Returns:
+        List of the paths saved
+    '''
+    name, method, args = task
+    plotter = _REPORT_WORKER['objects'][name]
+    saved = len(plotter.saved)
+    getattr(plotter, method)(_REPORT_WORKER['df'], *args)
+    return plotter.saved[saved:]
+
+
+class ReportRenderer():
+    '''
+    This is class created for rendering many figures of a dataframe at once. Without an output directory the figures
+    are shown one by one; with one, they are saved headless, spread across a pool of processes
+    '''
+    def __init__(self, output_dir: str = None, n_workers: int = None, file_format: str = 'png', dpi: int = 100) -> None:
+        self.output_dir = output_dir
+        self.n_workers = n_workers if n_workers is not None else (os.cpu_count() or 1)
+        self.file_format = file_format
+        self.dpi = dpi
+
+    def render(self, df: pd.DataFrame, tasks: list, section: str = None) -> list:
+        '''
+        Renders a list of figures
+
+        Inputs:
+            Dataframe, list of (class name in REPORT_CLASSES, method name, tuple of arguments after the dataframe),
+            e.g. [('info', 'explore_categorical_variable', ('month',)), ('plotter', 'corr_matrix', ())],
+            and the section of the report, which the saved file names start with (so sections drawing the same
+            figure do not overwrite each other)
+
+        Returns:
+            List of the saved image paths (empty when the figures are shown)
+        '''
+        if not tasks:
+            return []
+        if len({repr(task) for task in tasks}) < len(tasks):
+            raise ValueError('The same figure is listed more than once in tasks')
+        if self.output_dir is None or self.n_workers <= 1:
+            init_report_worker(df, self.output_dir, self.file_format, self.dpi, section, headless=False)
+            try:
+                results = [render_report_task(task) for task in tasks]
+            finally:
+                _REPORT_WORKER.clear()
+        else:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with ProcessPoolExecutor(min(self.n_workers, len(tasks)), initializer=init_report_worker,
+                                     initargs=(df, self.output_dir, self.file_format, self.dpi, section)) as executor:
+                results = list(executor.map(render_report_task, tasks))
+        return [path for paths in results for path in paths]
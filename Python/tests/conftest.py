@@ -0,0 +1,16 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # The modules are imported by name, as the scripts do
+import pandas as pd
+import pytest
+import db_utils
+
+
+@pytest.fixture
+def customer_data() -> pd.DataFrame:
+    '''
+    The customer_activity extract in the repository, encoded as read_rds_data encodes it
+    '''
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'customer_data.csv')
+    return db_utils.RDSDatabaseConnector().encode_session_columns(pd.read_csv(path))
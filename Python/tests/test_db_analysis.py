@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+import db_analysis
+import db_cleaning
+import db_storage
+
+
+@pytest.fixture
+def cleaned_data(customer_data) -> pd.DataFrame:
+    return db_cleaning.CleaningPipeline(db_cleaning.cleaning_steps()).run(customer_data)
+
+
+@pytest.mark.parametrize('dimensions', [['region'], ['traffic_type', 'month'], ['traffic_category'], ['weekend', 'visitor_type']])
+def test_cube_queries_match_groupby(cleaned_data, dimensions):
+    cube = db_analysis.AggregateCube()
+    half = len(cleaned_data) // 2
+    cube.build(cleaned_data.iloc[:half])
+    cube.update(cleaned_data.iloc[half:])
+    df = cleaned_data.assign(traffic_category=db_analysis.derive_column(cleaned_data['traffic_type'], db_analysis.TRAFFIC_CATEGORY))
+    measures = ['page_values', 'revenue', 'product_related_duration']
+    expected = df.groupby(dimensions, observed=True)[measures].sum()
+    result = cube.query(dimensions, measures)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_categorical=False, check_index_type=False)
+    sessions = df.groupby(dimensions, observed=True).size()
+    np.testing.assert_array_equal(cube.query(dimensions, ['sessions'])['sessions'].to_numpy(), sessions.to_numpy())
+
+
+def test_filtered_cube_totals_match_dataframe(cleaned_data):
+    cube = db_analysis.AggregateCube()
+    cube.build(cleaned_data)
+    ads = cleaned_data['traffic_type'].astype(str).str.contains('ads')
+    totals = cube.query([], ['page_values', 'sessions'], {'traffic_type': lambda s: s.str.contains('ads'), 'region': ['Asia']})
+    rows = cleaned_data[ads & (cleaned_data['region'] == 'Asia')]
+    assert totals['sessions'] == len(rows)
+    assert totals['page_values'] == pytest.approx(rows['page_values'].sum())
+
+
+@pytest.mark.parametrize('filters', [[('traffic_category', '==', 'Ads'), ('page_values', '>', 0)],
+                                     [('device_type', '!=', 'mobile'), ('region', 'in', ['Asia', 'Oceania'])],
+                                     [('traffic_type', 'contains', 'search'), ('month', 'not in', ['Nov', 'Dec'])]])
+def test_lazy_query_matches_eager_filtering(tmp_path, cleaned_data, filters):
+    path = str(tmp_path / 'cleaned')
+    db_storage.ParquetStore().write(cleaned_data, path)
+    df = cleaned_data.copy()
+    for name, (source, mapping, default) in db_analysis.DERIVED_COLUMNS.items():
+        df[name] = db_analysis.derive_column(df[source], mapping, default)
+    query = db_analysis.LazyQuery(path)
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        query = query.filter(column, op, value)
+        mask &= db_analysis.match(df[column], op, value).fillna(False)
+    eager = df[mask]
+    selected = query.select(['region', 'traffic_category', 'page_values']).collect()
+    pd.testing.assert_frame_equal(selected.reset_index(drop=True), eager[['region', 'traffic_category', 'page_values']].reset_index(drop=True),
+                                  check_dtype=False, check_categorical=False)
+    aggregated = query.aggregate(['region'], {'page_values': 'mean', 'revenue': 'sum'}).collect()
+    expected = eager.groupby('region', observed=True).agg({'page_values': 'mean', 'revenue': 'sum'})
+    pd.testing.assert_frame_equal(aggregated, expected, check_dtype=False, check_categorical=False, check_index_type=False)
+    plan = query.select(['region', 'traffic_category', 'page_values']).plan()
+    assert plan['columns'] == ['region', 'traffic_type', 'page_values'] # Only the selected columns (and derived ones' sources) are read
+    assert plan['expression'] is not None
+
+
+def test_category_index_matches_pandas(cleaned_data):
+    df = cleaned_data.copy()
+    df.loc[df.index[::50], 'traffic_type'] = np.nan # Null categories never match
+    index = db_analysis.CategoryIndex(df, ['traffic_type', 'operating_systems', 'month'])
+    ads = index.lookup('traffic_type', 'contains', 'ads')
+    mobile = index.lookup('operating_systems', 'in', ['Android', 'iOS'])
+    winter = index.lookup('month', 'in', ['Nov', 'Dec'])
+    traffic = df['traffic_type'].astype(str).str.contains('ads') & df['traffic_type'].notna()
+    is_mobile = df['operating_systems'].isin(['Android', 'iOS'])
+    is_winter = df['month'].isin(['Nov', 'Dec'])
+    for rows, expected in [(ads, traffic), (ads & mobile, traffic & is_mobile), (ads | winter, traffic | is_winter),
+                           (~mobile, ~is_mobile), (ads & ~winter, traffic & ~is_winter)]:
+        np.testing.assert_array_equal(rows.mask(), expected.to_numpy())
+        np.testing.assert_array_equal(rows.positions(), np.flatnonzero(expected.to_numpy()))
+        assert rows.count() == expected.sum()
+    sums = index.aggregate(df, ads & mobile, 'month', 'page_values')
+    expected = df[traffic & is_mobile].groupby('month', observed=True)['page_values'].sum()
+    expected.index = expected.index.astype(str)
+    pd.testing.assert_series_equal(sums.sort_index(), expected.sort_index(), check_index_type=False, check_names=False)
@@ -0,0 +1,51 @@
+import multiprocessing
+import numpy as np
+import pytest
+import db_benchmark
+
+
+fork = pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+
+
+@fork
+def test_resident_memory_measured_per_case():
+    large = db_benchmark.measure('large', 'test', 1, lambda: np.ones(2 ** 25).sum(), repeat=1)
+    small = db_benchmark.measure('small', 'test', 1, lambda: np.ones(2 ** 10).sum(), repeat=1)
+    assert 200 < large['rss_mb'] < 400 # 256 MB of float64
+    assert small['rss_mb'] < 20
+    assert 200 < large['peak_mb'] < 300
+
+
+@fork
+def test_failed_traced_run_raises():
+    calls = []
+
+    def fails_when_traced():
+        calls.append(1)
+        if len(calls) > 1:
+            raise ValueError('traced')
+
+    with pytest.raises(RuntimeError, match='ValueError: traced'):
+        db_benchmark.measure('failing', 'test', 1, fails_when_traced, repeat=1)
+
+
+def test_compare_results_flags_time_and_memory(tmp_path):
+    def run(file, results):
+        cases = [{'case': case, 'stage': 'test', 'mode': 'in memory', 'rows': 100, **result} for case, result in results.items()]
+        db_benchmark.save_results({'metadata': {}, 'results': cases}, str(tmp_path / file))
+        return str(tmp_path / file)
+
+    baseline = run('baseline.json', {'same': {'best_seconds': 1.0, 'peak_mb': 100.0, 'rss_mb': 100.0},
+                                     'slower': {'best_seconds': 1.0, 'peak_mb': 100.0, 'rss_mb': 100.0},
+                                     'more allocated': {'best_seconds': 1.0, 'peak_mb': 100.0, 'rss_mb': 100.0},
+                                     'more resident': {'best_seconds': 1.0, 'peak_mb': 100.0, 'rss_mb': 100.0},
+                                     'tiny': {'best_seconds': 1.0, 'peak_mb': 0.1, 'rss_mb': 0.0}})
+    current = run('current.json', {'same': {'best_seconds': 1.05, 'peak_mb': 105.0, 'rss_mb': 105.0},
+                                   'slower': {'best_seconds': 1.5, 'peak_mb': 100.0, 'rss_mb': 100.0},
+                                   'more allocated': {'best_seconds': 1.0, 'peak_mb': 150.0, 'rss_mb': 100.0},
+                                   'more resident': {'best_seconds': 1.0, 'peak_mb': 100.0, 'rss_mb': 150.0},
+                                   'tiny': {'best_seconds': 1.0, 'peak_mb': 0.5, 'rss_mb': 0.5}})
+    comparison = db_benchmark.compare_results(baseline, current).set_index('case')
+    assert comparison['regression'].to_dict() == {'same': False, 'slower': True, 'more allocated': True, 'more resident': True, 'tiny': False}
+    assert comparison.loc['more resident', 'rss_ratio'] == 1.5
+    assert not db_benchmark.compare_results(baseline, current, memory_tolerance=1.0).loc[lambda df: df['case'] != 'slower', 'regression'].any()
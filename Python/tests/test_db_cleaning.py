@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy as db
+import yaml
+import db_cleaning
+import db_utils
+
+
+def test_refit_drops_medians_of_absent_groups():
+    transformer = db_cleaning.DataFrameTransform()
+    first = pd.DataFrame({'administrative': [1, 1, 2, 2], 'administrative_duration': [10.0, np.nan, 20.0, np.nan]})
+    transformer.impute_numerical_pairs(first, [['administrative', 'administrative_duration']])
+    assert transformer.params['impute_numerical']['administrative_duration']['medians'] == {1: 10.0, 2: 20.0}
+    second = pd.DataFrame({'administrative': [3, 3], 'administrative_duration': [30.0, np.nan]})
+    transformer.impute_numerical_pairs(second, [['administrative', 'administrative_duration']])
+    assert transformer.params['impute_numerical']['administrative_duration']['medians'] == {3: 30.0}
+    third = pd.DataFrame({'administrative': [4], 'administrative_duration': [40.0]})
+    transformer.impute_numerical_pairs(third, [['administrative', 'administrative_duration']])
+    assert transformer.params['impute_numerical']['administrative_duration']['medians'] == {}
+
+
+def test_load_params_saved_without_newer_groups(tmp_path):
+    file = tmp_path / 'cleaning_params.yaml'
+    file.write_text(yaml.safe_dump({'impute_categorical': {'administrative': 0}, 'impute_numerical': {}, 'skewness': {}}))
+    transformer = db_cleaning.DataFrameTransform()
+    transformer.load_params(str(file))
+    assert transformer.params['impute_categorical'] == {'administrative': 0}
+    assert transformer.params['outliers'] == {}
+    assert transformer.params['selection'] == {}
+
+
+def test_collect_chunks_keeps_vocabulary_order():
+    connector = db_utils.RDSDatabaseConnector()
+    chunks = [connector.encode_session_columns(pd.DataFrame({'month': ['Dec', 'Feb']})),
+              connector.encode_session_columns(pd.DataFrame({'month': ['Jan', 'Smarch']}))]
+    df = db_cleaning.DataFrameTransform().collect_chunks(chunks, ['month'])
+    assert list(df['month'].cat.categories) == db_utils.SESSION_VOCABULARIES['month'] + ['Smarch']
+    assert df['month'].tolist() == ['Dec', 'Feb', 'Jan', 'Smarch']
+
+
+def test_collect_chunks_of_empty_table(tmp_path):
+    engine = db.create_engine(f'sqlite:///{tmp_path / "sessions.db"}')
+    pd.DataFrame({'month': pd.Series(dtype=str), 'page_values': pd.Series(dtype=float)}).to_sql('customer_activity', engine, index=False)
+    chunks = db_utils.RDSDatabaseConnector().read_rds_data_chunks(engine, 'customer_activity', 100)
+    df = db_cleaning.DataFrameTransform().collect_chunks(chunks, ['month'])
+    assert list(df.columns) == ['month', 'page_values']
+    assert len(df) == 0 and df['month'].dtype == 'category'
+    with pytest.raises(ValueError, match='empty'):
+        db_cleaning.DataFrameTransform().collect_chunks(iter([]), ['month'])
+
+
+def sequential_cleaning(df: pd.DataFrame) -> pd.DataFrame:
+    # The DataFrameTransform calls data_extraction_and_cleaning.py made one after another before CleaningPipeline
+    transformer = db_cleaning.DataFrameTransform()
+    for column in ['administrative', 'product_related']:
+        df = transformer.impute_categorical(df, column)
+    for column1, column2 in [['administrative', 'administrative_duration'], ['informational', 'informational_duration'],
+                             ['product_related', 'product_related_duration']]:
+        df = transformer.impute_numerical(df, column1, column2)
+    df = transformer.drop_null(df, 'operating_systems')
+    df = transformer.drop_null(df, 'product_related_duration')
+    df = transformer.format_cleaning(df)
+    df = transformer.region_cleaning(df)
+    df = transformer.product_related_outliers_transformation(df, df['product_related_duration'] < 20000)
+    transformer.skewness_log_transformation(df, 'administrative_duration', 'transformed_administrative_duration')
+    transformer.skewness_log_transformation(df, 'informational_duration', 'transformed_informational_duration')
+    transformer.skewness_boxcox_transformation(df, 'product_related_duration', 'transformed_product_related_duration', 0.01)
+    transformer.skewness_boxcox_transformation(df, 'bounce_rates', 'transformed_bounce_rates', 1e-10)
+    transformer.skewness_boxcox_transformation(df, 'exit_rates', 'transformed_exit_rates', 1e-10)
+    transformer.skewness_log_transformation(df, 'page_values', 'transformed_page_values')
+    df = df.drop(['bounce_rates', 'transformed_bounce_rates'], axis=1)
+    return df[[column for column in db_cleaning.COLUMN_ORDER if column not in ['bounce_rates', 'transformed_bounce_rates']]]
+
+
+def test_pipeline_matches_sequential_cleaning(customer_data):
+    expected = sequential_cleaning(customer_data.copy())
+    pipeline = db_cleaning.CleaningPipeline(db_cleaning.cleaning_steps())
+    pd.testing.assert_frame_equal(pipeline.run(customer_data.copy()), expected)
+    pd.testing.assert_frame_equal(pipeline.run(customer_data.copy(), fit=False), expected)
+
+
+@pytest.mark.parametrize('steps, passes', [(db_cleaning.NULL_STEPS, 2), ([('drop_null', {'column': 'operating_systems'})], 1)])
+def test_out_of_core_fit_leaves_no_stream_open(customer_data, steps, passes):
+    opened, finished = [], []
+
+    def chunks():
+        opened.append(1)
+        try:
+            for start in range(0, len(customer_data), 1000):
+                yield customer_data.iloc[start:start + 1000].copy()
+        finally:
+            finished.append(1)
+
+    db_cleaning.OutOfCoreCleaner(db_cleaning.CleaningPipeline(steps)).fit(chunks)
+    assert len(opened) == len(finished) == passes # The first pass reuses the stream the columns were read from
+
+
+def test_partition_executor_matches_serial_cleaning(customer_data):
+    rows = np.random.default_rng(0).random(len(customer_data))
+    customer_data.loc[rows < 0.05, 'browser'] = np.nan # Null categories in columns which are not dropped
+    customer_data.loc[rows > 0.97, 'visitor_type'] = np.nan
+    pipeline = db_cleaning.CleaningPipeline(db_cleaning.cleaning_steps())
+    pipeline.run(customer_data.copy())
+    expected = pipeline.run(customer_data.copy(), fit=False)
+    cleaned = db_cleaning.PartitionExecutor(n_workers=2, n_partitions=3).run(pipeline, customer_data.copy())
+    assert expected['browser'].isna().any()
+    pd.testing.assert_frame_equal(cleaned, expected)
+
+
+def test_selector_matches_scipy_search(customer_data):
+    from scipy import stats
+    df = db_cleaning.CleaningPipeline(db_cleaning.NULL_STEPS + db_cleaning.OUTLIER_STEPS).run(customer_data)
+    columns = [args['column1'] for _, args in db_cleaning.SKEWNESS_STEPS]
+    numeric = df.select_dtypes(include=['number']).columns.tolist()
+    selector = db_cleaning.TransformSelector()
+    selection = selector.fit(df, columns, numeric, 'revenue')
+    chunked = db_cleaning.TransformSelector().fit(lambda: (df.iloc[start:start + 2500] for start in range(0, len(df), 2500)),
+                                                  columns, numeric, 'revenue')
+    assert chunked['drop'] == selection['drop'] == ['bounce_rates'] # As chosen by hand in COLLINEARITY_STEPS
+    for column in columns:
+        values = df[column].to_numpy(dtype=float)
+        candidates = {('log', 1.0): stats.skew(np.log1p(values), bias=False),
+                      ('yeojohnson', 0.0): stats.skew(stats.yeojohnson(values)[0], bias=False)}
+        candidates.update({('boxcox', constant): stats.skew(stats.boxcox(values + constant)[0], bias=False) for constant in selector.boxcox_constants})
+        best = min(candidates, key=lambda candidate: abs(candidates[candidate]))
+        choice = selection['skewness'][column]
+        assert (choice['method'], choice['constant']) == best
+        assert choice['skew'] == pytest.approx(candidates[best], abs=0.01) # Lambdas come from a grid, within 3e-3 of scipy's here
+        if choice['method'] != 'log':
+            fitted = stats.yeojohnson(values)[1] if choice['method'] == 'yeojohnson' else stats.boxcox(values + choice['constant'])[1]
+            assert choice['lambda'] == pytest.approx(fitted, abs=3e-3)
+        assert (chunked['skewness'][column]['method'], chunked['skewness'][column]['constant']) == best
+        assert chunked['skewness'][column]['skew'] == pytest.approx(choice['skew'], abs=1e-6)
+    steps = selector.skewness_steps() + selector.collinearity_steps()
+    assert ('drop_columns', {'columns': ['bounce_rates', 'transformed_bounce_rates']}) in steps
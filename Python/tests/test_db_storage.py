@@ -0,0 +1,34 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+import db_storage
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'arrow'])
+def test_failed_write_keeps_previous_store(tmp_path, monkeypatch, file_format):
+    store = db_storage.get_store(file_format)
+    path = str(tmp_path / 'store')
+    store.write(pd.DataFrame({'page_values': [1.0, 2.0]}), path)
+
+    def failing(*args, **kwargs):
+        raise pa.ArrowIOError('disk full')
+
+    monkeypatch.setattr(db_storage.ds, 'write_dataset', failing)
+    with pytest.raises(pa.ArrowIOError):
+        store.write(pd.DataFrame({'page_values': [3.0]}), path)
+    monkeypatch.undo()
+    assert store.read(path)['page_values'].tolist() == [1.0, 2.0]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['store']
+    store.write(pd.DataFrame({'page_values': [3.0]}), path)
+    assert store.read(path)['page_values'].tolist() == [3.0]
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'arrow'])
+def test_max_over_appended_files(tmp_path, monkeypatch, file_format):
+    store = db_storage.get_store(file_format)
+    path = str(tmp_path / 'store')
+    for values in [[3.0, None], [None], [7.0, 1.0], [5.0]]:
+        store.append(pd.DataFrame({'page_values': values}, dtype=float), path)
+    if file_format == 'parquet': # Answered from the statistics without reading the column
+        monkeypatch.setattr(db_storage.pc, 'max', None)
+    assert store.max(path, 'page_values') == 7.0
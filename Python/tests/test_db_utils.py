@@ -0,0 +1,241 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy as db
+import db_sketches
+import db_storage
+import db_utils
+
+
+def sessions_table(tmp_path, keys) -> db.engine.Engine:
+    engine = db.create_engine(f'sqlite:///{tmp_path / "sessions.db"}')
+    df = pd.DataFrame({'session_id': keys, 'page_values': np.arange(len(keys), dtype=float),
+                       'region': ['Asia', 'Oceania'] * (len(keys) // 2) + ['Asia'] * (len(keys) % 2)})
+    df.to_sql('customer_activity', engine, index=False)
+    return engine
+
+
+@pytest.mark.parametrize('fail_in', ['append', 'write_watermark'])
+def test_incremental_read_retried_after_interruption(tmp_path, monkeypatch, fail_in):
+    engine = sessions_table(tmp_path, np.arange(1000))
+    connector = db_utils.RDSDatabaseConnector()
+    state_file, store_path = str(tmp_path / 'state.yaml'), str(tmp_path / 'store')
+    owner = db_storage.ParquetStore if fail_in == 'append' else db_utils.RDSDatabaseConnector
+    original = getattr(owner, fail_in)
+    calls = []
+
+    def interrupted(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(owner, fail_in, interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        connector.read_rds_data_incremental(engine, 'customer_activity', 'session_id', state_file, store_path, chunksize=100)
+    monkeypatch.setattr(owner, fail_in, original)
+    connector.read_rds_data_incremental(engine, 'customer_activity', 'session_id', state_file, store_path, chunksize=100)
+    stored = db_storage.ParquetStore().read(store_path, columns=['session_id'])['session_id']
+    assert len(stored) == 1000
+    assert stored.nunique() == 1000
+    assert connector.read_watermark(state_file, 'customer_activity') == 999
+    assert connector.read_rds_data_incremental(engine, 'customer_activity', 'session_id', state_file, store_path) == 0
+
+
+def test_incremental_read_keeps_rows_tied_on_a_timestamp(tmp_path, monkeypatch):
+    engine = db.create_engine(f'sqlite:///{tmp_path / "sessions.db"}')
+    loaded_at = pd.Timestamp('2024-01-01') + pd.to_timedelta(np.arange(300) // 7, unit='min') # 7 rows per timestamp
+    pd.DataFrame({'session_id': np.arange(300), 'loaded_at': loaded_at}).to_sql('customer_activity', engine, index=False)
+    connector = db_utils.RDSDatabaseConnector()
+    state_file, store_path = str(tmp_path / 'state.yaml'), str(tmp_path / 'store')
+    original = db_storage.ParquetStore.append
+    calls = []
+
+    def interrupted(*args, **kwargs):
+        calls.append(1)
+        original(*args, **kwargs)
+        if len(calls) == 2: # Stored, but the watermark was not written
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(db_storage.ParquetStore, 'append', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        connector.read_rds_data_incremental(engine, 'customer_activity', 'loaded_at', state_file, store_path, 50, 'session_id')
+    monkeypatch.setattr(db_storage.ParquetStore, 'append', original)
+    assert connector.read_rds_data_incremental(engine, 'customer_activity', 'loaded_at', state_file, store_path, 50, 'session_id') == 200
+    late = pd.DataFrame({'session_id': [300, 301], 'loaded_at': [loaded_at[-1], loaded_at[-1] + pd.Timedelta(minutes=1)]})
+    late.to_sql('customer_activity', engine, index=False, if_exists='append')
+    assert connector.read_rds_data_incremental(engine, 'customer_activity', 'loaded_at', state_file, store_path, 50, 'session_id') == 2
+    stored = db_storage.ParquetStore().read(store_path, columns=['session_id'])['session_id']
+    assert sorted(stored) == list(range(302))
+
+
+
+@pytest.mark.parametrize('mode', ['hash', 'range'])
+def test_partitions_cover_every_row(tmp_path, mode):
+    keys = np.random.default_rng(0).permutation(np.arange(-500, 500))
+    engine = sessions_table(tmp_path, keys)
+    connector = db_utils.RDSDatabaseConnector()
+    queries = connector.partition_queries(engine, 'customer_activity', 'session_id', 4, mode)
+    with engine.connect() as conn:
+        counts = [len(pd.read_sql(query, conn)) for query in queries]
+    assert sum(counts) == len(keys)
+    df = connector.read_rds_data_parallel(engine, 'customer_activity', 'session_id', 4, 2, mode)
+    assert sorted(df['session_id']) == sorted(keys)
+
+
+def test_stream_to_feather_round_trip(tmp_path):
+    connector = db_utils.RDSDatabaseConnector()
+    chunks = [pd.DataFrame({'region': pd.Categorical(['Asia', 'Oceania'], categories=['Asia', 'Oceania']), 'page_values': [1.0, 2.0]}),
+              pd.DataFrame({'region': pd.Categorical(['Mars', 'Asia'], categories=['Asia', 'Mars', 'Oceania']), 'page_values': [3.0, 4.0]})]
+    file = str(tmp_path / 'sessions.arrow')
+    passed = list(connector.stream_to_feather(iter(chunks), file))
+    assert passed[1] is chunks[1]
+    df = connector.load_mapped_data(file)
+    assert df['region'].tolist() == ['Asia', 'Oceania', 'Mars', 'Asia']
+    assert list(df['region'].cat.categories) == ['Asia', 'Oceania', 'Mars']
+    assert df['page_values'].tolist() == [1.0, 2.0, 3.0, 4.0]
+
+
+def test_interrupted_stream_to_feather_keeps_previous_file(tmp_path):
+    connector = db_utils.RDSDatabaseConnector()
+    file = str(tmp_path / 'sessions.arrow')
+    connector.df_to_feather(pd.DataFrame({'page_values': [1.0]}), file)
+
+    def chunks():
+        yield pd.DataFrame({'page_values': [2.0]})
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        list(connector.stream_to_feather(chunks(), file))
+    assert connector.load_mapped_data(file)['page_values'].tolist() == [1.0]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['sessions.arrow']
+
+
+def test_unknown_values_keep_their_code_across_chunks():
+    connector = db_utils.RDSDatabaseConnector()
+    first = connector.encode_session_columns(pd.DataFrame({'region': ['Asia', 'Mars', 'Venus']}))
+    second = connector.encode_session_columns(pd.DataFrame({'region': ['Jupiter', 'Venus', 'Asia']}))
+    vocabulary = db_utils.SESSION_VOCABULARIES['region']
+    assert list(first['region'].cat.categories) == vocabulary + ['Mars', 'Venus']
+    assert list(second['region'].cat.categories) == vocabulary + ['Mars', 'Venus', 'Jupiter']
+    assert first['region'].cat.codes[2] == second['region'].cat.codes[1]
+    assert 'Mars' not in db_utils.SESSION_VOCABULARIES['region']
+
+
+def test_report_sections_and_backend(tmp_path):
+    import matplotlib
+    import matplotlib.pyplot as plt
+    df = pd.DataFrame({'page_values': np.random.default_rng(0).exponential(size=200)})
+    backend = matplotlib.get_backend()
+    plt.switch_backend('svg')
+    try:
+        renderer = db_utils.ReportRenderer(str(tmp_path), n_workers=1)
+        assert renderer.render(df, []) == []
+        outliers = renderer.render(df, [('plotter', 'var_distribution', ('page_values',))], 'outliers')
+        skewness = renderer.render(df, [('plotter', 'var_distribution', ('page_values',))], 'skewness')
+        assert [os.path.basename(path) for path in outliers + skewness] == ['outliers-distribution-page_values.png',
+                                                                            'skewness-distribution-page_values.png']
+        with pytest.raises(ValueError):
+            renderer.render(df, [('plotter', 'var_distribution', ('page_values',))] * 2)
+        db_utils.DataFrameInfo(str(tmp_path))
+        assert matplotlib.get_backend() == 'svg'
+    finally:
+        plt.switch_backend(backend)
+
+
+@pytest.mark.parametrize('values', [np.random.default_rng(0).normal(size=5000),
+                                    np.concatenate([np.zeros(3000), np.random.default_rng(1).lognormal(3, 1.5, 2000)]),
+                                    np.random.default_rng(2).integers(0, 20, 4000).astype(float)])
+def test_kde_matches_scipy(values):
+    from scipy.stats import gaussian_kde
+    grid, density = db_utils.DistributionCache().kde(values)
+    exact = gaussian_kde(values)(grid)
+    assert np.abs(density - exact).max() <= 1e-4 * exact.max()
+
+
+def test_column_hashed_once_per_array(monkeypatch):
+    cache = db_utils.DistributionCache()
+    df = pd.DataFrame({'page_values': np.arange(1000, dtype=float), 'exit_rates': np.linspace(0, 1, 1000)})
+    first = cache.get(df, 'page_values')
+    hashes = []
+    original = db_utils.hashlib.blake2b
+    monkeypatch.setattr(db_utils.hashlib, 'blake2b', lambda data, **kwargs: hashes.append(len(data)) or original(data, **kwargs))
+    assert cache.get(df, 'page_values') is first
+    assert max(hashes) < 1000 # Only the short key is hashed, not the column
+    df['page_values'] = df['page_values'] * 2
+    assert cache.get(df, 'page_values')['edges'][-1] == 2 * first['edges'][-1]
+
+
+@pytest.mark.parametrize('null_fraction, tolerance', [(0, 1e-12), (0.05, 1e-3)])
+def test_spearman_correlations_match_pandas(null_fraction, tolerance):
+    rng = np.random.default_rng(0)
+    base = rng.lognormal(size=5000)
+    df = pd.DataFrame({'administrative_duration': base * rng.lognormal(size=5000), 'product_related_duration': base + rng.normal(size=5000),
+                       'page_values': rng.integers(0, 10, 5000).astype(float)})
+    for column in df:
+        df.loc[rng.random(len(df)) < null_fraction, column] = np.nan
+    correlations = db_utils.Plotter().correlations(df, 'spearman').correlation()
+    assert np.abs(np.asarray(correlations) - df.corr(method='spearman').to_numpy()).max() <= tolerance
+
+
+def test_profile_matches_pandas(customer_data):
+    profile = db_utils.DataFrameInfo().profile(customer_data)
+    numeric = customer_data.select_dtypes(include=['number'])
+    assert profile.numeric_columns() == numeric.columns.tolist()
+    pd.testing.assert_frame_equal(profile.describe(), numeric.describe().astype(float))
+    statistics = profile.statistics
+    for column in numeric.columns:
+        values = numeric[column].astype(float)
+        assert statistics.loc[column, 'skew'] == pytest.approx(values.skew(), rel=1e-9)
+        assert statistics.loc[column, 'kurtosis'] == pytest.approx(values.kurt(), rel=1e-9)
+        assert statistics.loc[column, 'unique'] == values.nunique()
+    pd.testing.assert_series_equal(profile.null_percent(), customer_data.isna().mean() * 100)
+    for column in ['month', 'browser', 'visitor_type']:
+        counts = customer_data[column].value_counts()
+        assert statistics.loc[column, 'unique'] == (counts > 0).sum()
+        assert statistics.loc[column, 'top'] == counts.index[0]
+        pd.testing.assert_series_equal(profile.value_counts[column], counts)
+
+
+def test_merged_sketches_match_pandas(tmp_path, customer_data):
+    info = db_utils.DataFrameInfo()
+    sketches = {}
+    for start in range(0, len(customer_data), 3000): # Partitions sketched separately, saved and merged
+        file = str(tmp_path / f'sketches-{start}.pkl')
+        db_sketches.save_sketches(info.sketch(customer_data.iloc[start:start + 3000]), file)
+        sketches = info.merge_sketches(sketches, db_sketches.load_sketches(file))
+    statistics = info.sketch_profile(sketches).statistics
+    exact = info.profile(customer_data).statistics
+    for column in exact.index:
+        assert statistics.loc[column, 'count'] == exact.loc[column, 'count']
+        assert statistics.loc[column, 'nulls'] == exact.loc[column, 'nulls']
+    for column in customer_data.select_dtypes(include=['number']).columns:
+        values = customer_data[column].dropna().astype(float).sort_values().to_numpy()
+        for statistic in ['mean', 'std', 'min', 'max', 'skew', 'kurtosis']:
+            assert statistics.loc[column, statistic] == pytest.approx(exact.loc[column, statistic], rel=1e-9, abs=1e-12)
+        rank_error = 4 * 2 / 8192 # Quantiles are approximate once a column has more than k values, with a rank error of about 2/k
+        for q in [0.25, 0.5, 0.75]:
+            value = statistics.loc[column, f'{q:.0%}']
+            low, high = np.searchsorted(values, value, 'left') / len(values), np.searchsorted(values, value, 'right') / len(values)
+            assert low - rank_error <= q <= high + rank_error
+        assert statistics.loc[column, 'unique'] == pytest.approx(len(np.unique(values)), rel=0.03, abs=1)
+    for column in ['month', 'browser', 'region', 'visitor_type']:
+        counts = customer_data[column].value_counts()
+        assert statistics.loc[column, 'top'] == counts.index[0]
+        assert statistics.loc[column, 'freq'] == counts.iloc[0]
+        assert statistics.loc[column, 'unique'] == (counts > 0).sum()
+
+
+def test_spearman_chunks_need_quantile_sketches(customer_data):
+    plotter, info = db_utils.Plotter(), db_utils.DataFrameInfo()
+    first, second = customer_data.iloc[:6000], customer_data.iloc[6000:]
+    correlations = plotter.correlations(first, 'spearman')
+    with pytest.raises(ValueError, match='quantiles'):
+        plotter.correlations(second, 'spearman', correlations)
+    sketches = info.sketch(customer_data)
+    quantiles = {column: sketch.quantiles for column, sketch in sketches.items() if sketch.numeric}
+    correlations = plotter.correlations(first, 'spearman', quantiles=quantiles)
+    correlations = plotter.correlations(second, 'spearman', correlations)
+    whole = plotter.correlations(customer_data, 'spearman', quantiles=quantiles)
+    np.testing.assert_allclose(np.asarray(correlations.correlation()), np.asarray(whole.correlation()), atol=1e-12)